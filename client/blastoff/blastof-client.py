@@ -12,6 +12,7 @@ import pyros.gccui
 import pyros.agent
 import pyros.pygamehelper
 import pygame
+import statuslib
 import sys
 import time
 
@@ -59,9 +60,9 @@ class BlastoffClient:
         pyros.subscribe("blastoff/feedback/action", self.handleAction)
         pyros.subscribe("blastoff/feedback/running", self.handleRunning)
 
-        pyros.subscribe("wheel/speed/status", self.rover.handleOdo)
-        pyros.subscribe("wheel/deg/status", self.rover.handleWheelOrientation)
-        pyros.subscribe("sensor/distance", self.rover.handleRadar)
+        statuslib.subscribe(statuslib.WHEEL_SPEED_TOPIC, self.rover.handleOdo)
+        statuslib.subscribe(statuslib.WHEEL_DEG_TOPIC, self.rover.handleWheelOrientation)
+        statuslib.subscribe(statuslib.RADAR_TOPIC, self.rover.handleRadar)
         pyros.subscribeBinary("sensor/heading/data", self.rover.handleHeading)
 
     @staticmethod
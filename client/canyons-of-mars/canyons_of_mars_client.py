@@ -13,6 +13,7 @@ import pyros.gcc
 import pyros.gccui
 import pyros.agent
 import pyros.pygamehelper
+import statuslib
 import sys
 import time
 
@@ -218,9 +219,9 @@ def onKeyUp(key):
 
 pyros.init("canyons-of-mars-#", unique=True, onConnected=connected, host=pyros.gcc.getHost(), port=pyros.gcc.getPort(), waitToConnect=False)
 
-pyros.subscribe("wheel/speed/status", canyonsOfMars.rover.handleOdo)
-pyros.subscribe("wheel/deg/status", canyonsOfMars.rover.handleWheelOrientation)
-pyros.subscribe("sensor/distance", canyonsOfMars.rover.handleRadar)
+statuslib.subscribe(statuslib.WHEEL_SPEED_TOPIC, canyonsOfMars.rover.handleOdo)
+statuslib.subscribe(statuslib.WHEEL_DEG_TOPIC, canyonsOfMars.rover.handleWheelOrientation)
+statuslib.subscribe(statuslib.RADAR_TOPIC, canyonsOfMars.rover.handleRadar)
 pyros.subscribeBinary("sensor/heading/data", canyonsOfMars.rover.handleHeading)
 
 pyros.subscribe("canyons/feedback/action", canyonsOfMars.handleAction)
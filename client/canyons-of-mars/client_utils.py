@@ -23,7 +23,6 @@ class TelemetryUtil:
     def __init__(self, topic="telemetry"):
         self.client = PyrosTelemetryClient(pyros.publish, pyros.subscribeBinary, topic=topic)
         self.stream = None
-        self.step = 10  # 15 seconds a time
         self.finished_downloading = False
         self.timestamp = None
         self.recordCallback = None
@@ -45,24 +44,22 @@ class TelemetryUtil:
             print("Telemetry: The oldest timestamp is " + str(oldest_timestamp) + " (it is " + str(time.time() - oldest_timestamp) + "s ago) and there are " + str(records_count) + " records.")
 
         if records_count > 0:
-            self.client.retrieve(self.stream, self.timestamp, self.timestamp + self.step, self.processData)
-
-    def processData(self, records):
-        self.timestamp += self.step
+            self.client.retrieveChunks(self.stream, self.timestamp, time.time(), self.processData, error_callback=self.processError)
+        else:
+            self.finished_downloading = True
 
+    def processData(self, records, last):
         for record in records:
             if self.recordCallback is not None:
                 self.recordCallback(record)
 
-        if self.timestamp > time.time() or len(records) == 0:
+        if last:
             self.client.trim(self.stream, time.time())
-
             self.finished_downloading = True
-            return
-
-        self.client.trim(self.stream, self.timestamp)
 
-        self.client.retrieve(self.stream, self.timestamp, self.timestamp + self.step, self.processData)
+    def processError(self, message):
+        self.error = message
+        self.finished_downloading = True
 
     def fetchData(self, stream_name, recordCallback):
         self.stream = None
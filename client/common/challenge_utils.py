@@ -7,6 +7,7 @@
 
 import pyroslib
 import pyroslib.logging
+import statuslib
 import telemetry
 import time
 
@@ -189,9 +190,9 @@ class AgentClass:
 
     def connected(self):
         pyroslib.subscribe(self.prefix + "/command", self.handleAgentCommands)
-        pyroslib.subscribe("wheel/speed/status", self.rover.handleOdo)
-        pyroslib.subscribe("wheel/deg/status", self.rover.handleWheelOrientation)
-        pyroslib.subscribe("sensor/distance", self.rover.handleRadar)
+        statuslib.subscribe(statuslib.WHEEL_SPEED_TOPIC, self.rover.handleOdo)
+        statuslib.subscribe(statuslib.WHEEL_DEG_TOPIC, self.rover.handleWheelOrientation)
+        statuslib.subscribe(statuslib.RADAR_TOPIC, self.rover.handleRadar)
         pyroslib.subscribeBinary("sensor/heading/data", self.rover.handleHeading)
 
         pyroslib.publish(self.prefix + "/feedback/action", self.current_action.getActionName())
@@ -6,6 +6,7 @@
 #
 
 import math
+import statuslib
 import time
 import struct
 
@@ -396,7 +397,7 @@ class RoverState:
         last_heading_time = data[57]
         last_heading = data[58]
         prev_heading = Heading(last_heading_time, last_heading, 0)
-        self.heading = Heading(heading_time, heading_value, prev_heading)
+        self.heading = Heading(heading_time, heading_value, heading_status, prev_heading)
 
         cmd_time = data[59]
         cmd_speed = data[60]
@@ -504,6 +505,41 @@ class RoverState:
         return self.hasWheelOdos() and self.hasWheelOrientation() and self.hasHeading() and self.hasRadar()
 
 
+class RoverStateReplay:
+    # Turns rover state records (see RoverState.log) back to messages Rover handlers got when state was
+    # recorded, for telemetry_replay. Message is produced only when its time changed since previous record.
+    HEADING_TOPIC = "sensor/heading/data"
+
+    def __init__(self):
+        self.odos_time = None
+        self.orientations_time = None
+        self.radar_time = None
+        self.heading_time = None
+
+    # record is as from stream.unpackRecord - log timestamp followed by values in RoverState.log order
+    def messages(self, record):
+        result = []
+        if record[1] != self.odos_time:
+            self.odos_time = record[1]
+            result.append((statuslib.WHEEL_SPEED_TOPIC, statuslib.encodeWheelStatusText(record[1], record[2:6], record[6:10])))
+
+        if record[15] != self.orientations_time:
+            self.orientations_time = record[15]
+            result.append((statuslib.WHEEL_DEG_TOPIC, statuslib.encodeWheelStatusText(record[15], record[16:20], record[20:24])))
+
+        if record[29] != self.radar_time:
+            self.radar_time = record[29]
+            distances = dict(zip(RADAR_ANGLES, record[30:38]))
+            statuses = dict(zip(RADAR_ANGLES, record[38:46]))
+            result.append((statuslib.RADAR_TOPIC, statuslib.encodeRadarText(record[29], distances, statuses)))
+
+        if record[55] != self.heading_time:
+            self.heading_time = record[55]
+            result.append((self.HEADING_TOPIC, struct.pack('>fffBf', 0.0, 0.0, record[56], record[57], record[55])))
+
+        return result
+
+
 class Rover:
     def __init__(self):
         self.wheel_odos = None
@@ -537,61 +573,49 @@ class Rover:
         self.heading = Heading(heading_time, normaiseAngle(new_heading - self.start_heading_value), heading_status, self.heading)
 
     def handleRadar(self, topic, message, groups):
-        values = [v.split(":") for v in message.split(" ")]
-        radar_values = {}
-        radar_status = {}
-        radar_time = None
-        for (k, v) in values:
-            if k == 'timestamp':
-                radar_time = float(v)
-            elif k == 'status':
-                i = 0
-                for angle in RADAR_ANGLES:
-                    radar_status[angle] = int(v[i:i+2], 16)
-                    i += 2
-            else:
-                radar_values[int(k)] = int(v)
+        radar_time, radar_values, radar_status = statuslib.decodeRadar(message)
 
         self.radar = Radar(radar_time, radar_values, radar_status, self.radar)
 
     def handleOdo(self, topic, message, groups):
-        data = message.split(",")
-
-        odo_time = float(data[0])
+        odo_time, data, odos_status = statuslib.decodeWheelStatus(message)
 
         odos = {}
-        odos_status = {}
 
-        for i in range(4):
-            data_index = i * 2
-            if data[data_index + 2] == "0":
-                odos[WHEEL_NAMES[i]] = int(data[data_index + 1])
+        for wheel_name in WHEEL_NAMES:
+            if odos_status[wheel_name] == 0 and data[wheel_name] is not None:
+                odos[wheel_name] = data[wheel_name]
             elif self.wheel_odos is not None:
-                odos[WHEEL_NAMES[i]] = self.wheel_odos.odos[WHEEL_NAMES[i]]  # TODO handle wrong values!
+                odos[wheel_name] = self.wheel_odos.odos[wheel_name]  # TODO handle wrong values!
             else:
-                odos[WHEEL_NAMES[i]] = -1  # TODO handle wrong values!
-            odos_status[WHEEL_NAMES[i]] = int(data[data_index + 2])
+                odos[wheel_name] = -1  # TODO handle wrong values!
 
         self.wheel_odos = WheelOdos(odo_time, odos, odos_status, self.wheel_odos)
 
     def handleWheelOrientation(self, topic, message, group):
-        data = message.split(",")
-
-        wheel_orientations_time = float(data[0])
+        wheel_orientations_time, data, wheel_status = statuslib.decodeWheelStatus(message)
 
         wheel_orientations = {}
-        wheel_status = {}
 
-        for i in range(4):
-            data_index = i * 2
-            if data[data_index + 2] == "32":
-                wheel_orientations[WHEEL_NAMES[i]] = int(data[data_index + 1])
+        for wheel_name in WHEEL_NAMES:
+            if data[wheel_name] is not None:
+                wheel_orientations[wheel_name] = data[wheel_name]
+            elif self.wheel_orientations is not None:
+                wheel_orientations[wheel_name] = self.wheel_orientations.orientations[wheel_name]  # TODO handle wrong values!
             else:
-                wheel_orientations[WHEEL_NAMES[i]] = int(data[data_index + 1])  # -1  # TODO handle wrong values!
-            wheel_status[WHEEL_NAMES[i]] = int(data[data_index + 2])
+                wheel_orientations[wheel_name] = 0  # TODO handle wrong values!
 
         self.wheel_orientations = WheelOrientations(wheel_orientations_time, wheel_orientations, wheel_status, self.wheel_orientations)
 
+    # Handlers by topic they are subscribed to, for replaying recorded messages directly into them
+    def handlers(self):
+        return {
+            statuslib.WHEEL_SPEED_TOPIC: self.handleOdo,
+            statuslib.WHEEL_DEG_TOPIC: self.handleWheelOrientation,
+            statuslib.RADAR_TOPIC: self.handleRadar,
+            RoverStateReplay.HEADING_TOPIC: self.handleHeading
+        }
+
     def hasHeading(self):
         return self.start_heading_value is not None
 
@@ -12,6 +12,7 @@ import pyros.gccui
 import pyros.agent
 import pyros.pygamehelper
 import pygame
+import statuslib
 import sys
 import time
 
@@ -85,9 +86,9 @@ class NebulaClient:
         pyros.subscribeBinary("camera/camera1/raw", self.handleCamera1Raw)
         pyros.subscribeBinary("camera/camera2/raw", self.handleCamera2Raw)
 
-        pyros.subscribe("wheel/speed/status", self.rover.handleOdo)
-        pyros.subscribe("wheel/deg/status", self.rover.handleWheelOrientation)
-        pyros.subscribe("sensor/distance", self.rover.handleRadar)
+        statuslib.subscribe(statuslib.WHEEL_SPEED_TOPIC, self.rover.handleOdo)
+        statuslib.subscribe(statuslib.WHEEL_DEG_TOPIC, self.rover.handleWheelOrientation)
+        statuslib.subscribe(statuslib.RADAR_TOPIC, self.rover.handleRadar)
         pyros.subscribeBinary("sensor/heading/data", self.rover.handleHeading)
 
         # pyros.subscribe("overtherainbow/distances", handleDistances)
@@ -6,16 +6,22 @@
 # MIT License
 #
 
+import collections
+import hashlib
 import os
-import select
+import selectors
 import sys
 import time
 import subprocess
 import threading
 import traceback
+import zlib
 
 import paho.mqtt.client as mqtt
 
+import pyroslog
+import pyroswarm
+
 
 do_exit = False
 
@@ -29,6 +35,55 @@ AGENT_KILL_TIMEOT = 180
 DEBUG_LEVEL = 1
 
 CODE_DIR_NAME = "code"
+LOG_DIR_NAME = "logs/processes"
+
+#
+# Output of each process is kept in pyroslog.ProcessLog - last lines in memory and all in rotating files
+# in LOG_DIR_NAME. 'logs' command republishes lines in memory to exec/<id>/out (as before);
+# 'logs <requestId> <since> [<regex>]' sends lines logged since given time (negative is seconds before now,
+# '-' is everything kept) which match regex only to exec/<id>/logs/<requestId>/out, as
+# '<timestamp> <line>' lines in frames of LOG_FRAME_SIZE bytes, followed by empty message.
+#
+
+LOG_FRAME_SIZE = 16 * 1024
+
+#
+# Output of all processes is read by one supervisor thread: stdout and stderr pipes of all of them are
+# non blocking and registered with one selector, read in big chunks and split to lines. Lines are
+# collected and sent as one exec/<id>/out message per process every OUTPUT_FLUSH_INTERVAL. Each process
+# can send at most OUTPUT_MAX_LINES_PER_SECOND lines and OUTPUT_MAX_BYTES_PER_SECOND bytes (with burst of
+# one second worth); lines over that are only kept in logs and number of dropped lines is sent instead.
+# Line longer than the byte burst is still sent when allowance is full - it then leaves allowance in debt.
+#
+
+OUTPUT_READ_SIZE = 65536
+OUTPUT_FLUSH_INTERVAL = 0.1
+OUTPUT_MAX_LINES_PER_SECOND = 200
+OUTPUT_MAX_BYTES_PER_SECOND = 16 * 1024
+OUTPUT_RATE_INTERVAL = 2.0
+
+#
+# With PYROS_WARM_POOL set ('1' for pyroswarm.DEFAULT_MODULES or comma separated list of modules) python3
+# processes are forked from warm pool server which has those modules already imported - see pyroswarm.py.
+# Process with 'warm=False' in its .process file is always started with new interpreter.
+#
+
+WARM_POOL_MODULES = None
+
+#
+# Resources used by each running process are sampled from /proc/<pid> every METRICS_INTERVAL: cpu %, rss,
+# number of threads, context switches per second and bytes read from and written to storage per second.
+# Last METRICS_HISTORY samples of each process are kept ('ps -v' shows last and peak values) and each
+# round is published to system/metrics, one line per process:
+#     <id> <time> <cpu%> <rss> <threads> <ctx/s> <read/s> <write/s>
+#
+
+METRICS_INTERVAL = 1.0
+METRICS_HISTORY = 60
+METRICS_TOPIC = "system/metrics"
+
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
 
 host = "localhost"
 port = 1883
@@ -40,6 +95,16 @@ scriptName = None
 
 processes = {}
 
+supervisorSelector = None
+supervisorWakeup = None  # (read fd, write fd) of pipe waking supervisor up to take new processes
+supervisorQueue = []
+supervisorLock = threading.Lock()
+
+processLogs = {}
+processLogsLock = threading.Lock()
+
+warmPool = None
+
 
 def important(line):
     print(line)
@@ -109,7 +174,7 @@ def processCommonHostSwitches(arguments):
 
 
 def processEnv():
-    global host, port, thisClusterId
+    global host, port, thisClusterId, WARM_POOL_MODULES
 
     if 'PYROS_MQTT' in os.environ:
         hostStr = os.environ['PYROS_MQTT']
@@ -130,6 +195,13 @@ def processEnv():
     if 'PYROS_CLUSTER_ID' in os.environ:
         thisClusterId = os.environ['PYROS_CLUSTER_ID']
 
+    if 'PYROS_WARM_POOL' in os.environ:
+        warmPoolStr = os.environ['PYROS_WARM_POOL']
+        if warmPoolStr in ["1", "true", "True", "yes"]:
+            WARM_POOL_MODULES = pyroswarm.DEFAULT_MODULES
+        elif warmPoolStr not in ["", "0", "false", "False", "no"]:
+            WARM_POOL_MODULES = [module.strip() for module in warmPoolStr.split(",") if module.strip() != ""]
+
 
 def complexProcessId(processId):
     if thisClusterId is not None:
@@ -213,17 +285,36 @@ def _output(processId, line):
             trace("exec/" + complexProcessId(processId) + "/out > " + line)
 
 
-def output(processId, line):
-    if "logs" not in processes[processId]:
-        logs = []
-        processes[processId]["logs"] = logs
-    else:
-        logs = processes[processId]["logs"]
+def getProcessLog(processId):
+    with processLogsLock:
+        if processId not in processLogs:
+            processLogs[processId] = pyroslog.ProcessLog(LOG_DIR_NAME, processId)
+        return processLogs[processId]
+
 
-    if len(logs) > 1000:
-        del logs[0]
+def flushLogs():
+    with processLogsLock:
+        logs = list(processLogs.values())
 
-    logs.append(line)
+    for log in logs:
+        try:
+            log.flush()
+        except OSError as exception:
+            important("ERROR: Cannot write log " + log.path + "; " + str(exception))
+
+
+def _log(processId, line):
+    if processId not in processes:
+        return
+
+    try:
+        getProcessLog(processId).append(line)
+    except OSError as exception:
+        important("ERROR: Cannot log output of " + processId + "; " + str(exception))
+
+
+def output(processId, line):
+    _log(processId, line)
     _output(processId, line)
 
 
@@ -286,14 +377,22 @@ def runProcess(processId):
         else:
             command = [exec, "-u", processId, processId]
 
-        process = subprocess.Popen(command,
-                                   env=new_env,
-                                   bufsize=0,
-                                   stdout=subprocess.PIPE,
-                                   stderr=subprocess.PIPE,
-                                   shell=False,
-                                   universal_newlines=True,
-                                   cwd=subprocessDir)
+        process = None
+        if warmPool is not None and exec == "python3" and processDef.get("warm", "True") != "False":
+            process = warmPool.startProcess(command, subprocessDir, new_env)
+            if process is None:
+                info("Warm pool cannot start " + processId + "; starting it with new interpreter")
+            else:
+                debug("Started " + processId + " from warm pool, pid " + str(process.pid))
+
+        if process is None:
+            process = subprocess.Popen(command,
+                                       env=new_env,
+                                       bufsize=0,
+                                       stdout=subprocess.PIPE,
+                                       stderr=subprocess.PIPE,
+                                       shell=False,
+                                       cwd=subprocessDir)
         outputStatus(processId, "PyROS: started process.")
     except Exception as exception:
         important("Start file " + filename + " (" + os.path.abspath(filename) + ") failed; " + str(exception))
@@ -304,30 +403,171 @@ def runProcess(processId):
     if "old" in processes[processId]:
         del processes[processId]["old"]
 
-    process.poll()
+    superviseProcess(processId, process)
+
+
+def superviseProcess(processId, process):
+    with supervisorLock:
+        supervisorQueue.append((processId, process))
+    os.write(supervisorWakeup[1], b'.')
+
+
+def _takeSupervisedProcesses(supervised):
+    with supervisorLock:
+        queued = list(supervisorQueue)
+        del supervisorQueue[:]
+
+    for processId, process in queued:
+        state = {
+            "id": processId,
+            "process": process,
+            "open": 0,
+            "partial": {},
+            "pending": [],
+            "lines_allowance": OUTPUT_MAX_LINES_PER_SECOND,
+            "bytes_allowance": OUTPUT_MAX_BYTES_PER_SECOND,
+            "dropped": 0,  # since last reported
+            "dropped_total": 0,
+            "lines": 0,  # since last rate calculation
+            "bytes": 0
+        }
+        for pipe in [process.stdout, process.stderr]:
+            fd = pipe.fileno()
+            os.set_blocking(fd, False)
+            supervisorSelector.register(fd, selectors.EVENT_READ, state)
+            state["partial"][fd] = b''
+            state["open"] += 1
+        if processId in processes:  # process could have been removed since it was queued
+            processes[processId]["output_rate"] = (0.0, 0.0, 0)
+        supervised.append(state)
+
+
+def _acceptLine(state, line):
+    text = str(line, 'utf-8', 'replace')
+    _log(state["id"], text)
+
+    state["lines"] += 1
+    state["bytes"] += len(line)
+    if state["lines_allowance"] >= 1 and (state["bytes_allowance"] >= len(line) or state["bytes_allowance"] >= OUTPUT_MAX_BYTES_PER_SECOND):
+        state["lines_allowance"] -= 1
+        state["bytes_allowance"] -= len(line)
+        state["pending"].append(text)
+    else:
+        state["dropped"] += 1
+        state["dropped_total"] += 1
+
+
+def _readOutput(fd, state):
+    try:
+        data = os.read(fd, OUTPUT_READ_SIZE)
+    except BlockingIOError:
+        return
+    except OSError:
+        data = b''
+
+    partial = state["partial"][fd]
+    if len(data) == 0:
+        supervisorSelector.unregister(fd)
+        state["open"] -= 1
+        if len(partial) > 0:
+            _acceptLine(state, partial + b'\n')
+        del state["partial"][fd]
+        return
+
+    lines = (partial + data).split(b'\n')
+    partial = lines.pop()
+    for line in lines:
+        _acceptLine(state, line + b'\n')
+    if len(partial) >= OUTPUT_READ_SIZE:  # no new line in sight
+        _acceptLine(state, partial + b'\n')
+        partial = b''
+    state["partial"][fd] = partial
 
-    while process.returncode is None:
-        reads = [process.stdout.fileno(), process.stderr.fileno()]
-        ret = select.select(reads, [], [])
 
-        for fd in ret[0]:
-            if fd == process.stdout.fileno():
-                line = process.stdout.readline()
-                output(processId, line)
-            if fd == process.stderr.fileno():
-                line = process.stderr.readline()
-                output(processId, line)
+def _flushOutput(state, elapsed):
+    if state["dropped"] > 0 and state["lines_allowance"] >= 1:
+        state["pending"].append("PyROS: dropped " + str(state["dropped"]) + " lines of output\n")
+        state["dropped"] = 0
 
-        process.poll()
+    if len(state["pending"]) > 0:
+        _output(state["id"], "".join(state["pending"]))
+        state["pending"] = []
 
-    for line in process.stdout.readlines():
-        if len(line) > 0:
-            output(processId, line)
-    for line in process.stderr.readlines():
-        if len(line) > 0:
-            output(processId, line)
+    state["lines_allowance"] = min(OUTPUT_MAX_LINES_PER_SECOND, state["lines_allowance"] + OUTPUT_MAX_LINES_PER_SECOND * elapsed)
+    state["bytes_allowance"] = min(OUTPUT_MAX_BYTES_PER_SECOND, state["bytes_allowance"] + OUTPUT_MAX_BYTES_PER_SECOND * elapsed)
 
-    outputStatus(processId, "PyROS: exit " + str(process.returncode))
+
+def superviseOutput():
+    supervised = []
+    lastFlush = time.time()
+    lastRate = lastFlush
+    while True:
+        try:
+            for key, _ in supervisorSelector.select(max(0.0, lastFlush + OUTPUT_FLUSH_INTERVAL - time.time())):
+                if key.fd == supervisorWakeup[0]:
+                    os.read(supervisorWakeup[0], OUTPUT_READ_SIZE)
+                    _takeSupervisedProcesses(supervised)
+                else:
+                    _readOutput(key.fd, key.data)
+
+            now = time.time()
+            if now - lastFlush >= OUTPUT_FLUSH_INTERVAL:
+                for state in supervised:
+                    _flushOutput(state, now - lastFlush)
+                flushLogs()
+                lastFlush = now
+
+                if now - lastRate >= OUTPUT_RATE_INTERVAL:
+                    for state in supervised:
+                        processId = state["id"]
+                        if processId in processes and processes[processId].get("process") is state["process"]:
+                            processes[processId]["output_rate"] = (state["lines"] / (now - lastRate), state["bytes"] / (now - lastRate), state["dropped_total"])
+                        state["lines"] = 0
+                        state["bytes"] = 0
+                    lastRate = now
+
+                for state in list(supervised):
+                    process = state["process"]
+                    process.poll()  # keeps returncode up to date for isRunning and stopProcess
+                    if state["open"] == 0 and process.returncode is not None:
+                        _flushOutput(state, 0)
+                        supervised.remove(state)
+                        if state["id"] in processes and processes[state["id"]].get("process") is process:
+                            processes[state["id"]]["output_rate"] = (0.0, 0.0, state["dropped_total"])
+                        process.stdout.close()
+                        process.stderr.close()
+                        outputStatus(state["id"], "PyROS: exit " + str(process.returncode))
+        except Exception as e:
+            important("ERROR: Got exception in output supervisor; " + str(e) + "\n" + ''.join(traceback.format_tb(e.__traceback__)))
+            time.sleep(OUTPUT_FLUSH_INTERVAL)  # not to spin on error which repeats
+
+
+def startOutputSupervisor():
+    global supervisorSelector, supervisorWakeup
+
+    supervisorSelector = selectors.DefaultSelector()
+    supervisorWakeup = os.pipe()
+    os.set_blocking(supervisorWakeup[0], False)
+    supervisorSelector.register(supervisorWakeup[0], selectors.EVENT_READ)
+
+    thread = threading.Thread(target=superviseOutput, daemon=True)
+    thread.start()
+
+
+def startWarmPool():
+    global warmPool
+
+    if WARM_POOL_MODULES is not None:
+        important("Starting warm pool with " + ", ".join(WARM_POOL_MODULES) + "...")
+        os.makedirs(CODE_DIR_NAME, exist_ok=True)
+        pool = pyroswarm.WarmPool(CODE_DIR_NAME, WARM_POOL_MODULES)
+        started = time.time()
+        if pool.start():
+            warmPool = pool
+            important("Started warm pool in " + str(round(time.time() - started, 2)) + "s.")
+        else:
+            pool.stop()
+            important("ERROR: Warm pool did not start; processes will be started with new interpreter.")
 
 
 def getProcessTypeName(processId):
@@ -368,7 +608,42 @@ def _sanitise_filename(processId, filename):
     return filename[remove_len:]
 
 
+#
+# Upload: exec/<id>/manifest lists sha1 and name of each file of the process, one per line. Status
+# 'needs <name> <name> ...' lists files that are missing or different in code/<id>/ and only those are then
+# sent, zlib compressed, to exec/<id>/processz (main file) and exec/<id>/processz/<name>. File which is
+# the same as already stored is not written and 'unchanged <name>' is sent instead of 'stored <name>',
+# so the process is not marked as running old code.
+#
+
+def fileHash(filename):
+    try:
+        with open(filename, "rb") as file:
+            return hashlib.sha1(file.read()).hexdigest()
+    except OSError:
+        return None
+
+
+def checkManifest(processId, payload):
+    needed = []
+    for line in payload.split("\n"):
+        i = line.find(" ")
+        if i > 0:
+            name = line[i + 1:]
+            if fileHash(processDir(processId) + "/" + name) != line[0:i]:
+                needed.append(name)
+
+    outputStatus(processId, " ".join(["needs"] + needed))
+
+
 def storeCode(processId, payload):
+    filename = processFilename(processId)
+    initFilename = processInitFilename(processId)
+
+    if processId in processes and os.path.exists(initFilename) and fileHash(filename) == hashlib.sha1(bytes(payload, 'utf-8')).hexdigest():
+        outputStatus(processId, "unchanged " + _sanitise_filename(processId, filename))
+        return
+
     if processId in processes:
         processes[processId]["old"] = True
 
@@ -383,9 +658,6 @@ def storeCode(processId, payload):
     if "exec" not in processes[processId]:
         processes[processId]["exec"] = "python3"
 
-    filename = processFilename(processId)
-    initFilename = processInitFilename(processId)
-
     try:
         with open(filename, "wt") as textFile:
             textFile.write(payload)
@@ -403,6 +675,10 @@ def storeExtraCode(processId, name, payload):
 
     filename = processDir(processId) + "/" + name
 
+    if fileHash(filename) == hashlib.sha1(payload).hexdigest():
+        outputStatus(processId, "unchanged " + _sanitise_filename(processId, filename))
+        return
+
     filedir = os.path.split(filename)[0]
     print("  making file dir " + str(filedir))
     os.makedirs(filedir, exist_ok=True)
@@ -519,6 +795,11 @@ def removeProcess(processId):
 
         del processes[processId]
 
+        with processLogsLock:
+            if processId in processLogs:
+                processLogs[processId].remove()
+                del processLogs[processId]
+
         output(processId, "PyROS: removed " + getProcessTypeName(processId))
     else:
         output(processId, "PyROS ERROR: process " + processId + " does not exist.")
@@ -526,12 +807,53 @@ def removeProcess(processId):
 
 def readLog(processId):
     if processId in processes:
-        logs = processes[processId]["logs"]
-        if logs is None:
-            logs = []
+        frame = []
+        size = 0
+        for timestamp, line in getProcessLog(processId).tail():
+            frame.append(line + "\n")
+            size += len(line) + 1
+            if size >= LOG_FRAME_SIZE:
+                _output(processId, "".join(frame))
+                frame = []
+                size = 0
+        if len(frame) > 0:
+            _output(processId, "".join(frame))
+
+
+def queryLog(processId, requestId, since, pattern):
+    topic = "exec/" + complexProcessId(processId) + "/logs/" + requestId + "/out"
+    try:
+        if since is not None and since < 0:
+            since = time.time() + since
+
+        frame = []
+        size = 0
+        for timestamp, line in getProcessLog(processId).query(since, pattern):
+            line = "{0:.3f} {1}\n".format(timestamp, line)
+            frame.append(line)
+            size += len(line)
+            if size >= LOG_FRAME_SIZE:
+                client.publish(topic, "".join(frame))
+                frame = []
+                size = 0
+        if len(frame) > 0:
+            client.publish(topic, "".join(frame))
+    except Exception as exception:
+        client.publish(topic, "{0:.3f} PyROS ERROR: cannot read log; {1}\n".format(time.time(), str(exception)))
+    client.publish(topic, "")
 
-        for log in logs:
-            _output(processId, log)
+
+def logsCommand(processId, params):
+    if len(params) < 3:
+        readLog(processId)
+    elif processId in processes:
+        try:
+            since = None if params[2] == "-" else float(params[2])
+        except ValueError:
+            since = None
+        pattern = " ".join(params[3:]) if len(params) > 3 else None
+        thread = threading.Thread(target=queryLog, args=(processId, params[1], since, pattern), daemon=True)
+        thread.start()
 
 
 def makeServiceProcess(processId):
@@ -638,6 +960,8 @@ def pingProcess(processId):
 
 
 def psComamnd(commandId, arguments):
+    verbose = "-v" in arguments
+
     for processId in processes:
         process = getProcessProcess(processId)
         if process is not None:
@@ -669,15 +993,36 @@ def psComamnd(commandId, arguments):
         if "lastPing" in processes[processId]:
             lastPing = str(processes[processId]["lastPing"])
 
-        systemOutput(commandId,
-                     "{0} {1} {2} {3} {4} {5} {6}".format(
-                         complexProcessId(processId),
-                         getProcessTypeName(processId),
-                         status,
-                         returnCode,
-                         fileLen,
-                         fileDate,
-                         lastPing))
+        linesRate = "-"
+        bytesRate = "-"
+        dropped = "-"
+        if "output_rate" in processes[processId]:
+            linesRate, bytesRate, dropped = processes[processId]["output_rate"]
+            linesRate = str(round(linesRate, 1))
+            bytesRate = str(int(bytesRate))
+            dropped = str(dropped)
+
+        line = "{0} {1} {2} {3} {4} {5} {6} {7} {8} {9}".format(
+            complexProcessId(processId),
+            getProcessTypeName(processId),
+            status,
+            returnCode,
+            fileLen,
+            fileDate,
+            lastPing,
+            linesRate,
+            bytesRate,
+            dropped)
+
+        if verbose:
+            metrics = processes[processId].get("metrics")
+            if status.startswith("running") and metrics is not None and len(metrics) > 0:
+                sample = metrics[-1]
+                line += " {0:.1f} {1:.1f} {2} {3} {4:.1f} {5:.0f} {6:.0f}".format(sample[1], max([m[1] for m in metrics]), *sample[2:])
+            else:
+                line += " - - - - - - -"
+
+        systemOutput(commandId, line)
 
 
 def servicesCommand(commandId, arguments):
@@ -742,7 +1087,7 @@ def processCommand(processId, message):
     elif "remove" == command:
         removeProcess(processId)
     elif "logs" == command:
-        readLog(processId)
+        logsCommand(processId, params)
     elif "make-service" == command:
         makeServiceProcess(processId)
     elif "unmake-service" == command:
@@ -786,6 +1131,9 @@ def onConnect(mqttClient, data, flags, rc):
             mqttClient.subscribe("exec/+", 0)
             mqttClient.subscribe("exec/+/process", 0)
             mqttClient.subscribe("exec/+/process/#", 0)
+            mqttClient.subscribe("exec/+/processz", 0)
+            mqttClient.subscribe("exec/+/processz/#", 0)
+            mqttClient.subscribe("exec/+/manifest", 0)
             mqttClient.subscribe("exec/+/system/stop", 0)
         else:
             important("ERROR: Connection returned error result: " + str(rc))
@@ -836,6 +1184,20 @@ def onMessage(mqttClient, data, msg):
                 if checkClusterId(clusterId):
                     name = "/".join(split[2:])
                     storeExtraCode(processId, name, msg.payload)
+            elif len(split) >= 2 and split[1] == "processz":
+                processId = split[0]
+                clusterId, processId = splitProcessId(processId)
+                if checkClusterId(clusterId):
+                    payload = zlib.decompress(msg.payload)
+                    if len(split) == 2:
+                        storeCode(processId, str(payload, 'utf-8'))
+                    else:
+                        storeExtraCode(processId, "/".join(split[2:]), payload)
+            elif len(split) == 2 and split[1] == "manifest":
+                processId = split[0]
+                clusterId, processId = splitProcessId(processId)
+                if checkClusterId(clusterId):
+                    checkManifest(processId, str(msg.payload, 'utf-8'))
             elif len(split) == 3 and split[1] == "system" and split[2] == "stop":
                 processId = split[0]
                 clusterId, processId = splitProcessId(processId)
@@ -844,6 +1206,8 @@ def onMessage(mqttClient, data, msg):
                     if payload == "stopped":
                         processes[processId]['stop_response'] = True
 
+        elif topic == METRICS_TOPIC:
+            pass  # our own
         elif topic.startswith("system/"):
             commandId = topic[7:]
             payload = str(msg.payload, 'utf-8')
@@ -879,6 +1243,73 @@ def startupServices():
                         startProcess(programDir)
 
 
+# Returns (cpu ticks, rss, threads, context switches, read bytes, written bytes) of process or None
+def readProcCounters(pid):
+    try:
+        with open("/proc/" + str(pid) + "/stat", "rt") as f:
+            stat = f.read()
+        fields = stat[stat.rindex(")") + 2:].split(" ")  # process name can have spaces
+        cpuTicks = int(fields[11]) + int(fields[12])
+        threads = int(fields[17])
+        rss = int(fields[21]) * PAGE_SIZE
+
+        contextSwitches = 0
+        with open("/proc/" + str(pid) + "/status", "rt") as f:
+            for line in f:
+                if line.startswith("voluntary_ctxt_switches:") or line.startswith("nonvoluntary_ctxt_switches:"):
+                    contextSwitches += int(line.split(":")[1])
+    except (OSError, ValueError, IndexError):
+        return None
+
+    readBytes = 0
+    writeBytes = 0
+    try:
+        with open("/proc/" + str(pid) + "/io", "rt") as f:
+            for line in f:
+                if line.startswith("read_bytes:"):
+                    readBytes = int(line.split(":")[1])
+                elif line.startswith("write_bytes:"):
+                    writeBytes = int(line.split(":")[1])
+    except OSError:
+        pass  # not readable when process runs as other user
+
+    return cpuTicks, rss, threads, contextSwitches, readBytes, writeBytes
+
+
+def sampleMetrics(currentTime):
+    lines = []
+    for processId in list(processes):
+        process = getProcessProcess(processId)
+        if process is None or process.returncode is not None:
+            continue
+
+        counters = readProcCounters(process.pid)
+        if counters is None:
+            continue
+
+        last = processes[processId].get("metrics_last")
+        processes[processId]["metrics_last"] = (currentTime, process.pid, counters)
+        if last is None or last[1] != process.pid:
+            processes[processId]["metrics"] = collections.deque(maxlen=METRICS_HISTORY)  # new process
+            continue
+
+        elapsed = currentTime - last[0]
+        lastCounters = last[2]
+        sample = (currentTime,
+                  (counters[0] - lastCounters[0]) * 100.0 / CLOCK_TICKS / elapsed,
+                  counters[1],
+                  counters[2],
+                  (counters[3] - lastCounters[3]) / elapsed,
+                  (counters[4] - lastCounters[4]) / elapsed,
+                  (counters[5] - lastCounters[5]) / elapsed)
+        processes[processId]["metrics"].append(sample)
+
+        lines.append("{0} {1:.3f} {2:.1f} {3} {4} {5:.1f} {6:.0f} {7:.0f}".format(complexProcessId(processId), *sample))
+
+    if len(lines) > 0:
+        client.publish(METRICS_TOPIC, "\n".join(lines))
+
+
 def testForAgents(currentTime):
     for processId in processes:
         if isAgent(processId) and isRunning(processId):
@@ -923,9 +1354,12 @@ _connect_mqtt()
 
 important("Started PyROS.")
 
+startOutputSupervisor()
+startWarmPool()
 startupServices()
 
 lastCheckedAgents = time.time()
+lastSampledMetrics = lastCheckedAgents
 
 while not do_exit:
     try:
@@ -936,10 +1370,18 @@ while not do_exit:
         if now - lastCheckedAgents > AGENTS_CHECK_TIMEOUT:
             lastCheckedAgents = now
             testForAgents(now)
+        if now - lastSampledMetrics >= METRICS_INTERVAL:
+            lastSampledMetrics = now
+            sampleMetrics(now)
 
     except SystemExit:
         do_exit = True
     except Exception as e:
         important("ERROR: Got exception in main loop; " + str(e))
 
+if warmPool is not None:
+    warmPool.stop()
+
+flushLogs()
+
 important("PyROS stopped.")
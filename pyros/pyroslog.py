@@ -0,0 +1,183 @@
+
+#
+# Copyright 2016-2019 Games Creators Club
+#
+# MIT License
+#
+
+#
+# Log of one process: last lines in memory (ring) and all lines, with timestamps, in rotating files
+# on disk, so logs survive PyROS restarts.
+#
+# Each line in file is '<timestamp> <line>'. Current file is <name>.log; when it grows over file size it
+# becomes <name>.log.1, previous <name>.log.1 becomes <name>.log.2 and so on - the oldest is dropped.
+# For each file there is a sparse index of (timestamp, offset) of a line every index interval bytes,
+# so lines since some time are found by seeking close to them instead of reading files from the start.
+# Indexes of files written before start are built by scanning them when they are first needed.
+#
+# Lines are written to file in batches - on flush, which PyROS calls periodically.
+#
+
+import bisect
+import collections
+import os
+import re
+import threading
+import time
+
+LOG_MEMORY_LINES = 1000
+LOG_FILE_SIZE = 1024 * 1024
+LOG_FILES = 5  # rotated files kept besides the current one
+LOG_INDEX_INTERVAL = 16 * 1024
+
+
+def _parseLine(raw):
+    i = raw.find(b' ')
+    try:
+        return float(raw[0:i]), str(raw[i + 1:].rstrip(b'\n'), 'utf-8', 'replace')
+    except ValueError:
+        return None, None
+
+
+class ProcessLog:
+    def __init__(self, directory, name, memoryLines=LOG_MEMORY_LINES, fileSize=LOG_FILE_SIZE, files=LOG_FILES, indexInterval=LOG_INDEX_INTERVAL):
+        self.path = os.path.join(directory, name + ".log")
+        self.fileSize = fileSize
+        self.files = files
+        self.indexInterval = indexInterval
+        self.ring = collections.deque(maxlen=memoryLines)  # (timestamp, line)
+        self.pending = []
+        self.indexes = [None] * (files + 1)  # [0] is of current file
+        self.lock = threading.Lock()
+
+        os.makedirs(directory, exist_ok=True)
+        self.file = open(self.path, "ab")
+        self.size = self.file.tell()
+        self.lastIndexed = None
+        if self.size > 0:
+            with open(self.path, "rb") as f:
+                self.indexes[0] = self._scan(f, self.size, self.ring)
+            self.lastIndexed = self.indexes[0][-1][1] if len(self.indexes[0]) > 0 else None
+        else:
+            self.indexes[0] = []
+
+    def _filename(self, n):
+        return self.path if n == 0 else self.path + "." + str(n)
+
+    def _scan(self, file, size, ring=None):
+        index = []
+        lastIndexed = None
+        offset = 0
+        file.seek(0)
+        while offset < size:
+            raw = file.readline()
+            if len(raw) == 0:
+                break
+            if lastIndexed is None or offset - lastIndexed >= self.indexInterval or ring is not None:
+                timestamp, line = _parseLine(raw)
+                if timestamp is not None:
+                    if lastIndexed is None or offset - lastIndexed >= self.indexInterval:
+                        index.append((timestamp, offset))
+                        lastIndexed = offset
+                    if ring is not None:
+                        ring.append((timestamp, line))
+            offset += len(raw)
+
+        return index
+
+    def append(self, line, timestamp=None):
+        if timestamp is None:
+            timestamp = time.time()
+        if line.endswith("\n"):
+            line = line[:len(line) - 1]
+
+        with self.lock:
+            for l in line.split("\n"):
+                self.ring.append((timestamp, l))
+                data = bytes("{0:.3f} {1}\n".format(timestamp, l), 'utf-8', 'replace')
+                if self.lastIndexed is None or self.size - self.lastIndexed >= self.indexInterval:
+                    self.indexes[0].append((timestamp, self.size))
+                    self.lastIndexed = self.size
+                self.pending.append(data)
+                self.size += len(data)
+                if self.size >= self.fileSize:
+                    self._rotate()
+
+    def _flush(self):
+        if len(self.pending) > 0:
+            self.file.write(b''.join(self.pending))
+            self.file.flush()
+            self.pending = []
+
+    def flush(self):
+        with self.lock:
+            self._flush()
+
+    def _rotate(self):
+        self._flush()
+        self.file.close()
+        for n in range(self.files, 0, -1):
+            if os.path.exists(self._filename(n - 1)):
+                os.replace(self._filename(n - 1), self._filename(n))
+        self.indexes = [[]] + self.indexes[0:self.files]
+        self.file = open(self.path, "ab")
+        self.size = 0
+        self.lastIndexed = None
+
+    # Returns lines kept in memory as (timestamp, line)
+    def tail(self):
+        with self.lock:
+            return list(self.ring)
+
+    # Returns generator of (timestamp, line) of lines logged at or after since (all when None) matching
+    # regular expression pattern (all when None)
+    def query(self, since=None, pattern=None):
+        regex = re.compile(pattern) if pattern is not None else None
+
+        with self.lock:
+            if since is not None and len(self.ring) > 0 and self.ring[0][0] <= since:
+                entries = [entry for entry in self.ring if entry[0] >= since]
+                return (entry for entry in entries if regex is None or regex.search(entry[1]))
+
+            self._flush()
+            snapshot = []
+            for n in range(self.files, -1, -1):
+                if os.path.exists(self._filename(n)):
+                    file = open(self._filename(n), "rb")
+                    size = self.size if n == 0 else os.path.getsize(self._filename(n))
+                    if self.indexes[n] is None:
+                        self.indexes[n] = self._scan(file, size)
+                    snapshot.append((file, size, list(self.indexes[n])))
+
+        return self._readFiles(snapshot, since, regex)
+
+    def _readFiles(self, snapshot, since, regex):
+        for file, size, index in snapshot:
+            with file:
+                offset = 0
+                if since is not None and len(index) > 0:
+                    i = bisect.bisect_left(index, (since, -1)) - 1  # last indexed line before since
+                    if i >= 0:
+                        offset = index[i][1]
+                file.seek(offset)
+                while offset < size:
+                    raw = file.readline()
+                    if len(raw) == 0:
+                        break
+                    offset += len(raw)
+                    timestamp, line = _parseLine(raw)
+                    if timestamp is None or (since is not None and timestamp < since):
+                        continue
+                    if regex is None or regex.search(line):
+                        yield timestamp, line
+
+    def close(self):
+        with self.lock:
+            self._flush()
+            self.file.close()
+
+    def remove(self):
+        self.close()
+        for n in range(0, self.files + 1):
+            if os.path.exists(self._filename(n)):
+                os.remove(self._filename(n))
@@ -0,0 +1,367 @@
+
+#
+# Copyright 2016-2019 Games Creators Club
+#
+# MIT License
+#
+
+#
+# Warm pool - forkserver for python processes started by PyROS.
+#
+# Server is a python interpreter which imports commonly used heavy modules (paho, numpy, PIL, pygame,
+# cv2, pyroslib...) once and then listens on unix socket. For each process it is given write ends of
+# stdout and stderr pipes, working directory, arguments and environment; it forks, and the child sets
+# those up and runs <id>.py as __main__ as 'python3 -u <id>.py <id>' would. Child is a separate
+# process as before - only already imported modules are shared (copy on write).
+#
+# Server writes pid of the child to the connection and, when child finishes, its return code (negative
+# signal number when killed - as subprocess does). WarmProcess is subprocess.Popen look alike on
+# PyROS side built from that connection.
+#
+# Modules preloaded from code directory (pyroslib) are dropped in the child if any of their files
+# changed since, so newly uploaded code is always used.
+#
+# Usage (started by pyros-core.py):
+#     python3 -u pyroswarm.py <socket-path> <code-dir> <module> { <module> }
+#
+
+import io
+import json
+import os
+import selectors
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import traceback
+
+from multiprocessing import reduction
+
+DEFAULT_MODULES = ["paho.mqtt.client", "numpy", "PIL.Image", "pygame", "cv2", "pyroslib"]
+
+START_TIMEOUT = 60.0  # preloading on Pi Zero can take a while
+CONNECT_TIMEOUT = 2.0
+
+
+def _readLine(conn, buffer):
+    while b'\n' not in buffer:
+        data = conn.recv(65536)
+        if len(data) == 0:
+            return None, buffer
+        buffer += data
+
+    i = buffer.index(b'\n')
+    return buffer[0:i], buffer[i + 1:]
+
+
+def _returnCode(status):
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
+
+
+def _preload(modules, codeDir):
+    for module in modules:
+        started = time.time()
+        try:
+            __import__(module)
+            print("  preloaded " + module + " in " + str(round(time.time() - started, 3)) + "s")
+        except Exception as ex:
+            print("  cannot preload " + module + "; " + str(ex))
+
+    codeModules = {}
+    for name, module in list(sys.modules.items()):
+        file = getattr(module, "__file__", None)
+        if file is not None and os.path.abspath(file).startswith(codeDir + "/"):
+            codeModules[name] = (file, os.path.getmtime(file))
+
+    return codeModules
+
+
+def _dropChangedCodeModules(codeModules):
+    for file, mtime in codeModules.values():
+        try:
+            changed = os.path.getmtime(file) != mtime
+        except OSError:
+            changed = True
+        if changed:
+            for name in codeModules:
+                if name in sys.modules:
+                    del sys.modules[name]
+            return
+
+
+def _runChild(request, fds, basePath, codeModules):
+    os.dup2(fds[0], 1)
+    os.dup2(fds[1], 2)
+    for fd in fds:
+        os.close(fd)
+
+    sys.stdout = io.TextIOWrapper(open(1, "wb", buffering=0, closefd=False), encoding="utf-8", write_through=True)
+    sys.stderr = io.TextIOWrapper(open(2, "wb", buffering=0, closefd=False), encoding="utf-8", errors="backslashreplace", write_through=True)
+
+    rc = 0
+    try:
+        os.chdir(request["cwd"])
+        os.environ.clear()
+        os.environ.update(request["env"])
+        script = request["argv"][0]
+        pythonPath = [p for p in request["env"].get("PYTHONPATH", "").split(":") if p != ""]
+        sys.path[:] = [os.path.dirname(os.path.abspath(script))] + pythonPath + basePath
+        sys.argv = list(request["argv"])
+
+        _dropChangedCodeModules(codeModules)
+        if "random" in sys.modules:
+            sys.modules["random"].seed()
+        if "numpy.random" in sys.modules:
+            sys.modules["numpy.random"].seed()
+
+        import runpy
+        import threading
+
+        runpy.run_path(script, run_name="__main__")
+
+        for thread in threading.enumerate():
+            if thread is not threading.main_thread() and not thread.daemon:
+                thread.join()
+    except SystemExit as ex:
+        if ex.code is None:
+            rc = 0
+        elif isinstance(ex.code, int):
+            rc = ex.code
+        else:
+            sys.stderr.write(str(ex.code) + "\n")
+            rc = 1
+    except BaseException:
+        traceback.print_exc()
+        rc = 1
+
+    try:
+        import atexit
+        atexit._run_exitfuncs()
+        sys.stdout.flush()
+        sys.stderr.flush()
+    finally:
+        os._exit(rc & 0xff)
+
+
+def serve(socketPath, codeDir, modules):
+    codeDir = os.path.abspath(codeDir)
+    serverPath = [os.path.abspath(p) for p in os.environ.get("PYTHONPATH", "").split(":") if p != ""]
+    basePath = [p for p in sys.path[1:] if os.path.abspath(p) not in serverPath]
+
+    codeModules = _preload(modules, codeDir)
+
+    wakeup = os.pipe()
+    os.set_blocking(wakeup[0], False)
+    os.set_blocking(wakeup[1], False)
+    signal.set_wakeup_fd(wakeup[1])
+    signal.signal(signal.SIGCHLD, lambda signum, frame: None)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # PyROS stops us by closing stdin
+
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    listener.bind(socketPath + ".tmp")
+    os.rename(socketPath + ".tmp", socketPath)  # socket appears only when ready
+    listener.listen(16)
+
+    selector = selectors.DefaultSelector()
+    selector.register(listener, selectors.EVENT_READ)
+    selector.register(wakeup[0], selectors.EVENT_READ)
+    selector.register(sys.stdin, selectors.EVENT_READ)  # closed when PyROS stops
+
+    children = {}  # pid to connection
+    print("Warm pool ready at " + socketPath)
+    while True:
+        for key, _ in selector.select():
+            if key.fileobj is sys.stdin:
+                if len(os.read(sys.stdin.fileno(), 1024)) == 0:
+                    listener.close()
+                    os.unlink(socketPath)
+                    return
+            elif key.fileobj is listener:
+                conn, _ = listener.accept()
+                try:
+                    conn.settimeout(CONNECT_TIMEOUT)
+                    fds = reduction.recvfds(conn, 2)
+                    line, _ = _readLine(conn, b'')
+                    request = json.loads(str(line, 'utf-8'))
+                except Exception as ex:
+                    print("ERROR: Bad warm pool request; " + str(ex))
+                    conn.close()
+                    continue
+
+                pid = os.fork()
+                if pid == 0:
+                    signal.set_wakeup_fd(-1)
+                    signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+                    signal.signal(signal.SIGINT, signal.default_int_handler)
+                    selector.close()
+                    listener.close()
+                    conn.close()
+                    for c in children.values():
+                        c.close()
+                    os.close(wakeup[0])
+                    os.close(wakeup[1])
+                    _runChild(request, fds, basePath, codeModules)
+
+                for fd in fds:
+                    os.close(fd)
+                try:
+                    conn.sendall(bytes(str(pid) + "\n", 'utf-8'))
+                except OSError:
+                    pass
+                children[pid] = conn
+            else:
+                try:
+                    while len(os.read(wakeup[0], 1024)) > 0:
+                        pass
+                except BlockingIOError:
+                    pass
+
+                while len(children) > 0:
+                    try:
+                        pid, status = os.waitpid(-1, os.WNOHANG)
+                    except ChildProcessError:
+                        break
+                    if pid == 0:
+                        break
+                    conn = children.pop(pid, None)
+                    if conn is not None:
+                        try:
+                            conn.sendall(bytes(str(_returnCode(status)) + "\n", 'utf-8'))
+                        except OSError:
+                            pass
+                        conn.close()
+
+
+class WarmProcess:
+    # Behaves as subprocess.Popen with stdout and stderr pipes as far as PyROS uses it
+    def __init__(self, conn, pid, stdout, stderr):
+        self.conn = conn
+        self.pid = pid
+        self.stdout = stdout
+        self.stderr = stderr
+        self.returncode = None
+        self.buffer = b''
+
+    def poll(self):
+        if self.returncode is None:
+            try:
+                data = self.conn.recv(1024)
+            except (BlockingIOError, InterruptedError):
+                return None
+            except OSError:
+                data = b''
+
+            self.buffer += data
+            if b'\n' in self.buffer:
+                self.returncode = int(self.buffer[0:self.buffer.index(b'\n')])
+                self.conn.close()
+            elif len(data) == 0:
+                # warm pool is gone - child is not anyone's to wait for now
+                try:
+                    os.kill(self.pid, 0)
+                except ProcessLookupError:
+                    self.returncode = -1
+                    self.conn.close()
+        return self.returncode
+
+    def wait(self, timeout=None):
+        started = time.time()
+        while self.poll() is None:
+            if timeout is not None and time.time() - started > timeout:
+                raise subprocess.TimeoutExpired(self.pid, timeout)
+            time.sleep(0.01)
+        return self.returncode
+
+    def send_signal(self, sig):
+        if self.poll() is None:
+            try:
+                os.kill(self.pid, sig)
+            except ProcessLookupError:
+                pass
+
+    def terminate(self):
+        self.send_signal(signal.SIGTERM)
+
+    def kill(self):
+        self.send_signal(signal.SIGKILL)
+
+
+class WarmPool:
+    def __init__(self, codeDir, modules):
+        self.codeDir = os.path.abspath(codeDir)
+        self.modules = modules
+        self.directory = None
+        self.socketPath = None
+        self.server = None
+
+    def start(self, timeout=START_TIMEOUT):
+        self.directory = tempfile.mkdtemp(prefix="pyros-warm-")
+        self.socketPath = os.path.join(self.directory, "warm.sock")
+
+        env = os.environ.copy()
+        env["PYTHONPATH"] = self.codeDir + (":" + env["PYTHONPATH"] if "PYTHONPATH" in env else "")
+        self.server = subprocess.Popen([sys.executable, "-u", os.path.abspath(__file__), self.socketPath, self.codeDir] + self.modules,
+                                       env=env, stdin=subprocess.PIPE, cwd=self.codeDir)
+
+        started = time.time()
+        while not os.path.exists(self.socketPath):
+            if self.server.poll() is not None or time.time() - started > timeout:
+                return False
+            time.sleep(0.05)
+        return True
+
+    def isRunning(self):
+        return self.server is not None and self.server.poll() is None and os.path.exists(self.socketPath)
+
+    def stop(self):
+        if self.server is not None:
+            self.server.stdin.close()
+            try:
+                self.server.wait(1.0)
+            except subprocess.TimeoutExpired:
+                self.server.kill()
+            self.server = None
+        if self.directory is not None and os.path.exists(self.directory):
+            for name in os.listdir(self.directory):
+                os.unlink(os.path.join(self.directory, name))
+            os.rmdir(self.directory)
+
+    # Starts 'python3 -u <script> <args>' command in cwd with env. Returns WarmProcess
+    # or None if pool cannot start it (and process should be started as usual)
+    def startProcess(self, command, cwd, env):
+        if not self.isRunning():
+            return None
+
+        argv = command[2:] if command[1] == "-u" else command[1:]
+        stdout = os.pipe()
+        stderr = os.pipe()
+        conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            conn.settimeout(CONNECT_TIMEOUT)
+            conn.connect(self.socketPath)
+            reduction.sendfds(conn, [stdout[1], stderr[1]])
+            conn.sendall(bytes(json.dumps({"cwd": cwd, "argv": argv, "env": dict(env)}) + "\n", 'utf-8'))
+            line, buffer = _readLine(conn, b'')
+            if line is None:
+                raise OSError("warm pool closed connection")
+        except OSError:
+            conn.close()
+            os.close(stdout[0])
+            os.close(stderr[0])
+            return None
+        finally:
+            os.close(stdout[1])
+            os.close(stderr[1])
+
+        conn.setblocking(False)
+        process = WarmProcess(conn, int(line), open(stdout[0], "rb", buffering=0), open(stderr[0], "rb", buffering=0))
+        process.buffer = buffer
+        return process
+
+
+if __name__ == "__main__":
+    serve(sys.argv[1], sys.argv[2], sys.argv[3:])
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+
+#
+# Copyright 2019 Games Creators Club
+#
+# MIT License
+#
+
+#
+# Start latency of services with new interpreter ('python3 -u <id>.py <id>' as PyROS does without warm
+# pool) against forking them from warm pool (see pyroswarm.py). Measured is time from start until all
+# top level imports of the service are done - which is dead time before service can do anything; the
+# rest of service is not run, so hardware is not needed. Imports which fail (no hardware libraries on
+# this machine) are counted and skipped.
+#
+# Usage (from rover directory):
+#     python3 ../pyros/pyroswarm_benchmark.py [<service.py> ...]
+#
+# Without arguments all *_service.py files under current directory are measured.
+#
+
+import ast
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import pyroswarm
+
+RUNS = 5
+READY = b"__ready__"
+
+
+def findServices():
+    services = []
+    for root, dirs, files in os.walk("."):
+        dirs[:] = [d for d in dirs if not d.startswith(".") and d != "__pycache__"]
+        for file in files:
+            if file.endswith("_service.py"):
+                services.append(os.path.join(root, file))
+    return sorted(services)
+
+
+def importsOnly(filename):
+    with open(filename) as f:
+        source = f.read()
+    tree = ast.parse(source, filename)
+
+    lines = ["failed = 0"]
+    for node in tree.body:
+        if isinstance(node, (ast.Import, ast.ImportFrom)):
+            lines += ["try:", "    " + ast.get_source_segment(source, node).replace("\n", " "), "except Exception:", "    failed += 1"]
+    lines.append("print('" + str(READY, 'utf-8') + " ' + str(failed))")
+    return "\n".join(lines) + "\n"
+
+
+def waitReady(process):
+    line = process.stdout.readline()
+    elapsed = time.perf_counter()
+    while len(process.stdout.read(65536)) > 0:
+        pass
+    process.stdout.close()
+    process.stderr.close()
+    process.wait()
+    if not line.startswith(READY):
+        raise ValueError("Process did not get to the end of imports")
+    return elapsed, int(line[len(READY):])
+
+
+def cold(command, cwd, env):
+    started = time.perf_counter()
+    process = subprocess.Popen(command, env=env, bufsize=0, stdout=subprocess.PIPE, stderr=subprocess.PIPE, cwd=cwd)
+    ready, failed = waitReady(process)
+    return ready - started, failed
+
+
+def warm(pool, command, cwd, env):
+    started = time.perf_counter()
+    process = pool.startProcess(command, cwd, env)
+    if process is None:
+        raise ValueError("Warm pool did not start process")
+    ready, failed = waitReady(process)
+    return ready - started, failed
+
+
+if __name__ == "__main__":
+    services = sys.argv[1:] if len(sys.argv) > 1 else findServices()
+    directory = tempfile.mkdtemp()
+    codeDir = os.path.abspath(".")
+    pool = pyroswarm.WarmPool(codeDir, pyroswarm.DEFAULT_MODULES)
+    try:
+        started = time.perf_counter()
+        if not pool.start():
+            raise ValueError("Warm pool did not start")
+        print("warm pool started in {0:.2f}s".format(time.perf_counter() - started))
+        print("{0:<40} {1:>8} {2:>10} {3:>10} {4:>8}".format("service", "failed", "cold ms", "warm ms", "speedup"))
+
+        totalCold = 0.0
+        totalWarm = 0.0
+        for service in services:
+            processId = os.path.splitext(os.path.basename(service))[0]
+            cwd = os.path.join(directory, processId)
+            os.makedirs(cwd, exist_ok=True)
+            with open(os.path.join(cwd, processId + ".py"), "w") as f:
+                f.write(importsOnly(service))
+
+            env = os.environ.copy()
+            env["PYTHONPATH"] = ":".join([os.path.abspath(os.path.dirname(service)), codeDir] + ([env["PYTHONPATH"]] if "PYTHONPATH" in env else []))
+            command = ["python3", "-u", processId + ".py", processId]
+
+            coldTimes = []
+            warmTimes = []
+            for i in range(RUNS):
+                elapsed, failed = cold(command, cwd, env)
+                coldTimes.append(elapsed)
+                elapsed, failed = warm(pool, command, cwd, env)
+                warmTimes.append(elapsed)
+
+            coldTime = statistics.median(coldTimes)
+            warmTime = statistics.median(warmTimes)
+            totalCold += coldTime
+            totalWarm += warmTime
+            print("{0:<40} {1:>8} {2:>10.1f} {3:>10.1f} {4:>7.1f}x".format(service, failed, coldTime * 1000, warmTime * 1000, coldTime / warmTime))
+
+        print("{0:<40} {1:>8} {2:>10.1f} {3:>10.1f} {4:>7.1f}x".format("total", "", totalCold * 1000, totalWarm * 1000, totalCold / max(totalWarm, 0.000001)))
+    finally:
+        pool.stop()
+        shutil.rmtree(directory)
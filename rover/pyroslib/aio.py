@@ -0,0 +1,416 @@
+
+#
+# Copyright 2016-2019 Games Creators Club
+#
+# MIT License
+#
+
+#
+# asyncio flavour of pyroslib.
+#
+# Talks to the same broker with the same topics as the blocking pyroslib so services can
+# be moved over one by one. The paho client is driven from the event loop: socket reads
+# are registered with loop.add_reader and keep-alive/reconnect is done by a small task,
+# so there is no polling and messages are delivered as soon as they arrive.
+#
+# Broker not being up yet is not an error - connect keeps retrying every RECONNECT_DELAY, same
+# as reconnecting after connection is lost.
+#
+# Usage:
+#
+#     import pyroslib.aio as aio
+#
+#     async def main():
+#         await aio.init("my-service")
+#         aio.periodic(0.02, tick)
+#         async for msg in aio.subscribe("wheel/+/deg"):
+#             print(msg.groups[0], msg.payload)
+#
+#     aio.run(main())
+#
+
+import asyncio
+import os
+import random
+import sys
+import time
+import traceback
+
+import paho.mqtt.client as mqtt
+
+from pyroslib.topics import TopicIndex
+from pyroslib import profiler
+
+MISC_LOOP_PERIOD = 1.0
+RECONNECT_DELAY = 1.0
+
+
+class Message:
+    __slots__ = ['topic', 'payload', 'groups']
+
+    def __init__(self, topic, payload, groups):
+        self.topic = topic
+        self.payload = payload
+        self.groups = groups
+
+
+class Subscription:
+    def __init__(self, connection, topic, binary, max_queue):
+        self.connection = connection
+        self.topic = topic
+        self.binary = binary
+        self.queue = asyncio.Queue(maxsize=max_queue)
+        self.closed = False
+
+    def _put(self, message):
+        if self.queue.full():
+            self.queue.get_nowait()  # slow consumer - keep latest messages
+        self.queue.put_nowait(message)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self.closed and self.queue.empty():
+            raise StopAsyncIteration
+        message = await self.queue.get()
+        if message is None:
+            raise StopAsyncIteration
+        return message
+
+    async def get(self, timeout=None):
+        if timeout is None:
+            return await self.queue.get()
+        return await asyncio.wait_for(self.queue.get(), timeout)
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.connection._removeSubscription(self)
+            if self.queue.full():
+                self.queue.get_nowait()
+            self.queue.put_nowait(None)
+
+
+class AsyncPyros:
+    def __init__(self, name, unique=False, host='localhost', port=1883, loop=None):
+        if unique:
+            name += "-" + str(random.randint(10000, 99999))
+
+        self.name = name
+        self.host = host
+        self.port = port
+        self.loop = loop if loop is not None else asyncio.get_running_loop()
+
+        self.client = mqtt.Client(name)
+        self.client.on_connect = self._onConnect
+        self.client.on_disconnect = self._onDisconnect
+        self.client.on_message = self._onMessage
+
+        self._index = TopicIndex()
+        self._subscriptions = {}
+        self._connected = asyncio.Event()
+        self._socket = None
+        self._reconnecting = False
+        self._misc_task = None
+        self._stopped = self.loop.create_future()
+
+        self.collect_stats = False
+        self.stats = [[0, 0, 0, 0.0, 0, 0, 0]]  # same columns as pyroslib; misc loop is the tick, nothing is coalesced
+
+    def isConnected(self):
+        return self._connected.is_set()
+
+    async def connect(self):
+        while True:
+            try:
+                await self.loop.run_in_executor(None, self.client.connect, self.host, self.port, 60)
+                break
+            except Exception as ex:
+                if self._stopped.done():
+                    raise
+                print("    " + self.name + " cannot connect to broker (" + str(ex) + "), retrying...")
+                await asyncio.sleep(RECONNECT_DELAY)
+        self._addSocket()
+        if self._misc_task is None:
+            self._misc_task = self.loop.create_task(self._miscLoop())
+        await self._connected.wait()
+
+    def stop(self):
+        if not self._stopped.done():
+            self._stopped.set_result(True)
+        if self._misc_task is not None:
+            self._misc_task.cancel()
+        for subscriptions in list(self._subscriptions.values()):
+            for subscription in list(subscriptions):
+                subscription.close()
+        self._removeSocket()
+        try:
+            self.client.disconnect()
+        except Exception:
+            pass
+
+    async def forever(self):
+        await self._stopped
+
+    def _addSocket(self):
+        self._socket = self.client.socket()
+        if self._socket is not None:
+            self.loop.add_reader(self._socket, self._readable)
+            self._flush()
+
+    def _removeSocket(self):
+        if self._socket is not None:
+            self.loop.remove_reader(self._socket)
+            self._socket = None
+
+    def _flush(self):
+        if self.client.want_write():
+            self.client.loop_write()
+
+    def _readable(self):
+        rc = self.client.loop_read(10)
+        if rc != mqtt.MQTT_ERR_SUCCESS:
+            self._connectionLost()
+        else:
+            self._flush()
+
+    def _connectionLost(self):
+        self._removeSocket()
+        self._connected.clear()
+        if not self._reconnecting and not self._stopped.done():
+            self._reconnecting = True
+            self.loop.create_task(self._reconnect())
+
+    async def _reconnect(self):
+        while not self._stopped.done():
+            try:
+                await self.loop.run_in_executor(None, self.client.reconnect)
+                self._addSocket()
+                self._reconnecting = False
+                return
+            except Exception:
+                await asyncio.sleep(RECONNECT_DELAY)
+
+    def _addTickStats(self, tickTime, jitter):
+        self.stats.append([tickTime, 0, 0, jitter, 0, 0, 0])
+        if len(self.stats) > 100:
+            del self.stats[0]
+
+    async def _miscLoop(self):
+        while not self._stopped.done():
+            deadline = self.loop.time() + MISC_LOOP_PERIOD
+            await asyncio.sleep(MISC_LOOP_PERIOD)
+            if self.collect_stats:
+                self._addTickStats(time.time(), self.loop.time() - deadline)  # how late event loop got to us
+            if self._socket is not None:
+                if self.client.loop_misc() != mqtt.MQTT_ERR_SUCCESS:
+                    self._connectionLost()
+                else:
+                    self._flush()
+            elif not self._reconnecting:
+                self._connectionLost()
+
+    def _onConnect(self, mqttClient, data, flags, rc):
+        if rc == 0:
+            for topic in self._subscriptions:
+                mqttClient.subscribe(topic, 0)
+            self._connected.set()
+        else:
+            print("ERROR: Connection returned error result: " + str(rc))
+
+    def _onDisconnect(self, mqttClient, data, rc):
+        self.loop.call_soon(self._connectionLost)
+
+    def _onMessage(self, mqttClient, data, msg):
+        if self.collect_stats:
+            self.stats[-1][2] += 1
+        try:
+            text, binaries = self._index.match(msg.topic)
+            decoded = None
+            for subscriptions, groups in binaries:
+                for subscription in subscriptions:
+                    if subscription.binary:
+                        subscription._put(Message(msg.topic, msg.payload, groups))
+                    else:
+                        if decoded is None:
+                            decoded = str(msg.payload, 'utf-8')
+                        subscription._put(Message(msg.topic, decoded, groups))
+        except Exception as ex:
+            print("ERROR: Got exception in on message processing; " + str(ex) + "\n" + ''.join(traceback.format_tb(ex.__traceback__)))
+
+    def publish(self, topic, payload):
+        if self.collect_stats:
+            self.stats[-1][1] += 1
+        self.client.publish(topic, payload)
+        self._flush()
+
+    def subscribe(self, topic, binary=False, max_queue=0):
+        subscription = Subscription(self, topic, binary, max_queue)
+        if topic not in self._subscriptions:
+            subscriptions = []
+            self._subscriptions[topic] = subscriptions
+            # all subscriptions are registered as 'binary' in the index as each gets every matching message
+            self._index.add(topic, subscriptions, binary=True)
+            if self.isConnected():
+                self.client.subscribe(topic, 0)
+                self._flush()
+
+        self._subscriptions[topic].append(subscription)
+        return subscription
+
+    def subscribeBinary(self, topic, max_queue=0):
+        return self.subscribe(topic, binary=True, max_queue=max_queue)
+
+    def _removeSubscription(self, subscription):
+        subscriptions = self._subscriptions.get(subscription.topic)
+        if subscriptions is not None and subscription in subscriptions:
+            subscriptions.remove(subscription)
+            if len(subscriptions) == 0:
+                del self._subscriptions[subscription.topic]
+                self._index.remove(subscription.topic)
+                if self.isConnected():
+                    self.client.unsubscribe(subscription.topic)
+                    self._flush()
+
+    async def request(self, topic, payload, reply_topic, timeout=None, binary=False):
+        subscription = self.subscribe(reply_topic, binary=binary)
+        try:
+            self.publish(topic, payload)
+            return await subscription.get(timeout)
+        finally:
+            subscription.close()
+
+    def periodic(self, period, callback):
+        return self.loop.create_task(self._periodic(period, callback))
+
+    async def _periodic(self, period, callback):
+        deadline = self.loop.time()
+        while not self._stopped.done():
+            try:
+                result = callback()
+                if asyncio.iscoroutine(result):
+                    await result
+            except Exception as ex:
+                print("ERROR: Got exception in periodic task; " + str(ex) + "\n" + ''.join(traceback.format_tb(ex.__traceback__)))
+
+            deadline += period
+            now = self.loop.time()
+            if deadline < now:
+                if self.collect_stats:
+                    self.stats[-1][4] += 1
+                deadline = now  # overrun - skip missed ticks
+            await asyncio.sleep(deadline - now)
+
+
+_connection = None
+_processId = "unknown"
+_onStop = None
+
+
+def connection():
+    return _connection
+
+
+async def init(name, unique=False, onStop=None, host='localhost', port=1883):
+    global _connection, _processId, _onStop
+
+    _onStop = onStop
+
+    if 'PYROS_MQTT' in os.environ:
+        hostSplit = os.environ['PYROS_MQTT'].split(":")
+        host = hostSplit[0]
+        if len(hostSplit) == 2:
+            try:
+                port = int(hostSplit[1])
+            except ValueError:
+                pass
+
+    _connection = AsyncPyros(name, unique=unique, host=host, port=port)
+
+    print("    " + _connection.name + " waiting to connect to broker...")
+    await _connection.connect()
+    print("    " + _connection.name + " connected to broker.")
+
+    if len(sys.argv) > 1:
+        _processId = sys.argv[1]
+        print("Started " + _processId + " process. Setting up pyroslib.aio...")
+        _connection.loop.create_task(_handleSystem(_connection.subscribe("exec/" + _processId + "/system")))
+        _connection.loop.create_task(_handleStats(_connection.subscribe("exec/" + _processId + "/stats")))
+        _connection.loop.create_task(_handleProfile(_connection.subscribe("exec/" + _processId + "/profile")))
+
+    return _connection
+
+
+async def _handleSystem(subscription):
+    async for msg in subscription:
+        if msg.payload.strip() == "stop":
+            print("Confirming stop for service " + _processId)
+            publish("exec/" + _processId + "/system/stop", "stopped")
+            if _onStop is not None:
+                print("Invoking stop callback for service " + _processId)
+                result = _onStop()
+                if asyncio.iscoroutine(result):
+                    await result
+
+            await asyncio.sleep(0.5)
+            print("Stopping service " + _processId)
+            os._exit(0)
+
+
+async def _handleStats(subscription):
+    async for msg in subscription:
+        payload = msg.payload.strip()
+        if payload == "start":
+            _connection.collect_stats = True
+        elif payload == "stop":
+            _connection.collect_stats = False
+        elif payload == "read":
+            publish("exec/" + _processId + "/stats/out", "".join(",".join([str(v) for v in stat]) + "\n" for stat in _connection.stats))
+
+
+async def _handleProfile(subscription):
+    async for msg in subscription:
+        try:
+            # sampled from executor thread while event loop keeps running
+            stacks = await _connection.loop.run_in_executor(None, profiler.sampleStacks, float(msg.payload))
+            for chunk in profiler.collapsedChunks(stacks):
+                publish("exec/" + _processId + "/profile/out", chunk)
+        except Exception as ex:
+            print("ERROR: Got exception while profiling; " + str(ex) + "\n" + ''.join(traceback.format_tb(ex.__traceback__)))
+        publish("exec/" + _processId + "/profile/out", "")  # end of profile
+
+
+def isConnected():
+    return _connection is not None and _connection.isConnected()
+
+
+def publish(topic, payload):
+    _connection.publish(topic, payload)
+
+
+def subscribe(topic, max_queue=0):
+    return _connection.subscribe(topic, max_queue=max_queue)
+
+
+def subscribeBinary(topic, max_queue=0):
+    return _connection.subscribeBinary(topic, max_queue=max_queue)
+
+
+async def request(topic, payload, reply_topic, timeout=None, binary=False):
+    return await _connection.request(topic, payload, reply_topic, timeout=timeout, binary=binary)
+
+
+def periodic(period, callback):
+    return _connection.periodic(period, callback)
+
+
+async def forever():
+    await _connection.forever()
+
+
+def run(main):
+    try:
+        asyncio.run(main)
+    except Exception as ex:
+        print("ERROR: " + str(ex) + "\n" + ''.join(traceback.format_tb(ex.__traceback__)))
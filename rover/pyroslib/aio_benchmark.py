@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+
+#
+# Copyright 2016-2019 Games Creators Club
+#
+# MIT License
+#
+
+#
+# Compares blocking pyroslib loop with pyroslib.aio against a local broker (mosquitto).
+#
+#  - throughput: N messages published and received back through the broker on one connection
+#  - latency: sequential request/reply round trips through an echo subscriber
+#
+# Usage (from rover directory; running it directly would shadow stdlib logging with pyroslib/logging.py):
+#     python3 -m pyroslib.aio_benchmark [host[:port]]
+#
+
+import asyncio
+import subprocess
+import sys
+import time
+
+MESSAGES = 5000
+ROUND_TRIPS = 500
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def report(name, throughput, latencies):
+    print("{0:<8} {1:>12.0f} msg/s   p50 {2:>7.3f}ms   p99 {3:>7.3f}ms   max {4:>7.3f}ms".format(
+        name, throughput, percentile(latencies, 50) * 1000, percentile(latencies, 99) * 1000, max(latencies) * 1000))
+
+
+def benchmarkSync(host, port):
+    import pyroslib
+
+    received = [0]
+    pong = [None]
+
+    def handleBench(topic, payload):
+        received[0] += 1
+
+    def handlePing(topic, payload):
+        pyroslib.publish("bench/pong", payload)
+
+    def handlePong(topic, payload):
+        pong[0] = payload
+
+    pyroslib.subscribe("bench/sync/data", handleBench)
+    pyroslib.subscribe("bench/ping", handlePing)
+    pyroslib.subscribe("bench/pong", handlePong)
+    pyroslib.init("bench-sync", unique=True, host=host, port=port)
+    pyroslib.loop(0.5)
+
+    started = time.time()
+    for i in range(MESSAGES):
+        pyroslib.publish("bench/sync/data", str(i))
+        if i % 100 == 0:
+            pyroslib.loop(0.001)
+    while received[0] < MESSAGES and time.time() - started < 60:
+        pyroslib.loop(0.001)
+    throughput = received[0] / (time.time() - started)
+
+    latencies = []
+    for i in range(ROUND_TRIPS):
+        pong[0] = None
+        sent = time.time()
+        pyroslib.publish("bench/ping", str(i))
+        while pong[0] != str(i) and time.time() - sent < 5:
+            pyroslib.loop(0.001)
+        latencies.append(time.time() - sent)
+
+    report("sync", throughput, latencies)
+
+
+def benchmarkAsync(host, port):
+    import pyroslib.aio as aio
+
+    async def echo(subscription):
+        async for msg in subscription:
+            aio.publish("bench/pong", msg.payload)
+
+    async def main():
+        await aio.init("bench-async", unique=True, host=host, port=port)
+
+        data = aio.subscribe("bench/async/data")
+        echo_task = asyncio.get_event_loop().create_task(echo(aio.subscribe("bench/ping")))
+        await asyncio.sleep(0.5)
+
+        started = time.time()
+        for i in range(MESSAGES):
+            aio.publish("bench/async/data", str(i))
+            if i % 100 == 0:
+                await asyncio.sleep(0)
+        received = 0
+        try:
+            while received < MESSAGES:
+                await data.get(timeout=60)
+                received += 1
+        except asyncio.TimeoutError:
+            pass
+        throughput = received / (time.time() - started)
+
+        latencies = []
+        for i in range(ROUND_TRIPS):
+            sent = time.time()
+            await aio.request("bench/ping", str(i), "bench/pong", timeout=5)
+            latencies.append(time.time() - sent)
+
+        report("async", throughput, latencies)
+        aio.connection().stop()
+        await echo_task
+
+    aio.run(main())
+
+
+if __name__ == "__main__":
+    host, port = "localhost", 1883
+    if len(sys.argv) > 1 and sys.argv[1] not in ("sync", "async"):
+        hostSplit = sys.argv[1].split(":")
+        host = hostSplit[0]
+        if len(hostSplit) > 1:
+            port = int(hostSplit[1])
+        del sys.argv[1]
+
+    flavour = sys.argv[1] if len(sys.argv) > 1 else None
+    del sys.argv[1:]  # pyroslib would take next argument as process id
+
+    if flavour == "sync":
+        benchmarkSync(host, port)
+    elif flavour == "async":
+        benchmarkAsync(host, port)
+    else:
+        # pyroslib keeps its state in module globals so each flavour runs in its own process
+        for f in ["sync", "async"]:
+            subprocess.call([sys.executable, "-m", "pyroslib.aio_benchmark", host + ":" + str(port), f])
@@ -0,0 +1,77 @@
+
+#
+# Copyright 2016-2019 Games Creators Club
+#
+# MIT License
+#
+
+#
+# Sampling profiler used by 'pyros profile <processId> <seconds>'.
+#
+# Stacks of all other threads are sampled every PROFILE_INTERVAL from a separate thread and counted.
+# Result is in collapsed (folded) stack format - one line per distinct stack, frames from thread name
+# down to innermost function separated by ';', followed by space and number of samples - which is
+# what flamegraph.pl, speedscope and similar tools read.
+#
+
+import os
+import sys
+import threading
+import time
+
+PROFILE_INTERVAL = 0.005
+PROFILE_MAX_SECONDS = 300
+PROFILE_CHUNK_SIZE = 32 * 1024
+
+
+def _frameName(code):
+    return code.co_name + " (" + os.path.basename(code.co_filename) + ":" + str(code.co_firstlineno) + ")"
+
+
+# Returns dict of collapsed stack to number of samples it was seen in
+def sampleStacks(seconds, interval=PROFILE_INTERVAL):
+    stacks = {}
+    names = {}
+    me = threading.get_ident()
+    end = time.time() + min(seconds, PROFILE_MAX_SECONDS)
+    while time.time() < end:
+        for ident, frame in sys._current_frames().items():
+            if ident == me:
+                continue
+
+            if ident not in names:
+                names = {thread.ident: thread.name.replace(";", ":").replace(" ", "_") for thread in threading.enumerate()}
+
+            frames = []
+            while frame is not None:
+                frames.append(_frameName(frame.f_code))
+                frame = frame.f_back
+            frames.append(names.get(ident, str(ident)))
+            frames.reverse()
+
+            stack = ";".join(frames)
+            stacks[stack] = stacks.get(stack, 0) + 1
+
+        time.sleep(interval)
+
+    return stacks
+
+
+# Returns collapsed stack lines split to payloads of about PROFILE_CHUNK_SIZE bytes
+def collapsedChunks(stacks, chunkSize=PROFILE_CHUNK_SIZE):
+    chunks = []
+    lines = []
+    size = 0
+    for stack, count in sorted(stacks.items()):
+        line = stack + " " + str(count) + "\n"
+        lines.append(line)
+        size += len(line)
+        if size >= chunkSize:
+            chunks.append("".join(lines))
+            lines = []
+            size = 0
+
+    if len(lines) > 0:
+        chunks.append("".join(lines))
+
+    return chunks
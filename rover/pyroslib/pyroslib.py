@@ -7,14 +7,19 @@
 
 import os
 import sys
-import re
+import heapq
+import select
 import time
 import random
+import struct
 import traceback
 import threading
 import paho.mqtt.client as mqtt
 import multiprocessing
 
+from pyroslib.topics import TopicIndex
+from pyroslib import profiler
+
 client = None
 
 _name = "undefined"
@@ -30,6 +35,11 @@ PRIORITY_LOW = 0
 PRIORITY_NORMAL = 1
 PRIORITY_HIGH = 2
 
+SCHEDULER_POLLING = "polling"
+SCHEDULER_SELECT = "select"
+
+_scheduler = SCHEDULER_POLLING
+
 
 def doNothing():
     pass
@@ -39,16 +49,28 @@ _processId = "unknown"
 _onConnected = doNothing
 _onStop = doNothing
 _connected = False
+_connectedListeners = []  # see addConnectedListener
 
 _subscribers = []
-_regexTextToLambda = {}
-_regexBinaryToLambda = {}
+_topicIndex = TopicIndex()
 
 _collectStats = False
+_profiling = False
 
-_stats = [[0, 0, 0]]
+_stats = [[0, 0, 0, 0.0, 0, 0, 0]]  # tick time, sent, received, tick jitter, overruns, coalesced (dropped), bytes saved
 _received = False
 
+BATCH_FRAME_VERSION = 1
+
+_coalesced = {}
+_coalescedLock = threading.Lock()
+_nextFlushTime = None
+_coalescedDropped = 0
+_coalescedBytesSaved = 0
+
+_timers = []
+_timerSequence = 0
+
 
 def _setClusterId(cId):
     global _clusterId
@@ -73,6 +95,12 @@ def _addReceivedMessage():
     currentStats[2] = currentStats[2] + 1
 
 
+def _addCoalescedMessage(savedBytes):
+    currentStats = _stats[len(_stats) - 1]
+    currentStats[5] = currentStats[5] + 1
+    currentStats[6] = currentStats[6] + savedBytes
+
+
 def isConnected():
     return _connected
 
@@ -82,44 +110,203 @@ def getConnectionDetails():
 
 
 def publish(topic, message):
-    if _connected:
+    if topic in _coalesced:
+        _publishCoalesced(topic, message)
+    elif _connected:
         client.publish(topic, message)
         if _collectStats:
             _addSendMessage()
 
 
-def subscribe(topic, method):
-    _subscribers.append(topic)
-    regexString = "^" + topic.replace("+", "([^/]+)").replace("#", "(.*)") + "$"
-    regex = re.compile(regexString)
+class _CoalescedTopic:
+    __slots__ = ['window', 'batch_topic', 'message', 'pending', 'next_send']
+
+    def __init__(self, window, batch_topic):
+        self.window = window
+        self.batch_topic = batch_topic
+        self.message = None
+        self.pending = False
+        self.next_send = 0
+
 
+def coalesce(topic, window=0.1, batchTopic=None):
+    # Messages published to topic are coalesced: at most one message per window is sent and it is always the latest.
+    # If batchTopic is given, pending messages of all topics sharing it are sent in one frame (see subscribeBatch).
+    with _coalescedLock:
+        _coalesced[topic] = _CoalescedTopic(window, batchTopic)
+
+
+def uncoalesce(topic):
+    with _coalescedLock:
+        if topic in _coalesced:
+            entry = _coalesced[topic]
+            del _coalesced[topic]
+            if entry.pending:
+                publish(topic, entry.message)
+
+
+def coalescedStats():
+    return _coalescedDropped, _coalescedBytesSaved
+
+
+def _messageLen(message):
+    return len(message) if message is not None else 0
+
+
+def _publishCoalesced(topic, message):
+    global _nextFlushTime, _coalescedDropped, _coalescedBytesSaved
+
+    now = time.time()
+    with _coalescedLock:
+        entry = _coalesced.get(topic)
+        if entry is None:
+            return
+
+        if entry.pending:
+            saved = len(topic) + _messageLen(entry.message)
+            _coalescedDropped += 1
+            _coalescedBytesSaved += saved
+            if _collectStats:
+                _addCoalescedMessage(saved)
+
+        entry.message = message
+        if entry.batch_topic is None and entry.next_send <= now:
+            # leading edge - nothing sent in current window so no reason to delay it
+            entry.pending = False
+            entry.next_send = now + entry.window
+            send = True
+        else:
+            if not entry.pending and entry.next_send <= now:
+                entry.next_send = now + entry.window
+            entry.pending = True
+            if _nextFlushTime is None or entry.next_send < _nextFlushTime:
+                _nextFlushTime = entry.next_send
+            send = False
+
+    if send and _connected:
+        client.publish(topic, message)
+        if _collectStats:
+            _addSendMessage()
+
+
+def _flushCoalesced():
+    global _nextFlushTime
+
+    now = time.time()
+    if _nextFlushTime is None or now < _nextFlushTime:
+        return
+
+    messages = []
+    batches = {}
+    with _coalescedLock:
+        for topic, entry in _coalesced.items():
+            if entry.pending and entry.next_send <= now:
+                entry.pending = False
+                entry.next_send = now + entry.window
+                if entry.batch_topic is None:
+                    messages.append((topic, entry.message))
+                else:
+                    if entry.batch_topic not in batches:
+                        batches[entry.batch_topic] = []
+                    batches[entry.batch_topic].append((topic, entry.message))
+
+        _nextFlushTime = None
+        for topic, entry in _coalesced.items():
+            if entry.pending:
+                if entry.batch_topic in batches:
+                    # not due yet but can piggyback on a frame that is going out anyway
+                    entry.pending = False
+                    entry.next_send = now + entry.window
+                    batches[entry.batch_topic].append((topic, entry.message))
+                elif _nextFlushTime is None or entry.next_send < _nextFlushTime:
+                    _nextFlushTime = entry.next_send
+
+    if _connected:
+        for topic, message in messages:
+            client.publish(topic, message)
+        for batchTopic in batches:
+            client.publish(batchTopic, encodeBatch(batches[batchTopic]))
+        if _collectStats:
+            for _ in range(len(messages) + len(batches)):
+                _addSendMessage()
+
+
+def encodeBatch(messages):
+    frame = bytearray(struct.pack('<B', BATCH_FRAME_VERSION))
+    for topic, message in messages:
+        topicBytes = bytes(topic, 'utf-8')
+        if isinstance(message, str):
+            message = bytes(message, 'utf-8')
+        elif message is None:
+            message = b''
+        elif not isinstance(message, (bytes, bytearray)):
+            message = bytes(str(message), 'utf-8')
+        frame += struct.pack('<H', len(topicBytes))
+        frame += topicBytes
+        frame += struct.pack('<I', len(message))
+        frame += message
+    return bytes(frame)
+
+
+def decodeBatch(frame):
+    if len(frame) == 0 or frame[0] != BATCH_FRAME_VERSION:
+        raise ValueError("Unsupported batch frame version")
+
+    messages = []
+    ptr = 1
+    length = len(frame)
+    while ptr < length:
+        topicLen = struct.unpack_from('<H', frame, ptr)[0]
+        ptr += 2
+        topic = str(frame[ptr:ptr + topicLen], 'utf-8')
+        ptr += topicLen
+        messageLen = struct.unpack_from('<I', frame, ptr)[0]
+        ptr += 4
+        messages.append((topic, frame[ptr:ptr + messageLen]))
+        ptr += messageLen
+    return messages
+
+
+def _handleBatch(topic, payload):
+    for batchedTopic, message in decodeBatch(payload):
+        _dispatch(batchedTopic, message)
+
+
+def subscribeBatch(batchTopic):
+    # Batch frames are unpacked and each message is dispatched to handlers subscribed to its own topic
+    subscribeBinary(batchTopic, _handleBatch)
+
+
+def _handlerDetails(method):
     has_self = hasattr(method, '__self__')
     all_args_count = (3 + (1 if has_self else 0))
 
     has_groups = method.__code__.co_argcount == all_args_count
-    _regexTextToLambda[regex] = (has_groups, method)
 
     if DEBUG_SUBSCRIBE:
         print("*** stored method " + str(method) + " with has group " + str(has_groups) + " and it self is " + str(has_self) + ", expected arg no " + str(all_args_count))
 
-    if _connected:
-        client.subscribe(topic, 0)
+    return has_groups, method
 
 
-def subscribeBinary(topic, method):
-    _subscribers.append(topic)
-    regexString = "^" + topic.replace("+", "([^/]+)").replace("#", "(.*)") + "$"
-    regex = re.compile(regexString)
+# Adds callback invoked each time client (re)connects, after onConnected given to init - for libraries
+# which need to refresh their state after reconnecting
+def addConnectedListener(callback):
+    if callback not in _connectedListeners:
+        _connectedListeners.append(callback)
 
-    has_self = hasattr(method, '__self__')
-    all_args_count = (3 + (1 if has_self else 0))
 
-    has_groups = method.__code__.co_argcount == all_args_count
+def subscribe(topic, method):
+    _subscribers.append(topic)
+    _topicIndex.add(topic, _handlerDetails(method))
 
-    _regexBinaryToLambda[regex] = (has_groups, method)
+    if _connected:
+        client.subscribe(topic, 0)
 
-    if DEBUG_SUBSCRIBE:
-        print("*** stored method " + str(method) + " with has group " + str(has_groups) + " and it self is " + str(has_self) + ", expected arg no " + str(all_args_count))
+
+def subscribeBinary(topic, method):
+    _subscribers.append(topic)
+    _topicIndex.add(topic, _handlerDetails(method), binary=True)
 
     if _connected:
         client.subscribe(topic, 0)
@@ -129,33 +316,23 @@ def unsubscribe(topic):
     if _connected:
         client.unsubscribe(topic)
 
-    regexString = "^" + topic.replace("+", "([^/]+)").replace("#", "(.*)") + "$"
-    regex = re.compile(regexString)
-
-    if regex in _regexBinaryToLambda:
-        del _regexBinaryToLambda[regex]
-
-    if regex in _regexTextToLambda:
-        del _regexTextToLambda[regex]
+    _topicIndex.remove(topic)
 
 
 def subscribedMethod(topic):
-    regexString = "^" + topic.replace("+", "([^/]+)").replace("#", "(.*)") + "$"
-    regex = re.compile(regexString)
-
-    if regex in _regexTextToLambda:
-        return _regexTextToLambda[regex]
+    return _topicIndex.find(topic)
 
-    if regex in _regexBinaryToLambda:
-        return _regexBinaryToLambda[regex]
 
-    return None
+def _addTickStats(tickTime, jitter):
+    _stats.append([tickTime, 0, 0, jitter, 0, 0, 0])
+    if len(_stats) > 100:
+        del _stats[0]
 
 
 def _sendStats():
     msg = ""
     for stat in _stats:
-        msg = msg + str(stat[0]) + "," + str(stat[1]) + "," + str(stat[2]) + "\n"
+        msg = msg + ",".join([str(v) for v in stat]) + "\n"
 
     publish("exec/" + _processId + "/stats/out", msg)
 
@@ -171,6 +348,35 @@ def _handleStats(topic, payload, groups):
         _sendStats()
 
 
+def _handleProfile(topic, payload, groups):
+    global _profiling
+
+    def profile(seconds):
+        global _profiling
+
+        try:
+            print("Profiling " + _processId + " for " + str(seconds) + "s")
+            for chunk in profiler.collapsedChunks(profiler.sampleStacks(seconds)):
+                publish("exec/" + _processId + "/profile/out", chunk)
+        except Exception as ex:
+            print("ERROR: Got exception while profiling; " + str(ex) + "\n" + ''.join(traceback.format_tb(ex.__traceback__)))
+        finally:
+            _profiling = False
+            publish("exec/" + _processId + "/profile/out", "")  # end of profile
+
+    try:
+        seconds = float(payload)
+    except ValueError:
+        print("ERROR: Profile needs number of seconds, not '" + payload + "'")
+        publish("exec/" + _processId + "/profile/out", "")
+        return
+
+    if not _profiling:
+        _profiling = True
+        thread = threading.Thread(target=profile, args=(seconds,), daemon=True)
+        thread.start()
+
+
 def _handleSystem(topic, payload, groups):
     def waitForProcessStop():
         print("Confirming stop for service " + _processId)
@@ -202,6 +408,11 @@ def _onConnect(mqttClient, data, flags, rc):
             mqttClient.subscribe(subscriber, 0)
         if _onConnected is not None:
             _onConnected()
+        for listener in _connectedListeners:
+            try:
+                listener()
+            except Exception as ex:
+                print("ERROR: Got exception in connected listener; " + str(ex) + "\n" + ''.join(traceback.format_tb(ex.__traceback__)))
 
     else:
         print("ERROR: Connection returned error result: " + str(rc))
@@ -219,35 +430,20 @@ def _onMessage(mqttClient, data, msg):
         _addReceivedMessage()
 
     try:
-        for regex in _regexTextToLambda:
-            matching = regex.match(topic)
-            if matching:
-                payload = str(msg.payload, 'utf-8')
-
-                invokeHandler(topic, payload, matching.groups(), _regexTextToLambda[regex])
+        _dispatch(topic, msg.payload)
+    except Exception as ex:
+        print("ERROR: Got exception in on message processing; " + str(ex) + "\n" + ''.join(traceback.format_tb(ex.__traceback__)))
 
-                # (has_groups, method) = _regexTextToLambda[regex]
-                # if has_groups:
-                #     method(topic, payload, matching.groups())
-                # else:
-                #     method(topic, payload)
 
-                return
+def _dispatch(topic, payload):
+    text, binaries = _topicIndex.match(topic)
+    if text is not None:
+        details, groups = text
+        invokeHandler(topic, str(payload, 'utf-8'), groups, details)
+        return
 
-        for regex in _regexBinaryToLambda:
-            matching = regex.match(topic)
-            if matching:
-                invokeHandler(topic, msg.payload, matching.groups(), _regexBinaryToLambda[regex])
-
-                # (has_groups, method) = _regexBinaryToLambda[regex]
-                # if has_groups:
-                #     method(topic, msg.payload, matching.groups())
-                # else:
-                #     method(topic, msg.payload)
-                # return
-
-    except Exception as ex:
-        print("ERROR: Got exception in on message processing; " + str(ex) + "\n" + ''.join(traceback.format_tb(ex.__traceback__)))
+    for details, groups in binaries:
+        invokeHandler(topic, payload, groups, details)
 
 
 def invokeHandler(topic, message, groups, details):
@@ -288,7 +484,7 @@ def onDisconnect(mqttClient, data, rc):
     _connect()
 
 
-def init(name, unique=False, onConnected=None, onStop=None, waitToConnect=True, host='localhost', port=1883):
+def init(name, unique=False, onConnected=None, onStop=None, waitToConnect=True, host='localhost', port=1883, scheduler=None):
     global client, _connected, _onConnected, _onStop, _name, _processId, _host, _port, _loop_sleep, _client_loop
 
     _onConnected = onConnected
@@ -321,6 +517,12 @@ def init(name, unique=False, onConnected=None, onStop=None, waitToConnect=True,
     if 'PYROS_CLUSTER_ID' in os.environ:
         _setClusterId(os.environ['PYROS_CLUSTER_ID'])
 
+    if scheduler is None and 'PYROS_SCHEDULER' in os.environ:
+        scheduler = os.environ['PYROS_SCHEDULER']
+
+    if scheduler is not None:
+        setScheduler(scheduler)
+
     if host is not None:
         connect(host, port, waitToConnect)
 
@@ -332,6 +534,7 @@ def init(name, unique=False, onConnected=None, onStop=None, waitToConnect=True,
         else:
             print("Started " + _processId + " process on " + getClusterId() + " clustered pyros. Setting up pyroslib...")
         subscribe("exec/" + _processId + "/stats", _handleStats)
+        subscribe("exec/" + _processId + "/profile", _handleProfile)
         subscribe("exec/" + _processId + "/system", _handleSystem)
     else:
         print("No processId argument supplied.")
@@ -366,9 +569,108 @@ def sleep(deltaTime):
     loop(deltaTime)
 
 
+def setScheduler(scheduler):
+    global _scheduler
+
+    if scheduler != SCHEDULER_POLLING and scheduler != SCHEDULER_SELECT:
+        raise ValueError("Unknown scheduler " + str(scheduler))
+
+    _scheduler = scheduler
+
+
+def getScheduler():
+    return _scheduler
+
+
+def schedule(period, callback):
+    global _timerSequence
+
+    _timerSequence += 1
+    heapq.heappush(_timers, [time.time() + period, _timerSequence, period, callback])
+
+
+def _waitForMessages(timeout):
+    # Blocks on MQTT socket until something arrives or timeout passes. Returns True if anything was read.
+    try:
+        sock = client.socket()
+        if sock is None:
+            # not connected (yet) - reconnecting is done in separate thread
+            time.sleep(min(timeout, 0.02))
+            return False
+
+        writeList = [sock] if client.want_write() else []
+        readable, writable, _ = select.select([sock], writeList, [], timeout if timeout > 0 else 0)
+
+        if len(readable) > 0:
+            client.loop_read(10)
+        if len(writable) > 0:
+            client.loop_write()
+        client.loop_misc()
+
+        return len(readable) > 0
+    except BaseException as ex:
+        print("MQTT Client Loop Exception: " + str(ex) + "\n" + ''.join(traceback.format_tb(ex.__traceback__)))
+        return False
+
+
+def _selectLoop(until, inner):
+    currentTime = time.time()
+    while True:
+        waitUntil = until
+        if _nextFlushTime is not None and _nextFlushTime < waitUntil:
+            waitUntil = _nextFlushTime
+        if _waitForMessages(waitUntil - currentTime) and inner is not None:
+            inner()
+        _flushCoalesced()
+        currentTime = time.time()
+        if currentTime >= until:
+            return
+
+
+def _invokeTimer(timer):
+    try:
+        timer[3]()
+    except BaseException as ex:
+        print("ERROR: Got exception in timer; " + str(ex) + "\n" + ''.join(traceback.format_tb(ex.__traceback__)))
+
+
+def _selectForever(deltaTime, outer, inner):
+    mainTimer = [time.time(), 0, deltaTime, outer]
+    heapq.heappush(_timers, mainTimer)
+
+    while True:
+        timer = _timers[0]
+        deadline = timer[0]
+        currentTime = time.time()
+        if currentTime < deadline:
+            _selectLoop(deadline, inner)
+            currentTime = time.time()
+
+        heapq.heappop(_timers)
+        if timer is mainTimer and _collectStats:
+            _addTickStats(deadline, currentTime - deadline)
+
+        if timer[3] is not None:
+            _invokeTimer(timer)
+
+        nextDeadline = deadline + timer[2]
+        currentTime = time.time()
+        if nextDeadline < currentTime:
+            # overrun - skip missed ticks instead of firing them all at once
+            if timer is mainTimer and _collectStats:
+                _stats[len(_stats) - 1][4] += 1
+            nextDeadline = currentTime
+        timer[0] = nextDeadline
+        heapq.heappush(_timers, timer)
+
+
 def loop(deltaTime, inner=None, loop_sleep=None, priority=PRIORITY_NORMAL):
     global _received
 
+    if _scheduler == SCHEDULER_SELECT:
+        _selectLoop(time.time() + deltaTime, inner)
+        return
+
     if loop_sleep is None:
         if priority == PRIORITY_LOW:
             loop_sleep = 0.05
@@ -378,6 +680,7 @@ def loop(deltaTime, inner=None, loop_sleep=None, priority=PRIORITY_NORMAL):
     def client_loop():
         try:
             client.loop(_client_loop)  # wait for 0.5 ms
+            _flushCoalesced()
         except BaseException as ex:
             print("MQTT Client Loop Exception: " + str(ex) + "\n" + ''.join(traceback.format_tb(ex.__traceback__)))
 
@@ -403,14 +706,16 @@ def loop(deltaTime, inner=None, loop_sleep=None, priority=PRIORITY_NORMAL):
 def forever(deltaTime, outer=None, inner=None, loop_sleep=None, priority=PRIORITY_NORMAL):
     global _received
 
+    if _scheduler == SCHEDULER_SELECT:
+        _selectForever(deltaTime, outer, inner)
+        return
+
     currentTime = time.time()
     nextTime = currentTime
 
     while True:
         if _collectStats:
-            _stats.append([nextTime, 0, 0])
-            if len(_stats) > 100:
-                del _stats[0]
+            _addTickStats(nextTime, time.time() - nextTime)
 
         nextTime = nextTime + deltaTime
         try:
@@ -423,6 +728,8 @@ def forever(deltaTime, outer=None, inner=None, loop_sleep=None, priority=PRIORIT
 
         sleepTime = nextTime - currentTime
         if sleepTime < _loop_sleep:
+            if sleepTime < 0 and _collectStats:
+                _stats[len(_stats) - 1][4] += 1
             nextTime = currentTime
 
             _received = False
@@ -432,6 +739,7 @@ def forever(deltaTime, outer=None, inner=None, loop_sleep=None, priority=PRIORIT
                 _received = True
                 count -= 1
                 client.loop(_client_loop)  # wait for 0.1 ms
+            _flushCoalesced()
 
         else:
             loop(sleepTime, inner=inner, loop_sleep=loop_sleep, priority=priority)
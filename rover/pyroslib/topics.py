@@ -0,0 +1,185 @@
+
+#
+# Copyright 2016-2019 Games Creators Club
+#
+# MIT License
+#
+
+#
+# Subscription index keyed on MQTT topic levels.
+#
+# Each subscribed topic is split on '/' and stored in a trie. Levels '+' and '#' are
+# stored in separate slots of a node so a lookup only follows the literal level of the
+# received topic plus the two wildcard slots, instead of running every subscription's
+# regex. Groups are captured the same way pyroslib's old regexes did: '+' captures one
+# (non empty) level and '#' captures the rest of the topic.
+#
+# Text and binary handlers are kept apart as pyroslib treats them differently: first
+# (oldest) matching text handler wins, otherwise all matching binary handlers are invoked.
+#
+
+MAX_CACHED_TOPICS = 1024
+
+
+class _TopicNode:
+    __slots__ = ['children', 'plus', 'hash', 'text', 'binary']
+
+    def __init__(self):
+        self.children = {}
+        self.plus = None
+        self.hash = None
+        self.text = None  # (order, details)
+        self.binary = None  # (order, details)
+
+    def isEmpty(self):
+        return len(self.children) == 0 and self.plus is None and self.hash is None and self.text is None and self.binary is None
+
+
+class TopicIndex:
+    def __init__(self):
+        self._root = _TopicNode()
+        self._order = 0
+        self._size = 0
+        self._cache = {}
+
+    def __len__(self):
+        return self._size
+
+    def _node(self, topic, create):
+        node = self._root
+        for level in topic.split("/"):
+            if level == "+":
+                if node.plus is None:
+                    if not create:
+                        return None
+                    node.plus = _TopicNode()
+                node = node.plus
+            elif level == "#":
+                if node.hash is None:
+                    if not create:
+                        return None
+                    node.hash = _TopicNode()
+                node = node.hash
+            else:
+                child = node.children.get(level)
+                if child is None:
+                    if not create:
+                        return None
+                    child = _TopicNode()
+                    node.children[level] = child
+                node = child
+        return node
+
+    def add(self, topic, details, binary=False):
+        node = self._node(topic, True)
+        existing = node.binary if binary else node.text
+        if existing is None:
+            self._order += 1
+            self._size += 1
+            entry = (self._order, details)
+        else:
+            entry = (existing[0], details)  # re-subscribing keeps original position
+
+        if binary:
+            node.binary = entry
+        else:
+            node.text = entry
+
+        self._cache.clear()
+
+    def remove(self, topic):
+        path = []
+        node = self._root
+        for level in topic.split("/"):
+            path.append((node, level))
+            if level == "+":
+                node = node.plus
+            elif level == "#":
+                node = node.hash
+            else:
+                node = node.children.get(level)
+            if node is None:
+                return False
+
+        if node.text is None and node.binary is None:
+            return False
+
+        if node.text is not None:
+            self._size -= 1
+        if node.binary is not None:
+            self._size -= 1
+        node.text = None
+        node.binary = None
+
+        # prune empty branches
+        while len(path) > 0 and node.isEmpty():
+            parent, level = path.pop()
+            if level == "+":
+                parent.plus = None
+            elif level == "#":
+                parent.hash = None
+            else:
+                del parent.children[level]
+            node = parent
+
+        self._cache.clear()
+        return True
+
+    def find(self, topic):
+        node = self._node(topic, False)
+        if node is not None:
+            if node.text is not None:
+                return node.text[1]
+            if node.binary is not None:
+                return node.binary[1]
+        return None
+
+    # Returns (text, binaries) where text is None or (details, groups) of the first subscribed
+    # text handler and binaries is a list of (details, groups) in subscription order.
+    def match(self, topic):
+        result = self._cache.get(topic)
+        if result is not None:
+            return result
+
+        levels = topic.split("/")
+        levels_len = len(levels)
+
+        text = None
+        binaries = []
+
+        stack = [(self._root, 0, ())]
+        while len(stack) > 0:
+            node, i, groups = stack.pop()
+
+            hash_node = node.hash
+            if hash_node is not None and i < levels_len:
+                hash_groups = groups + ("/".join(levels[i:]),)
+                if hash_node.text is not None and (text is None or hash_node.text[0] < text[0]):
+                    text = (hash_node.text[0], hash_node.text[1], hash_groups)
+                if hash_node.binary is not None:
+                    binaries.append((hash_node.binary[0], hash_node.binary[1], hash_groups))
+
+            if i == levels_len:
+                if node.text is not None and (text is None or node.text[0] < text[0]):
+                    text = (node.text[0], node.text[1], groups)
+                if node.binary is not None:
+                    binaries.append((node.binary[0], node.binary[1], groups))
+                continue
+
+            level = levels[i]
+            child = node.children.get(level)
+            if child is not None:
+                stack.append((child, i + 1, groups))
+            if node.plus is not None and level != "":
+                stack.append((node.plus, i + 1, groups + (level,)))
+
+        if len(binaries) > 1:
+            binaries.sort(key=lambda b: b[0])
+
+        result = (None if text is None else (text[1], text[2]), [(b[1], b[2]) for b in binaries])
+
+        if len(self._cache) >= MAX_CACHED_TOPICS:
+            self._cache.clear()
+        self._cache[topic] = result
+
+        return result
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+
+#
+# Copyright 2016-2019 Games Creators Club
+#
+# MIT License
+#
+
+#
+# Micro benchmark of topic dispatch: old linear regex scan against TopicIndex.
+#
+# Run from this directory: python3 topics_benchmark.py
+#
+
+import re
+import time
+
+from topics import TopicIndex
+
+MESSAGES = 200000
+
+
+def makeSubscriptions(count):
+    # status topics are subscribed last (as in AgentClass.connected) so linear scan has to pass the rest
+    hot_topics = ["wheel/speed/status", "wheel/deg/status", "sensor/distance", "sensor/heading/data", "wheel/+/deg", "wheel/+/speed", "storage/write/#"]
+    topics = []
+    i = 0
+    while len(topics) < count - len(hot_topics):
+        topics.append("agent" + str(i) + "/command")
+        topics.append("agent" + str(i) + "/feedback/+")
+        topics.append("exec/process" + str(i) + "/system")
+        i += 1
+    return topics[:count - len(hot_topics)] + hot_topics
+
+
+def received():
+    return ["wheel/speed/status", "wheel/deg/status", "sensor/distance", "wheel/fl/deg", "storage/write/wheels/cal/fl/deg/0"]
+
+
+def benchmarkRegex(subscriptions, topics):
+    regexes = {}
+    for topic in subscriptions:
+        regexes[re.compile("^" + topic.replace("+", "([^/]+)").replace("#", "(.*)") + "$")] = (False, None)
+
+    started = time.time()
+    for i in range(MESSAGES):
+        topic = topics[i % len(topics)]
+        for regex in regexes:
+            matching = regex.match(topic)
+            if matching:
+                matching.groups()
+                break
+    return MESSAGES / (time.time() - started)
+
+
+def benchmarkIndex(subscriptions, topics, cached=True):
+    index = TopicIndex()
+    for topic in subscriptions:
+        index.add(topic, (False, None))
+
+    started = time.time()
+    for i in range(MESSAGES):
+        if not cached:
+            index._cache.clear()
+        index.match(topics[i % len(topics)])
+    return MESSAGES / (time.time() - started)
+
+
+if __name__ == "__main__":
+    print("{0:<15} {1:>15} {2:>15} {3:>15}".format("subscriptions", "regex msg/s", "trie msg/s", "cached msg/s"))
+    for count in [10, 50, 200]:
+        subs = makeSubscriptions(count)
+        print("{0:<15} {1:>15.0f} {2:>15.0f} {3:>15.0f}".format(
+            count,
+            benchmarkRegex(subs, received()),
+            benchmarkIndex(subs, received(), cached=False),
+            benchmarkIndex(subs, received())))
@@ -10,4 +10,4 @@ fi
 
 echo ""
 echo Uploading        $SERVICE
-pyros $1 upload       $SERVICE $DIR/pyroslib.py -e $DIR/logging.py $DIR/__init__.py
+pyros $1 upload       $SERVICE $DIR/pyroslib.py -e $DIR/logging.py $DIR/topics.py $DIR/aio.py $DIR/profiler.py $DIR/__init__.py
@@ -0,0 +1,8 @@
+
+#
+# Copyright 2016-2019 Games Creators Club
+#
+# MIT License
+#
+
+from statuslib.statuslib import *
@@ -0,0 +1,311 @@
+
+#
+# Copyright 2016-2019 Games Creators Club
+#
+# MIT License
+#
+
+#
+# Wire format of status topics published every cycle:
+#
+#     wheel/speed/status  - timestamp, odo and status of each wheel
+#     wheel/deg/status    - timestamp, angle and status of each wheel
+#     sensor/distance     - timestamp, distance and range status of each radar sensor
+#
+# Each topic exists in two flavours:
+#
+#  - text on the topic itself ('1.5,120,0,...' and '0:230 45:120 ... timestamp:1.5 status:00...'),
+#    exactly as before
+#  - struct packed binary on <topic>/bin; each frame starts with version and message type bytes
+#    followed by little endian timestamp (double), values (unsigned shorts) and statuses (bytes)
+#
+# Binary is negotiated: consumer announces '<topic> <version>' on status/format where version is
+# the highest it can decode and producer starts publishing binary frames once it sees a version it
+# can produce. Consumer reads text until binary frames arrive (and ignores text while they do), so it
+# works with old producers, too. Producers ask consumers to re-announce on status/format/query when
+# they start.
+#
+# By default producers keep publishing text and binary is published on top of it, so consumers which
+# read text without statuslib keep working. Once all consumers are converted, producer can be created
+# with text=TEXT_AUTO: after binary is negotiated it stops publishing text unless some consumer announced
+# text ('<topic> 0') in last TEXT_EXPIRY_PERIODS announce periods - or with text=False for binary only.
+#
+# Decoders accept both, bytes and str, so handlers can be subscribed to either flavour.
+#
+
+import pyroslib
+import struct
+import time
+
+WIRE_VERSION = 1
+TEXT_VERSION = 0  # announced by consumers which read text only
+
+BINARY_SUFFIX = "/bin"
+FORMAT_TOPIC = "status/format"
+FORMAT_QUERY_TOPIC = "status/format/query"
+
+ANNOUNCE_PERIOD = 5  # seconds
+TEXT_EXPIRY_PERIODS = 3  # announce periods after last text consumer announcement text is still published
+
+TEXT_AUTO = 'auto'  # publish text until binary is negotiated and while text consumers announce themselves
+
+MSG_TYPE_WHEEL_SPEED = 1
+MSG_TYPE_WHEEL_DEG = 2
+MSG_TYPE_RADAR = 3
+
+WHEEL_NAMES = ['fl', 'fr', 'bl', 'br']
+RADAR_ANGLES = [0, 45, 90, 135, 180, 225, 270, 315]
+
+WHEEL_SPEED_TOPIC = "wheel/speed/status"
+WHEEL_DEG_TOPIC = "wheel/deg/status"
+RADAR_TOPIC = "sensor/distance"
+
+_HEADER = struct.Struct('<BBd')
+_WHEELS = struct.Struct('<BBd4H4B')
+_RADAR = struct.Struct('<BBd8H8B')
+
+_TOPIC_MSG_TYPES = {WHEEL_SPEED_TOPIC: MSG_TYPE_WHEEL_SPEED, WHEEL_DEG_TOPIC: MSG_TYPE_WHEEL_DEG, RADAR_TOPIC: MSG_TYPE_RADAR}
+
+_publishers = {}
+_consumers = {}
+
+
+def _isBinary(payload):
+    return isinstance(payload, (bytes, bytearray, memoryview))
+
+
+def _distance(distance):
+    if distance < 0:
+        return 0
+    if distance > 0xFFFE:
+        return 0xFFFE
+    return distance
+
+
+def _checkHeader(payload, msg_type, size):
+    if len(payload) < _HEADER.size:
+        raise ValueError("Status frame too short; " + str(len(payload)) + " bytes")
+    version = payload[0]
+    if version != WIRE_VERSION:
+        raise ValueError("Unsupported status frame version " + str(version))
+    if payload[1] != msg_type:
+        raise ValueError("Unexpected status frame type " + str(payload[1]) + ", expected " + str(msg_type))
+    if len(payload) != size:
+        raise ValueError("Status frame has wrong size " + str(len(payload)) + ", expected " + str(size))
+
+
+#
+# Wheels (wheel/speed/status and wheel/deg/status)
+#
+# values and statuses are lists in WHEEL_NAMES order. None (text '-') value is sent as 0xFFFF.
+#
+
+def encodeWheelStatus(msg_type, timestamp, values, statuses):
+    return _WHEELS.pack(WIRE_VERSION, msg_type, timestamp,
+                        0xFFFF if values[0] is None else values[0] & 0xFFFF,
+                        0xFFFF if values[1] is None else values[1] & 0xFFFF,
+                        0xFFFF if values[2] is None else values[2] & 0xFFFF,
+                        0xFFFF if values[3] is None else values[3] & 0xFFFF,
+                        statuses[0] & 0xFF, statuses[1] & 0xFF, statuses[2] & 0xFF, statuses[3] & 0xFF)
+
+
+def encodeWheelStatusText(timestamp, values, statuses):
+    return ",".join([str(timestamp),
+                     "-" if values[0] is None else str(values[0]), str(statuses[0]),
+                     "-" if values[1] is None else str(values[1]), str(statuses[1]),
+                     "-" if values[2] is None else str(values[2]), str(statuses[2]),
+                     "-" if values[3] is None else str(values[3]), str(statuses[3])])
+
+
+# Returns (timestamp, values, statuses) where values and statuses are dicts keyed by wheel name.
+def decodeWheelStatus(payload, msg_type=None):
+    if _isBinary(payload):
+        data = _WHEELS.unpack(payload) if len(payload) == _WHEELS.size else None
+        if data is None or data[0] != WIRE_VERSION or (msg_type is not None and data[1] != msg_type):
+            _checkHeader(payload, payload[1] if msg_type is None and len(payload) > 1 else msg_type, _WHEELS.size)
+        values = dict(zip(WHEEL_NAMES, data[3:7]))
+        if 0xFFFF in values.values():
+            values = {k: None if v == 0xFFFF else v for k, v in values.items()}
+        return data[2], values, dict(zip(WHEEL_NAMES, data[7:11]))
+
+    data = payload.split(",")
+    values = {}
+    statuses = {}
+    for i in range(4):
+        value = data[i * 2 + 1]
+        values[WHEEL_NAMES[i]] = None if value == "-" else int(float(value))
+        statuses[WHEEL_NAMES[i]] = int(data[i * 2 + 2])
+    return float(data[0]), values, statuses
+
+
+#
+# Radar (sensor/distance)
+#
+# distances and statuses are dicts keyed by angle (RADAR_ANGLES).
+#
+
+def encodeRadar(timestamp, distances, statuses):
+    return _RADAR.pack(WIRE_VERSION, MSG_TYPE_RADAR, timestamp,
+                       _distance(distances[0]), _distance(distances[45]), _distance(distances[90]), _distance(distances[135]),
+                       _distance(distances[180]), _distance(distances[225]), _distance(distances[270]), _distance(distances[315]),
+                       statuses[0] & 0xFF, statuses[45] & 0xFF, statuses[90] & 0xFF, statuses[135] & 0xFF,
+                       statuses[180] & 0xFF, statuses[225] & 0xFF, statuses[270] & 0xFF, statuses[315] & 0xFF)
+
+
+def encodeRadarText(timestamp, distances, statuses):
+    return " ".join([str(a) + ":" + str(distances[a]) for a in RADAR_ANGLES]) + \
+        " timestamp:" + str(timestamp) + \
+        " status:" + "".join(["{0:02x}".format(statuses[a] & 0xFF) for a in RADAR_ANGLES])
+
+
+# Returns (timestamp, distances, statuses) where distances and statuses are dicts keyed by angle.
+def decodeRadar(payload):
+    if _isBinary(payload):
+        data = _RADAR.unpack(payload) if len(payload) == _RADAR.size else None
+        if data is None or data[0] != WIRE_VERSION or data[1] != MSG_TYPE_RADAR:
+            _checkHeader(payload, MSG_TYPE_RADAR, _RADAR.size)
+        return data[2], dict(zip(RADAR_ANGLES, data[3:11])), dict(zip(RADAR_ANGLES, data[11:19]))
+
+    timestamp = None
+    distances = {}
+    statuses = {}
+    for kv in payload.split(" "):
+        k, v = kv.split(":")
+        if k == 'timestamp':
+            timestamp = float(v)
+        elif k == 'status':
+            i = 0
+            for angle in RADAR_ANGLES:
+                statuses[angle] = int(v[i:i + 2], 16)
+                i += 2
+        else:
+            distances[int(k)] = int(v)
+    return timestamp, distances, statuses
+
+
+#
+# Producer side
+#
+
+class StatusPublisher:
+    def __init__(self, topic, text=True):
+        self.topic = topic
+        self.binaryTopic = topic + BINARY_SUFFIX
+        self.msgType = _TOPIC_MSG_TYPES[topic]
+        self.text = text
+        self.binary = False
+        self.lastTextConsumer = 0
+        self.textPublished = text is not False
+
+    def _publishText(self):
+        if self.text != TEXT_AUTO:
+            return self.text
+
+        publishText = not self.binary or self.lastTextConsumer + TEXT_EXPIRY_PERIODS * ANNOUNCE_PERIOD >= time.time()
+        if publishText != self.textPublished:
+            self.textPublished = publishText
+            print("    " + ("Text consumer announced, publishing text for " if publishText else "No text consumers, stopped publishing text for ") + self.topic)
+        return publishText
+
+    def publish(self, timestamp, values, statuses):
+        text = self._publishText()
+        if self.msgType == MSG_TYPE_RADAR:
+            if text:
+                pyroslib.publish(self.topic, encodeRadarText(timestamp, values, statuses))
+            if self.binary:
+                pyroslib.publish(self.binaryTopic, encodeRadar(timestamp, values, statuses))
+        else:
+            if text:
+                pyroslib.publish(self.topic, encodeWheelStatusText(timestamp, values, statuses))
+            if self.binary:
+                pyroslib.publish(self.binaryTopic, encodeWheelStatus(self.msgType, timestamp, values, statuses))
+
+
+def _handleFormat(topic, message, groups):
+    split = message.split(" ")
+    if len(split) == 2 and split[0] in _publishers:
+        try:
+            version = int(split[1])
+        except ValueError:
+            return
+        statusPublisher = _publishers[split[0]]
+        if version == TEXT_VERSION:
+            statusPublisher.lastTextConsumer = time.time()
+        elif version >= WIRE_VERSION and not statusPublisher.binary:
+            statusPublisher.binary = True
+            print("    Consumer requested binary format for " + statusPublisher.topic)
+
+
+# Call before pyroslib.init. text is True to always publish text (default), TEXT_AUTO (see above) or
+# False for binary frames only (once negotiated).
+def publisher(topic, text=True):
+    if len(_publishers) == 0:
+        pyroslib.subscribe(FORMAT_TOPIC, _handleFormat)
+
+    statusPublisher = StatusPublisher(topic, text)
+    _publishers[topic] = statusPublisher
+    return statusPublisher
+
+
+# Call after pyroslib.init so consumers which are already running announce themselves again.
+def queryConsumers():
+    pyroslib.publish(FORMAT_QUERY_TOPIC, " ".join(_publishers))
+
+
+#
+# Consumer side
+#
+
+class _StatusConsumer:
+    def __init__(self, topic, handler):
+        self.topic = topic
+        self.handler = handler
+        self.lastBinary = 0
+        self.lastAnnounced = 0
+
+    def announce(self):
+        if pyroslib.isConnected():
+            self.lastAnnounced = time.time()
+            pyroslib.publish(FORMAT_TOPIC, self.topic + " " + str(WIRE_VERSION))
+
+    # Text is ignored while binary frames are coming; text subscription stays so consumer
+    # goes back to text if producer is replaced by one which does not publish binary
+    def handleText(self, topic, message, groups):
+        now = time.time()
+        if self.lastBinary + ANNOUNCE_PERIOD >= now:
+            return
+        if self.lastAnnounced + ANNOUNCE_PERIOD < now:
+            self.announce()
+        self.handler(topic, message, groups)
+
+    def handleBinary(self, topic, payload, groups):
+        self.lastBinary = time.time()
+        self.handler(self.topic, payload, groups)
+
+
+def _handleQuery(topic, message, groups):
+    topics = message.split(" ")
+    for consumer in _consumers.values():
+        if consumer.topic in topics:
+            consumer.announce()
+
+
+# Subscribes handler(topic, payload, groups) to status topic. Payload is str until producer
+# switches to binary and bytes after that - use decodeWheelStatus/decodeRadar to read it.
+def subscribe(topic, handler):
+    if len(_consumers) == 0:
+        pyroslib.subscribe(FORMAT_QUERY_TOPIC, _handleQuery)
+
+    consumer = _StatusConsumer(topic, handler)
+    _consumers[topic] = consumer
+    pyroslib.subscribe(topic, consumer.handleText)
+    pyroslib.subscribeBinary(topic + BINARY_SUFFIX, consumer.handleBinary)
+    consumer.announce()
+
+
+def unsubscribe(topic):
+    consumer = _consumers.get(topic)
+    if consumer is not None:
+        del _consumers[topic]
+        pyroslib.unsubscribe(topic)
+        pyroslib.unsubscribe(topic + BINARY_SUFFIX)
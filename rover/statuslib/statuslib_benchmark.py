@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+
+#
+# Copyright 2016-2019 Games Creators Club
+#
+# MIT License
+#
+
+#
+# Encode and decode cost per message of status topics: text format (as it was built and parsed
+# by wheels service, vl53l1x service and Rover) against binary statuslib frames.
+#
+# Usage (from rover directory):
+#     python3 -m statuslib.statuslib_benchmark
+#
+
+import time
+
+from statuslib import statuslib
+
+MESSAGES = 100000
+
+WHEEL_NAMES = statuslib.WHEEL_NAMES
+RADAR_ANGLES = statuslib.RADAR_ANGLES
+
+
+def oldWheelsEncode(timestamp, values, statuses):
+    return ",".join([str(f) for f in [timestamp, values[0], statuses[0], values[1], statuses[1], values[2], statuses[2], values[3], statuses[3]]])
+
+
+def oldWheelsDecode(message):
+    data = message.split(",")
+    t = float(data[0])
+    odos = {}
+    odos_status = {}
+    for i in range(4):
+        data_index = i * 2
+        odos[WHEEL_NAMES[i]] = int(data[data_index + 1])
+        odos_status[WHEEL_NAMES[i]] = int(data[data_index + 2])
+    return t, odos, odos_status
+
+
+def oldRadarEncode(timestamp, distances, status_str):
+    radar = {a: distances[a] for a in RADAR_ANGLES}
+    radar['timestamp'] = timestamp
+    radar['status'] = status_str
+    return " ".join([":".join([str(v) for v in kv]) for kv in radar.items()])
+
+
+def oldRadarDecode(message):
+    values = [v.split(":") for v in message.split(" ")]
+    radar_values = {}
+    radar_status = {}
+    radar_time = None
+    for (k, v) in values:
+        if k == 'timestamp':
+            radar_time = float(v)
+        elif k == 'status':
+            i = 0
+            for angle in RADAR_ANGLES:
+                radar_status[angle] = int(v[i:i + 2], 16)
+                i += 2
+        else:
+            radar_values[int(k)] = int(v)
+    return radar_time, radar_values, radar_status
+
+
+def measure(f, *args):
+    started = time.perf_counter()
+    for _ in range(MESSAGES):
+        f(*args)
+    return (time.perf_counter() - started) * 1000000 / MESSAGES
+
+
+def report(name, size, encode, decode):
+    print("{0:<20} {1:>6} {2:>10.2f} {3:>10.2f}".format(name, size, encode, decode))
+
+
+if __name__ == "__main__":
+    now = time.time()
+    odos = [4011, 35120, 812, 65000]
+    wheel_statuses = [0, 0, 32, 0]
+    distances = {0: 1230, 45: 871, 90: 136, 135: 2013, 180: 1, 225: 1, 270: 412, 315: 96}
+    radar_statuses = {0: 0, 45: 0, 90: 2, 135: 0, 180: 0, 225: 0, 270: 0, 315: 7}
+    radar_status_str = "".join(["{0:02x}".format(radar_statuses[a]) for a in RADAR_ANGLES])
+
+    print("{0:<20} {1:>6} {2:>10} {3:>10}".format("format", "bytes", "enc us", "dec us"))
+
+    message = oldWheelsEncode(now, odos, wheel_statuses)
+    report("wheels text (old)", len(message), measure(oldWheelsEncode, now, odos, wheel_statuses), measure(oldWheelsDecode, message))
+
+    message = statuslib.encodeWheelStatusText(now, odos, wheel_statuses)
+    report("wheels text", len(message), measure(statuslib.encodeWheelStatusText, now, odos, wheel_statuses), measure(statuslib.decodeWheelStatus, message))
+
+    frame = statuslib.encodeWheelStatus(statuslib.MSG_TYPE_WHEEL_SPEED, now, odos, wheel_statuses)
+    report("wheels binary", len(frame), measure(statuslib.encodeWheelStatus, statuslib.MSG_TYPE_WHEEL_SPEED, now, odos, wheel_statuses), measure(statuslib.decodeWheelStatus, frame))
+
+    message = oldRadarEncode(now, distances, radar_status_str)
+    report("radar text (old)", len(message), measure(oldRadarEncode, now, distances, radar_status_str), measure(oldRadarDecode, message))
+
+    message = statuslib.encodeRadarText(now, distances, radar_statuses)
+    report("radar text", len(message), measure(statuslib.encodeRadarText, now, distances, radar_statuses), measure(statuslib.decodeRadar, message))
+
+    frame = statuslib.encodeRadar(now, distances, radar_statuses)
+    report("radar binary", len(frame), measure(statuslib.encodeRadar, now, distances, radar_statuses), measure(statuslib.decodeRadar, frame))
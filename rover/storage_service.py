@@ -6,7 +6,9 @@
 # MIT License
 #
 
+import collections
 import os
+import threading
 import time
 import traceback
 import pyroslib
@@ -22,7 +24,46 @@ DEBUG = False
 
 STORAGE_MAP_FILE = os.path.expanduser('~') + "/rover-storage.config"
 
+#
+# Changes are not written to the storage map file straight away. They are collected for
+# WRITE_DEBOUNCE seconds (repeated writes of the same key in that time are written only once)
+# and then appended to the journal file next to it in the same 'path=value' format. When the
+# journal grows over COMPACT_JOURNAL_SIZE, whole map is written to a temporary file which is
+# then renamed over the storage map file (so it is never half written) and the journal is removed.
+# On load storage map file is read first and then the journal, if there is one, on top of it.
+# Flushing and compacting are done under storageFileLock as stop callback flushes from another thread.
+#
+
+STORAGE_JOURNAL_FILE = STORAGE_MAP_FILE + ".journal"
+WRITE_DEBOUNCE = 0.5  # seconds
+COMPACT_JOURNAL_SIZE = 64 * 1024  # bytes
+
+#
+# Besides storage/write/<path> and storage/read/<path> for one value at the time there is bulk protocol:
+#
+#  storage/bulk/read/<path>  - all values under path (or all values for storage/bulk/read) are sent as
+#                              one message to topic given in payload, or to storage/bulk/values/<path>
+#  storage/bulk/write        - 'path=value' lines, all of them written at once
+#  storage/changes           - sent by this service after each write which changed anything, with changed values
+#  storage/sync              - '<version> <topic>': all changes since version are sent to topic, or if they
+#                              are not kept any more (or service was restarted since), all values with ' all'
+#                              after version
+#
+# Payloads of all of them are 'path=value' lines, same as in the storage map file, after '; version <epoch>:<n>'
+# line. Version is incremented with each storage/changes message; epoch changes when service is restarted.
+# Values written with storage/bulk/write are not sent to storage/write/<path>.
+#
+
+CHANGE_HISTORY = 200  # number of storage/changes messages kept for storage/sync
+
 storageMap = {}
+storageEpoch = str(int(time.time()))
+storageVersion = 0
+changeHistory = collections.deque(maxlen=CHANGE_HISTORY)  # (version, changes)
+pendingChanges = {}  # path to value, in order of first change
+firstPendingChange = 0
+journalSize = 0
+storageFileLock = threading.RLock()  # compactStorage is called from within flushStorage
 
 
 def addPaths(p1, p2):
@@ -41,31 +82,93 @@ def writeLocalStorage(m):
             else:
                 f.write(p + "=" + str(v) + "\n")
 
-    with open(STORAGE_MAP_FILE, 'wt') as file:
+    with open(STORAGE_MAP_FILE + ".tmp", 'wt') as file:
         file.write("; storage written at " + time.ctime(time.time()) + "\n")
         writeLayer(file, m, "")
+        file.flush()
+        os.fsync(file.fileno())
+    os.rename(STORAGE_MAP_FILE + ".tmp", STORAGE_MAP_FILE)
+
+
+def appendToJournal(changes):
+    global journalSize
+
+    data = bytes("".join([k + "=" + str(v) + "\n" for k, v in changes.items()]), 'utf-8')
+    fd = os.open(STORAGE_JOURNAL_FILE, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+    try:
+        os.write(fd, data)
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+    journalSize += len(data)
+
+
+def compactStorage():
+    global journalSize
+
+    with storageFileLock:
+        writeLocalStorage(storageMap)
+        if os.path.exists(STORAGE_JOURNAL_FILE):
+            os.remove(STORAGE_JOURNAL_FILE)
+        journalSize = 0
+
+
+def flushStorage(force=False):
+    global pendingChanges
+
+    with storageFileLock:
+        if len(pendingChanges) > 0 and (force or time.time() - firstPendingChange >= WRITE_DEBOUNCE):
+            changes = pendingChanges
+            pendingChanges = {}
+            if DEBUG:
+                print("Writing " + str(len(changes)) + " changes to storage journal")
+            appendToJournal(changes)
+
+        if journalSize > COMPACT_JOURNAL_SIZE:
+            if DEBUG:
+                print("Compacting storage journal of " + str(journalSize) + " bytes")
+            compactStorage()
+
+
+# Returns (path, value) or None for comments and lines without value
+def _parseLine(line):
+    line = line.strip()
+    if not line.startswith(";"):
+        i = line.find("=")
+        if i > 0:
+            return line[0:i], line[i + 1:]
+    return None
+
+
+def _readLines(filename):
+    count = 0
+    with open(filename, "rt") as file:
+        for line in file:
+            entry = _parseLine(line)
+            if entry is not None:
+                storeValue(entry[0].split("/"), entry[1])
+                count += 1
+    return count
 
 
 def loadStorageMap():
-    global storageMap
+    global storageMap, pendingChanges, journalSize
 
     storageMap = {}
-
-    if os.path.exists(STORAGE_MAP_FILE):
-        lines = []
-        with open(STORAGE_MAP_FILE, "rt") as file:
-            lines = file.readlines()
-
-        for line in lines:
-            line = line.strip()
-            if not line.startswith(";"):
-                i = line.find("=")
-                if i > 0:
-                    k = line[0:i]
-                    v = line[i + 1:]
-                    writeStorage(k.split("/"), v)
-
-        print("  Storage map is " + str(storageMap))
+    pendingChanges = {}
+    journalSize = 0
+
+    if os.path.exists(STORAGE_MAP_FILE) or os.path.exists(STORAGE_JOURNAL_FILE):
+        count = 0
+        if os.path.exists(STORAGE_MAP_FILE):
+            count += _readLines(STORAGE_MAP_FILE)
+        if os.path.exists(STORAGE_JOURNAL_FILE):
+            count += _readLines(STORAGE_JOURNAL_FILE)
+            compactStorage()
+
+        print("  Storage map loaded, " + str(count) + " entries")
+        if DEBUG:
+            print("  Storage map is " + str(storageMap))
     else:
         print("  No storage map found @ " + STORAGE_MAP_FILE)
 
@@ -86,8 +189,8 @@ def readoutStorage():
     pyroslib.publish("storage/values", _composeRecursively(storageMap, ""))
 
 
-def writeStorage(splitPath, value):
-    # print("Got storage value " + str(topicSplit))
+# Returns True if value was changed
+def storeValue(splitPath, value):
     change = False
 
     m = storageMap
@@ -95,7 +198,7 @@ def writeStorage(splitPath, value):
         key = str(splitPath[i])
         if key not in m:
             if value == "":
-                return  # empty string means no data. No data - no change.
+                return False  # empty string means no data. No data - no change.
             m[key] = {}
             change = True
         m = m[key]
@@ -105,11 +208,79 @@ def writeStorage(splitPath, value):
         change = True
         m[key] = value
 
-    if change:
+    return change
+
+
+# Returns True if value was changed
+def writeStorage(splitPath, value):
+    global firstPendingChange
+
+    # print("Got storage value " + str(topicSplit))
+    if storeValue(splitPath, value):
         if DEBUG:
             print("Storing to storage " + str(splitPath) + " = " + value)
 
-        writeLocalStorage(storageMap)
+        path = "/".join([str(k) for k in splitPath])
+        with storageFileLock:
+            if len(pendingChanges) == 0:
+                firstPendingChange = time.time()
+            pendingChanges.pop(path, None)  # keeps changes in order they are made
+            pendingChanges[path] = value
+        return True
+
+    return False
+
+
+def _versionLine(suffix=""):
+    return "; version " + storageEpoch + ":" + str(storageVersion) + suffix + "\n"
+
+
+def _composeChanges(changes):
+    return "".join([path + "=" + str(value) + "\n" for path, value in changes.items()])
+
+
+def publishChanges(changes):
+    global storageVersion
+
+    if len(changes) > 0:
+        storageVersion += 1
+        changeHistory.append((storageVersion, changes))
+        pyroslib.publish("storage/changes", _versionLine() + _composeChanges(changes))
+
+
+def bulkReadStorage(path, topic):
+    if path == "":
+        values = _composeRecursively(storageMap, "")
+    else:
+        values = ""
+        m = storageMap
+        splitPath = path.split("/")
+        for key in splitPath[0:-1]:
+            m = m.get(key) if isinstance(m, dict) else None
+            if m is None:
+                break
+        if isinstance(m, dict) and splitPath[-1] in m:
+            v = m[splitPath[-1]]
+            if isinstance(v, dict):
+                values = _composeRecursively(v, path + "/")
+            else:
+                values = path + "=" + str(v) + "\n"
+
+    pyroslib.publish(topic, _versionLine() + values)
+
+
+# Sends all changes since given version or, if they are not kept any more, all values
+def syncStorage(version, topic):
+    epoch, _, since = version.partition(":")
+    if epoch == storageEpoch and since.isdigit() and \
+            (int(since) >= storageVersion or (len(changeHistory) > 0 and changeHistory[0][0] <= int(since) + 1)):
+        changes = {}
+        for v, c in changeHistory:
+            if v > int(since):
+                changes.update(c)
+        pyroslib.publish(topic, _versionLine() + _composeChanges(changes))
+    else:
+        pyroslib.publish(topic, _versionLine(" all") + _composeRecursively(storageMap, ""))
 
 
 def readStorage(splitPath):
@@ -152,7 +323,28 @@ def _readRecursively(path, m):
 
 
 def storageWriteTopic(topic, payload, groups):
-    writeStorage(groups[0].split("/"), payload)
+    if writeStorage(groups[0].split("/"), payload):
+        publishChanges({groups[0]: payload})
+
+
+def storageBulkWriteTopic(topic, payload, groups):
+    changes = {}
+    for line in payload.split("\n"):
+        entry = _parseLine(line)
+        if entry is not None and writeStorage(entry[0].split("/"), entry[1]):
+            changes.pop(entry[0], None)
+            changes[entry[0]] = entry[1]
+    publishChanges(changes)
+
+
+def storageBulkReadTopic(topic, payload, groups):
+    path = groups[0] if len(groups) > 0 else ""
+    bulkReadStorage(path, payload if payload != "" else "storage/bulk/values/" + path)
+
+
+def storageSyncTopic(topic, payload, groups):
+    version, _, reply_topic = payload.partition(" ")
+    syncStorage(version, reply_topic)
 
 
 def storageReadAllTopic(topic, payload, groups):
@@ -174,11 +366,15 @@ if __name__ == "__main__":
         pyroslib.subscribe("storage/write/#", storageWriteTopic)
         pyroslib.subscribe("storage/read/#", storageReadSpecificTopic)
         pyroslib.subscribe("storage/read", storageReadAllTopic)
-        pyroslib.init("storage-service")
+        pyroslib.subscribe("storage/bulk/write", storageBulkWriteTopic)
+        pyroslib.subscribe("storage/bulk/read/#", storageBulkReadTopic)
+        pyroslib.subscribe("storage/bulk/read", storageBulkReadTopic)
+        pyroslib.subscribe("storage/sync", storageSyncTopic)
+        pyroslib.init("storage-service", onStop=lambda: flushStorage(True))
 
         print("Started storage service.")
 
-        pyroslib.forever(0.5, priority=pyroslib.PRIORITY_LOW)
+        pyroslib.forever(0.5, flushStorage, priority=pyroslib.PRIORITY_LOW)
 
     except Exception as ex:
         print("ERROR: " + str(ex) + "\n" + ''.join(traceback.format_tb(ex.__traceback__)))
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+
+#
+# Copyright 2019 Games Creators Club
+#
+# MIT License
+#
+
+#
+# Burst of calibration like writes (few keys changed over and over, as CalibrateWheelScreen and
+# CalibratePIDScreen do) to a large storage map: rewriting whole storage map file on every change
+# against debounced journal with compaction. Shows bytes written (what wears SD card out), number
+# of write calls, fsyncs, time spent in storage service per change and time to load the map back.
+#
+# Writes are 20ms apart on a simulated clock, so the benchmark itself does not wait.
+#
+# Usage (from rover directory):
+#     python3 storage_service_benchmark.py
+#
+
+import os
+import shutil
+import tempfile
+import time
+
+import storage_service
+
+KEYS = 2000
+WRITES = 1000
+WRITE_INTERVAL = 0.02
+CALIBRATION_KEYS = ['wheels/cal/' + w + '/' + k for w in ['fl', 'fr', 'bl', 'br'] for k in ['steer/0', 'steer/90', 'pid/p', 'pid/i']]
+
+
+class SimulatedClock:
+    def __init__(self):
+        self.now = time.time()
+
+    def time(self):
+        return self.now
+
+    def ctime(self, t):
+        return time.ctime(t)
+
+
+class Counters:
+    # bytes passed to write calls and number of write calls of this process (Linux only)
+    @staticmethod
+    def read():
+        counters = {}
+        with open("/proc/self/io", "rt") as f:
+            for line in f:
+                name, value = line.split(":")
+                counters[name] = int(value)
+        return counters['wchar'], counters['syscw']
+
+
+def makeMap():
+    storage_service.storageMap = {}
+    for i in range(KEYS):
+        storage_service.storeValue(("config/group" + str(i // 20) + "/key" + str(i)).split("/"), str(i * 1.5))
+    for key in CALIBRATION_KEYS:
+        storage_service.storeValue(key.split("/"), "0")
+
+
+def run(name, change):
+    makeMap()
+    storage_service.compactStorage()
+
+    fsyncs = [0]
+    fsync = os.fsync
+
+    def countingFsync(fd):
+        fsyncs[0] += 1
+        fsync(fd)
+
+    os.fsync = countingFsync
+    clock = SimulatedClock()
+    storage_service.time = clock
+    try:
+        wchar, syscw = Counters.read()
+        started = time.perf_counter()
+        for i in range(WRITES):
+            clock.now += WRITE_INTERVAL
+            change(CALIBRATION_KEYS[i % len(CALIBRATION_KEYS)].split("/"), str(i))
+        clock.now += storage_service.WRITE_DEBOUNCE
+        storage_service.flushStorage(True)
+        elapsed = time.perf_counter() - started
+        new_wchar, new_syscw = Counters.read()
+    finally:
+        os.fsync = fsync
+        storage_service.time = time
+
+    expected = storage_service.storageMap
+    started = time.perf_counter()
+    storage_service.loadStorageMap()
+    load_time = time.perf_counter() - started
+    if storage_service.storageMap != expected:
+        raise ValueError(name + " did not load back the same storage map")
+
+    print("{0:<10} {1:>12} {2:>8} {3:>8} {4:>10.1f} {5:>10.1f}".format(name, new_wchar - wchar, new_syscw - syscw, fsyncs[0], elapsed * 1000000 / WRITES, load_time * 1000))
+
+
+def rewrite(splitPath, value):
+    if storage_service.storeValue(splitPath, value):
+        storage_service.writeLocalStorage(storage_service.storageMap)
+
+
+def journal(splitPath, value):
+    storage_service.writeStorage(splitPath, value)
+    storage_service.flushStorage()  # pyroslib.forever calls it every 0.5s; here after every change
+
+
+if __name__ == "__main__":
+    directory = tempfile.mkdtemp()
+    storage_service.STORAGE_MAP_FILE = os.path.join(directory, "rover-storage.config")
+    storage_service.STORAGE_JOURNAL_FILE = storage_service.STORAGE_MAP_FILE + ".journal"
+    try:
+        print(str(WRITES) + " writes of " + str(len(CALIBRATION_KEYS)) + " keys, " + str(WRITE_INTERVAL * 1000) + "ms apart, to map of " + str(KEYS) + " keys")
+        print("{0:<10} {1:>12} {2:>8} {3:>8} {4:>10} {5:>10}".format("mode", "bytes", "writes", "fsyncs", "us/change", "load ms"))
+        run("rewrite", rewrite)
+        run("journal", journal)
+    finally:
+        shutil.rmtree(directory)
@@ -7,12 +7,71 @@
 
 import traceback
 import pyroslib
-import time
+import uuid
+
+#
+# Subscribed paths are read with storage/bulk/read/<path> - all values under the path come in one
+# message, to this client's own topic - and are kept up to date from storage/changes. Each
+# storage/changes message has a version; when one is missed (or storage service was restarted, or
+# this client reconnected) all changes since last seen version are requested with one storage/sync
+# message. See storage_service.py for the protocol.
+#
+# Version is taken only from replies to this client's requests and from storage/changes, never
+# from values other clients asked for.
+#
 
 _firstValues = {}
+_paths = []  # subscribed paths
+_version = None  # (epoch, n) of last seen change
+_clientId = str(uuid.uuid4())[0:8]
+_syncTopic = "storage/synced/" + _clientId
+_valuesTopic = "storage/bulk/reply/" + _clientId  # followed by path
+_subscribed = False
+_bindings = {}  # path to StorageValue
 storageMap = {}
 
 
+#
+# Value at one path parsed to given type - see bind. Kept up to date as values arrive, so reading it is
+# just reading value attribute. Callbacks are invoked with the StorageValue when parsed value changes.
+#
+class StorageValue:
+    def __init__(self, path, value_type, default):
+        self.path = path
+        self.value_type = value_type
+        self.value = default
+        self.callbacks = []
+
+    def get(self):
+        return self.value
+
+    def onChange(self, callback):
+        self.callbacks.append(callback)
+        return self
+
+    def _parse(self, raw):
+        if self.value_type is int:
+            return int(float(raw))  # stored ints are often written as floats
+        if self.value_type is bool:
+            return str(raw).lower() in ['true', '1', 'yes', 'on']
+        return self.value_type(raw)
+
+    def _update(self, raw):
+        try:
+            value = self._parse(raw)
+        except (TypeError, ValueError):
+            print("ERROR: Cannot parse " + str(raw) + " at " + self.path + " as " + self.value_type.__name__)
+            return
+
+        if value != self.value:
+            self.value = value
+            for callback in self.callbacks:
+                try:
+                    callback(self)
+                except Exception as ex:
+                    print("ERROR: Got exception in storage callback for " + self.path + "; " + str(ex) + "\n" + ''.join(traceback.format_tb(ex.__traceback__)))
+
+
 def hasDataAt(path):
     value = read(path)
     return value is not None and value != ""
@@ -36,35 +95,37 @@ def read(path):
 
 
 def write(path, value):
-    splitPath = path.split("/")
-
-    m = storageMap
-    for i in range(0, len(splitPath) - 1):
-        key = splitPath[i]
-        if key not in m:
-            if value == "":
-                return  # empty string means no data. No data - no change.
-            m[key] = {}
-            change = True
-        m = m[key]
-    key = splitPath[len(splitPath) - 1]
-    m[key] = value
+    _storeValue(path, value)
 
     pyroslib.publish("storage/write/" + path, value)
 
 
-def _handleValues(topic, message, groups):
-    global _firstValues
+# Returns StorageValue for path with value parsed as value_type (int, float, str, bool or any function
+# taking string), default until there is a value. Same path always gives the same StorageValue.
+def bind(path, value_type=str, default=None):
+    binding = _bindings.get(path)
+    if binding is None:
+        binding = StorageValue(path, value_type, default)
+        _bindings[path] = binding
+        value = read(path)
+        if value is not None and not isinstance(value, dict):
+            binding._update(value)
+    elif binding.value_type is not value_type:
+        raise ValueError("Path " + path + " is already bound as " + binding.value_type.__name__)
+
+    return binding
+
 
-    change = False
-    value = message
-    splitPath = topic.split("/")
-    del splitPath[0]
-    del splitPath[0]
+# Writes dict of path to value with one message
+def writeMany(values):
+    for path, value in values.items():
+        _storeValue(path, value)
 
-    topic = "/".join(splitPath)
-    if topic in _firstValues:
-        del _firstValues[topic]
+    pyroslib.publish("storage/bulk/write", "".join([path + "=" + str(value) + "\n" for path, value in values.items()]))
+
+
+def _storeValue(path, value):
+    splitPath = path.split("/")
 
     m = storageMap
     for i in range(0, len(splitPath) - 1):
@@ -73,35 +134,121 @@ def _handleValues(topic, message, groups):
             if value == "":
                 return  # empty string means no data. No data - no change.
             m[key] = {}
-            change = True
         m = m[key]
     key = splitPath[len(splitPath) - 1]
 
     if (key not in m and value != "") or (key in m and m[key] != value):
-        change = True
         m[key] = value
+        if path in _bindings:
+            _bindings[path]._update(value)
+
+
+def _isSubscribed(path):
+    for p in _paths:
+        if path == p or path.startswith(p + "/"):
+            return True
+    return False
+
+
+# Returns (epoch, n) from the first line of bulk message (or None) and the rest of its lines
+def _parseBulk(payload):
+    lines = payload.split("\n")
+    version = None
+    if lines[0].startswith("; version "):
+        epoch, _, n = lines[0][len("; version "):].split(" ")[0].partition(":")
+        version = (epoch, int(n))
+    return version, lines[1:]
+
+
+def _applyBulk(lines):
+    for line in lines:
+        i = line.find("=")
+        if i > 0 and _isSubscribed(line[0:i]):
+            _storeValue(line[0:i], line[i + 1:])
+
+
+def _handleBulkValues(topic, message, groups):
+    global _version
+
+    path = groups[0]
+    for p in list(_firstValues):
+        if p == path or p.startswith(path + "/"):
+            del _firstValues[p]
+
+    version, lines = _parseBulk(message)
+    _applyBulk(lines)
+    if version is not None and (_version is None or _version[0] != version[0] or _version[1] < version[1]):
+        _version = version
+
+
+def _handleSynced(topic, message, groups):
+    global _version
+
+    version, lines = _parseBulk(message)
+    _applyBulk(lines)
+    if version is not None:
+        _version = version
+
+
+def _handleChanges(topic, message, groups):
+    global _version
+
+    version, lines = _parseBulk(message)
+    if version is None:
+        return
+
+    _applyBulk(lines)
+    if _version is not None and (version[0] != _version[0] or version[1] > _version[1] + 1):
+        resync()  # missed some changes
+    elif _version is None or version[1] > _version[1]:
+        _version = version
+
+
+def _subscribe():
+    global _subscribed
+
+    if not _subscribed:
+        _subscribed = True
+        pyroslib.subscribe(_valuesTopic + "/#", _handleBulkValues)
+        pyroslib.subscribe("storage/changes", _handleChanges)
+        pyroslib.subscribe(_syncTopic, _handleSynced)
+        pyroslib.addConnectedListener(_handleConnected)
+
+
+def _handleConnected():
+    if len(_paths) > 0:
+        resync()
+
+
+def _requestValues(path):
+    pyroslib.publish("storage/bulk/read/" + path, _valuesTopic + "/" + path)
+
+
+# Requests all changes of subscribed values since last seen change with one message - called on each reconnect
+def resync():
+    if _version is None:
+        for path in _paths:
+            _requestValues(path)
+    else:
+        pyroslib.publish("storage/sync", _version[0] + ":" + str(_version[1]) + " " + _syncTopic)
 
 
 def subscribeToPath(path):
-    topic = "storage/write/" + path
-    pyroslib.subscribe(topic, _handleValues)
+    _subscribe()
+    if path not in _paths:
+        _paths.append(path)
 
     _firstValues[path] = None
 
-    topic = "storage/read/" + path
-    pyroslib.publish(topic, "")
+    _requestValues(path)
 
 
 def subscribeWithPrototype(prefix, protoMap):
-    for key in protoMap:
-        if prefix is None or prefix is dict:
-            path = key
-        else:
-            path = prefix + "/" + key
-        if type(protoMap[key]) is dict:
-            subscribeWithPrototype(path, protoMap[key])
-        else:
-            subscribeToPath(path)
+    if prefix is None or prefix == "":
+        for key in protoMap:
+            subscribeToPath(key)
+    else:
+        subscribeToPath(prefix)  # whole subtree comes in one message
 
 
 def bulkPopulateIfEmpty(prefix, protoMap):
@@ -135,8 +282,7 @@ def waitForData():
     while len(_firstValues) > 0:
         try:
             for path in _firstValues:
-                topic = "storage/read/" + path
-                pyroslib.publish(topic, "")
+                _requestValues(path)
             pyroslib.loop(1)
         except Exception as ex:
             print("ERROR: Got exception in main loop; " + str(ex) + "\n" + ''.join(traceback.format_tb(ex.__traceback__)))
@@ -7,6 +7,9 @@
 
 from telemetry.telemetry_stream import *
 from telemetry.telemetry_storage import *
+from telemetry.telemetry_file_storage import *
+from telemetry.telemetry_registry import *
+from telemetry.telemetry_ring import *
 from telemetry.telemetry_logger import *
 from telemetry.telemetry_server import *
 from telemetry.telemetry_pyros_logger import *
@@ -0,0 +1,129 @@
+
+#
+# Copyright 2019 Games Creators Club
+#
+# MIT License
+#
+
+#
+# Server side reduction of retrieved records (numpy is needed only here and only when it is used).
+#
+# aggregate splits records to time buckets and produces one record per bucket where each field is
+# min, max, mean or last of the field in that bucket. Timestamp of produced record is start of the
+# bucket, or timestamp of last record for 'last'. Fields which are not numbers (strings and bytes)
+# always take last value.
+#
+# Variable length streams are reduced over their fixed size fields (see
+# TelemetryStreamDefinition.splitVarLenRecords); variable length fields are taken from the last record
+# of the bucket, or from the selected record for decimate.
+#
+# decimate selects given number of records with Largest-Triangle-Three-Buckets over one field,
+# so shape of a graph of that field is kept.
+#
+# Both return records of the same stream, back to back, so they can be decoded as any retrieved records.
+#
+
+import numpy
+
+AGGREGATE_MIN = 'min'
+AGGREGATE_MAX = 'max'
+AGGREGATE_MEAN = 'mean'
+AGGREGATE_LAST = 'last'
+
+AGGREGATE_FUNCTIONS = [AGGREGATE_MIN, AGGREGATE_MAX, AGGREGATE_MEAN, AGGREGATE_LAST]
+
+
+# Returns numpy array of records (of fixed size fields only for variable length streams) and list of
+# variable length fields of each record (None for fixed length streams)
+def _records(stream, views):
+    payload = views[0] if len(views) == 1 else b''.join(views)
+    if stream.fixed_length is not None:
+        return numpy.frombuffer(payload, dtype=stream.numpyDtype()), None
+
+    fixed, varlen = stream.splitVarLenRecords(payload)
+    return numpy.frombuffer(fixed, dtype=stream.fixedDtype()), varlen
+
+
+# Returns result records as stored - for variable length streams with variable length fields of records
+# at given indexes put back
+def _result(stream, result, varlen, indexes):
+    if varlen is None:
+        return result.tobytes()
+    return stream.joinVarLenRecords(result.tobytes(), b''.join([varlen[i] for i in indexes]))
+
+
+def aggregate(stream, views, from_timestamp, bucket, function):
+    if function not in AGGREGATE_FUNCTIONS:
+        raise ValueError("Unknown aggregate function " + str(function))
+    if bucket <= 0:
+        raise ValueError("Bucket must be positive, got " + str(bucket))
+
+    records, varlen = _records(stream, views)
+    if len(records) == 0:
+        return b''
+
+    timestamps = records['timestamp']
+    keys = numpy.floor((timestamps - from_timestamp) / bucket).astype(numpy.int64)
+    starts = numpy.concatenate(([0], numpy.flatnonzero(numpy.diff(keys)) + 1))
+    ends = numpy.concatenate((starts[1:], [len(records)]))
+
+    result = numpy.empty(len(starts), dtype=records.dtype)
+    if function == AGGREGATE_LAST:
+        result['timestamp'] = timestamps[ends - 1]
+    else:
+        result['timestamp'] = from_timestamp + keys[starts] * bucket
+
+    for name in records.dtype.names[1:]:
+        column = records[name]
+        kind = column.dtype.kind
+        if kind not in 'iuf' or function == AGGREGATE_LAST:
+            result[name] = column[ends - 1]
+        elif function == AGGREGATE_MIN:
+            result[name] = numpy.minimum.reduceat(column, starts)
+        elif function == AGGREGATE_MAX:
+            result[name] = numpy.maximum.reduceat(column, starts)
+        else:
+            mean = numpy.add.reduceat(column.astype(numpy.float64), starts) / (ends - starts)
+            result[name] = mean if kind == 'f' else numpy.rint(mean)
+
+    return _result(stream, result, varlen, ends - 1)
+
+
+def decimate(stream, views, points, field):
+    if points < 3:
+        raise ValueError("Decimating needs at least 3 points, got " + str(points))
+
+    records, varlen = _records(stream, views)
+    count = len(records)
+    if points >= count:
+        return _result(stream, records, varlen, range(count))
+
+    x = records['timestamp']
+    y = records[field].astype(numpy.float64)
+
+    # first and last are always selected, others are split to points - 2 buckets
+    edges = numpy.linspace(1, count - 1, points - 1).astype(numpy.int64)
+    selected = numpy.empty(points, dtype=numpy.int64)
+    selected[0] = 0
+    selected[points - 1] = count - 1
+
+    a = 0
+    for i in range(points - 2):
+        start = edges[i]
+        end = edges[i + 1]
+
+        # average of the next bucket (or last point) is third vertex of the triangle
+        if i < points - 3:
+            next_start = end
+            next_end = edges[i + 2]
+            avg_x = x[next_start:next_end].mean()
+            avg_y = y[next_start:next_end].mean()
+        else:
+            avg_x = x[count - 1]
+            avg_y = y[count - 1]
+
+        areas = numpy.abs((x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + int(numpy.argmax(areas))
+        selected[i + 1] = a
+
+    return _result(stream, records[selected], varlen, selected)
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+
+#
+# Copyright 2019 Games Creators Club
+#
+# MIT License
+#
+
+#
+# Cost of getting a 300 point graph of an hour of 50Hz rover state like stream: retrieving and decoding
+# all records against aggregating and decimating them where they are stored.
+#
+# Needs numpy. Usage (from rover directory):
+#     python3 -m telemetry.telemetry_aggregate_benchmark
+#
+
+import time
+
+from telemetry.telemetry_storage import MemoryTelemetryStorage
+from telemetry.telemetry_aggregate import aggregate, decimate
+from telemetry import telemetry_numpy_benchmark
+
+RECORDS = 50 * 3600
+POINTS = 300
+
+
+def measure(name, storage, stream, reduce):
+    result = []
+
+    def callback(views):
+        result.append(reduce(views))
+
+    started = time.perf_counter()
+    storage.retrieve(stream, 0, RECORDS, callback)
+    records = stream.unpackRecords(result[0])
+    elapsed = time.perf_counter() - started
+    print("{0:<12} {1:>10} {2:>12} {3:>10.1f}".format(name, len(records), len(result[0]), elapsed * 1000))
+
+
+if __name__ == "__main__":
+    telemetry_numpy_benchmark.RECORDS = RECORDS
+    stream = telemetry_numpy_benchmark.makeStream()
+    payload = telemetry_numpy_benchmark.makePayload(stream)
+    storage = MemoryTelemetryStorage(max_records=RECORDS)
+    storage.store_many(stream, [(float(i), payload[i * stream.fixed_length:(i + 1) * stream.fixed_length]) for i in range(RECORDS)])
+
+    bucket = RECORDS / POINTS
+    print(str(RECORDS) + " records of " + str(stream.fixed_length) + " bytes, " + str(POINTS) + " points")
+    print("{0:<12} {1:>10} {2:>12} {3:>10}".format("query", "records", "bytes", "ms"))
+    measure("raw", storage, stream, lambda views: b''.join(views))
+    for function in ['min', 'max', 'mean', 'last']:
+        measure(function, storage, stream, lambda views: aggregate(stream, views, 0, bucket, function))
+    measure("lttb", storage, stream, lambda views: decimate(stream, views, POINTS, 'heading'))
@@ -6,50 +6,226 @@
 
 import os
 import struct
+import threading
 import uuid
-from telemetry.telemetry_stream import streamFromJSON
+from telemetry.telemetry_stream import RETRIEVE_CHUNK_HEADER, RETRIEVE_CHUNK_LAST, RETRIEVE_CHUNK_ERROR
+from telemetry.telemetry_registry import TelemetryStreamCache
+
+DEFAULT_CHUNK_SIZE = 65536
+DEFAULT_WINDOW = 4
+
+CHUNK_TIMEOUT = 10.0  # seconds to wait for next chunk before chunked retrieve is retried
+CHUNK_RETRIES = 2  # retries of chunked retrieve before it fails
+
+ENCODING_RAW = 'raw'  # others are in telemetry_compression
+
+
+class _ChunkedRetrieve:
+    def __init__(self, from_timestamp, to_timestamp, callback, chunk_size, window, as_array, encoding, error_callback=None):
+        self.from_timestamp = from_timestamp
+        self.to_timestamp = to_timestamp
+        self.callback = callback
+        self.error_callback = error_callback
+        self.chunk_size = chunk_size
+        self.window = window
+        self.as_array = as_array
+        self.encoding = encoding
+        self.next_sequence = 0
+        self.retries = 0
+        self.last_timestamp = None  # of last record given to callback; retry continues from it
+        self.last_count = 0  # records with last_timestamp given to callback
+        self.skip = 0  # records with last_timestamp to drop as they were given to callback before retry
+        self.timer = None
 
 
 class StreamCallback:
-    def __init__(self, stream_name, topic, unique_id, sub_method):
+    def __init__(self, stream_name, topic, unique_id, pub_method, sub_method):
         self.stream_name = stream_name
         self.stream = None
         self.topic = topic
         self.unique_id = unique_id
+        self.pub_method = pub_method
         self.sub_method = sub_method
         self.retrieve_callbacks = []
         self.oldest_callbacks = []
-        self.defs_callbacks = []
+        self.defs_callbacks = []  # answered when all definitions are fetched (see PubSubTelemetryClient)
+        self.chunked_retrieves = []  # first one is in progress, others wait for it to finish
+        self.chunked_lock = threading.RLock()  # chunks and chunk timeouts come from different threads
+        self.reduced_callbacks = []  # answered in order requests were sent
 
         self.retrieveTopic = topic + "/retrieve_" + unique_id + "_" + stream_name
+        self.chunksTopic = topic + "/chunks_" + unique_id + "_" + stream_name
+        self.reducedTopic = topic + "/reduced_" + unique_id + "_" + stream_name
         self.oldestTimestampTopic = topic + "/oldest_" + unique_id + "_" + stream_name
-        self.streamDefTopic = topic + "/streamdef_" + unique_id + "_" + stream_name
 
         self.sub_method(self.retrieveTopic, self._handleRetrieve)
+        self.sub_method(self.chunksTopic, self._handleChunk)
+        self.sub_method(self.reducedTopic, self._handleReduced)
         self.sub_method(self.oldestTimestampTopic, self._handleOldest)
-        self.sub_method(self.streamDefTopic, self._handleStreamDef)
 
     def stop(self):
         pass
 
     def _handleRetrieve(self, topic, payload):
-        record_length = self.stream.fixed_length
-
-        received_records = len(payload) // record_length
-        if received_records * record_length != len(payload):
-            pass  # what to do here?
-
-        records = []
-        for i in range(0, received_records):
-            record = struct.unpack(self.stream.pack_string, payload[i * record_length: (i + 1) * record_length])
-            records.append(record)
-
         callbacks = self.retrieve_callbacks
         self.retrieve_callbacks = []
 
-        while len(callbacks) > 0:
-            callbacks[0](records)
-            del callbacks[0]
+        # records are decoded only in forms some of the callbacks asked for
+        records = None
+        array = None
+        for callback, as_array in callbacks:
+            if as_array:
+                if array is None:
+                    array = self.stream.recordsArray(payload)
+                callback(array)
+            else:
+                if records is None:
+                    records = self.stream.unpackRecords(payload)
+                callback(records)
+
+    def _emptyRecords(self, as_array):
+        if as_array:
+            import numpy
+
+            return numpy.empty(0, dtype=self.stream.fixedDtype())
+        return []
+
+    # Records could not be retrieved - error is printed and passed to error_callback; without
+    # error_callback callback gets no records (with args), so callers waiting for it do not wait forever
+    def _failed(self, message, callback, error_callback, as_array, *args):
+        print("ERROR: " + message)
+        if error_callback is not None:
+            error_callback(message)
+        else:
+            callback(self._emptyRecords(as_array), *args)
+
+    def _handleReduced(self, topic, payload):
+        if len(self.reduced_callbacks) > 0:
+            callback, as_array, error_callback = self.reduced_callbacks[0]
+            del self.reduced_callbacks[0]
+            sequence, flags = RETRIEVE_CHUNK_HEADER.unpack_from(payload, 0)
+            records = memoryview(payload)[RETRIEVE_CHUNK_HEADER.size:]
+            if flags & RETRIEVE_CHUNK_ERROR:
+                self._failed(str(records, 'utf-8', 'replace'), callback, error_callback, as_array)
+            else:
+                callback(self.stream.recordsArray(records) if as_array else self.stream.unpackRecords(records))
+
+    def startChunkedRetrieve(self, chunked_retrieve):
+        with self.chunked_lock:
+            self.chunked_retrieves.append(chunked_retrieve)
+            if len(self.chunked_retrieves) == 1:
+                self._requestChunks()
+
+    def _requestChunks(self):
+        chunked_retrieve = self.chunked_retrieves[0]
+        chunked_retrieve.next_sequence = 0
+        from_timestamp = chunked_retrieve.from_timestamp if chunked_retrieve.last_timestamp is None else chunked_retrieve.last_timestamp
+        chunked_retrieve.skip = chunked_retrieve.last_count
+        self.pub_method(self.topic + "/retrieve/" + self.stream_name,
+                        ",".join(str(f) for f in [self.chunksTopic, from_timestamp, chunked_retrieve.to_timestamp, chunked_retrieve.chunk_size, chunked_retrieve.window, chunked_retrieve.encoding]))
+        self._restartChunkTimer(chunked_retrieve)
+
+    def _restartChunkTimer(self, chunked_retrieve):
+        if chunked_retrieve.timer is not None:
+            chunked_retrieve.timer.cancel()
+        chunked_retrieve.timer = threading.Timer(CHUNK_TIMEOUT, self._chunkTimeout, [chunked_retrieve])
+        chunked_retrieve.timer.daemon = True
+        chunked_retrieve.timer.start()
+
+    def _finishChunkedRetrieve(self):
+        chunked_retrieve = self.chunked_retrieves[0]
+        if chunked_retrieve.timer is not None:
+            chunked_retrieve.timer.cancel()
+            chunked_retrieve.timer = None
+        del self.chunked_retrieves[0]
+        if len(self.chunked_retrieves) > 0:
+            self._requestChunks()
+
+    def _chunkTimeout(self, chunked_retrieve):
+        with self.chunked_lock:
+            if len(self.chunked_retrieves) > 0 and self.chunked_retrieves[0] is chunked_retrieve:
+                self._retryChunkedRetrieve(chunked_retrieve, "No telemetry chunk " + str(chunked_retrieve.next_sequence) + " of stream " + self.stream_name + " in " + str(CHUNK_TIMEOUT) + "s")
+
+    # Chunk was lost (or did not come in CHUNK_TIMEOUT). Server's session is cancelled and retrieve is asked
+    # for again from the last record callback got, or fails after CHUNK_RETRIES retries - so retrieves
+    # waiting behind it can go on.
+    def _retryChunkedRetrieve(self, chunked_retrieve, message):
+        self.pub_method(self.topic + "/retrieve_ack/" + self.stream_name, self.chunksTopic + ",-1")
+        if chunked_retrieve.retries < CHUNK_RETRIES:
+            chunked_retrieve.retries += 1
+            print("ERROR: " + message + "; retrying")
+            self._requestChunks()
+        else:
+            self._failed(message + " after " + str(CHUNK_RETRIES) + " retries", chunked_retrieve.callback, chunked_retrieve.error_callback, chunked_retrieve.as_array, True)
+            self._finishChunkedRetrieve()
+
+    # Drops records given to callback before retry - same as RetrieveCursor, by counting records with
+    # timestamp retry started from - and keeps last timestamp and count of records with it for next retry
+    @staticmethod
+    def _skipDelivered(chunked_retrieve, records, timestamps):
+        start = 0
+        while chunked_retrieve.skip > 0 and start < len(timestamps) and timestamps[start] == chunked_retrieve.last_timestamp:
+            chunked_retrieve.skip -= 1
+            start += 1
+        if start == len(timestamps):
+            return records[start:]
+
+        chunked_retrieve.skip = 0
+        last_timestamp = float(timestamps[-1])
+        same = 1
+        while same < len(timestamps) - start and timestamps[-1 - same] == last_timestamp:
+            same += 1
+        if same == len(timestamps) - start and last_timestamp == chunked_retrieve.last_timestamp:
+            chunked_retrieve.last_count += same
+        else:
+            chunked_retrieve.last_count = same
+        chunked_retrieve.last_timestamp = last_timestamp
+        return records[start:]
+
+    def _handleChunk(self, topic, payload):
+        with self.chunked_lock:
+            if len(self.chunked_retrieves) == 0:
+                return
+
+            chunked_retrieve = self.chunked_retrieves[0]
+            sequence, flags = RETRIEVE_CHUNK_HEADER.unpack_from(payload, 0)
+            if sequence != chunked_retrieve.next_sequence:
+                if chunked_retrieve.retries > 0 and chunked_retrieve.next_sequence == 0:
+                    return  # late chunk of retrieve before retry
+                self._retryChunkedRetrieve(chunked_retrieve, "Missing telemetry chunks " + str(chunked_retrieve.next_sequence) + " to " + str(sequence - 1) + " of stream " + self.stream_name)
+                return
+            chunked_retrieve.next_sequence = sequence + 1
+
+            records = memoryview(payload)[RETRIEVE_CHUNK_HEADER.size:]
+            if flags & RETRIEVE_CHUNK_ERROR:
+                self._failed(str(records, 'utf-8', 'replace'), chunked_retrieve.callback, chunked_retrieve.error_callback, chunked_retrieve.as_array, True)
+                self._finishChunkedRetrieve()
+                return
+
+            if chunked_retrieve.encoding != ENCODING_RAW:
+                from telemetry import telemetry_compression
+
+                records = telemetry_compression.decode(self.stream, records, chunked_retrieve.encoding)
+
+            if chunked_retrieve.as_array:
+                records = self.stream.recordsArray(records)
+                timestamps = records['timestamp']
+            else:
+                records = self.stream.unpackRecords(records)
+                timestamps = [record[0] for record in records]
+            records = self._skipDelivered(chunked_retrieve, records, timestamps)
+
+            last = flags & RETRIEVE_CHUNK_LAST != 0
+            if not last:
+                self._restartChunkTimer(chunked_retrieve)
+            result = chunked_retrieve.callback(records, last)
+            if last:
+                self._finishChunkedRetrieve()
+            elif result is False:
+                self.pub_method(self.topic + "/retrieve_ack/" + self.stream_name, self.chunksTopic + ",-1")
+                self._finishChunkedRetrieve()
+            elif chunked_retrieve.window > 0:
+                self.pub_method(self.topic + "/retrieve_ack/" + self.stream_name, self.chunksTopic + "," + str(sequence))
 
     def _handleOldest(self, topic, payload):
         oldest, size = struct.unpack('<di', payload)
@@ -57,15 +233,6 @@ class StreamCallback:
             self.oldest_callbacks[0](oldest, size)
             del self.oldest_callbacks[0]
 
-    def _handleStreamDef(self, topic, payload):
-        payload = str(payload, 'UTF-8')
-        self.stream = streamFromJSON(payload)
-        if self.stream is not None:
-            self.stream.build(self.stream.stream_id)
-        while len(self.defs_callbacks) > 0:
-            self.defs_callbacks[0](self.stream)
-            del self.defs_callbacks[0]
-
 
 class TelemetryClient:
     def __init__(self):
@@ -77,29 +244,49 @@ class TelemetryClient:
     def getStreamDefinition(self, stream_name, callback):
         pass
 
+    def getStreamDefinitions(self, callback):
+        pass
+
     def getOldestTimestamp(self, stream, callback):
         pass
 
     def trim(self, stream, to_timestamp):
         pass
 
-    def retrieve(self, stream, from_timestamp, to_timestmap, callback):
+    def retrieve(self, stream, from_timestamp, to_timestmap, callback, as_array=False):
+        pass
+
+    def retrieveChunks(self, stream, from_timestamp, to_timestmap, callback, chunk_size=DEFAULT_CHUNK_SIZE, window=DEFAULT_WINDOW, as_array=False, encoding=ENCODING_RAW, error_callback=None):
+        pass
+
+    def aggregate(self, stream, from_timestamp, to_timestmap, bucket, function, callback, as_array=False, error_callback=None):
+        pass
+
+    def decimate(self, stream, from_timestamp, to_timestmap, points, field, callback, as_array=False, error_callback=None):
         pass
 
 
 class PubSubTelemetryClient(TelemetryClient):
-    def __init__(self, topic=None, pub_method=None, sub_method=None):
+    # Stream definitions are fetched all at once, the first time any of them is needed, and parsed through
+    # stream_cache (TelemetryStreamCache) so definitions already seen are not parsed again.
+    def __init__(self, topic=None, pub_method=None, sub_method=None, stream_cache=None):
         super(PubSubTelemetryClient, self).__init__()
 
         self.topic = topic
         self.pub_method = pub_method
         self.sub_method = sub_method
+        self.stream_cache = stream_cache if stream_cache is not None else TelemetryStreamCache()
         self.uniqueId = str(uuid.uuid4())
         self.stream_callbacks = {}
         self.streams_callbacks = []
+        self.definitions = {}  # last fetched definitions by stream name
+        self.definitions_callbacks = []
+        self.definitions_requested = False
         self.streams_topic = self.topic + "/streams_" + self.uniqueId
+        self.definitions_topic = self.topic + "/streamdefs_" + self.uniqueId
 
         self.sub_method(self.streams_topic, self._handleStreams)
+        self.sub_method(self.definitions_topic, self._handleStreamDefinitions)
 
     def _handleStreams(self, topic, payload):
         payload = str(payload, 'UTF-8')
@@ -108,9 +295,35 @@ class PubSubTelemetryClient(TelemetryClient):
             self.streams_callbacks[0](stream_names)
             del self.streams_callbacks[0]
 
+    def _handleStreamDefinitions(self, topic, payload):
+        payload = str(payload, 'UTF-8')
+        self.definitions_requested = False
+        streams = {}
+        for line in payload.split("\n"):
+            if line != "":
+                stream = self.stream_cache.fromDefinition(line)
+                streams[stream.name] = stream
+        self.definitions = streams
+
+        for stream_name, streamCallback in self.stream_callbacks.items():
+            if streamCallback.stream is None and stream_name in streams:
+                streamCallback.stream = streams[stream_name]
+            while len(streamCallback.defs_callbacks) > 0:
+                streamCallback.defs_callbacks[0](streamCallback.stream)
+                del streamCallback.defs_callbacks[0]
+
+        while len(self.definitions_callbacks) > 0:
+            self.definitions_callbacks[0](streams)
+            del self.definitions_callbacks[0]
+
+    def _requestStreamDefinitions(self):
+        if not self.definitions_requested:
+            self.definitions_requested = True
+            self.pub_method(self.topic + "/streamdefs", self.definitions_topic)
+
     def _addStreamCallback(self, stream_name):
         if stream_name not in self.stream_callbacks:
-            streamCallback = StreamCallback(stream_name, self.topic, self.uniqueId, self.sub_method)
+            streamCallback = StreamCallback(stream_name, self.topic, self.uniqueId, self.pub_method, self.sub_method)
             self.stream_callbacks[stream_name] = streamCallback
         else:
             streamCallback = self.stream_callbacks[stream_name]
@@ -125,13 +338,22 @@ class PubSubTelemetryClient(TelemetryClient):
         self.streams_callbacks.append(callback)
         self.pub_method(self.topic + "/streams", self.streams_topic)
 
+    # callback gets stream definition or None if there is no such stream
     def getStreamDefinition(self, stream_name, callback):
         streamCallback = self._addStreamCallback(stream_name)
+        if streamCallback.stream is None:
+            streamCallback.stream = self.definitions.get(stream_name)
+
         if streamCallback.stream is not None:
             callback(streamCallback.stream)
         else:
             streamCallback.defs_callbacks.append(callback)
-            self.pub_method(self.topic + "/streamdef/" + stream_name, streamCallback.streamDefTopic)
+            self._requestStreamDefinitions()
+
+    # callback gets dict of current definitions of all streams by stream name
+    def getStreamDefinitions(self, callback):
+        self.definitions_callbacks.append(callback)
+        self._requestStreamDefinitions()
 
     def getOldestTimestamp(self, stream, callback):
         if self.pub_method is None:
@@ -144,14 +366,52 @@ class PubSubTelemetryClient(TelemetryClient):
     def trim(self, stream, to_timestamp):
         self.pub_method(self.topic + "/trim/" + stream.name, str(to_timestamp))
 
-    def retrieve(self, stream, from_timestamp, to_timestmap, callback):
+    # When as_array is True callback gets numpy structured array (see TelemetryStreamDefinition.numpyDtype)
+    # instead of list of tuples.
+    def retrieve(self, stream, from_timestamp, to_timestmap, callback, as_array=False):
         if self.pub_method is None:
             raise NotImplemented("Publish method not defined")
 
         streamCallback = self._addStreamCallback(stream.name)
-        streamCallback.retrieve_callbacks.append(callback)
+        streamCallback.retrieve_callbacks.append((callback, as_array))
         self.pub_method(self.topic + "/retrieve/" + stream.name, ",".join(str(f) for f in [streamCallback.retrieveTopic, from_timestamp, to_timestmap]))
 
+    # Retrieves records in chunks of about chunk_size bytes. callback(records, last) is invoked for each
+    # chunk as it arrives; last is True for the final chunk. Server sends at most window chunks ahead of
+    # the ones callback has processed (0 for no limit). Returning False from callback stops the retrieve.
+    # encoding other than raw sends each chunk compressed (see telemetry_compression; needs numpy).
+    # If chunk is lost or does not come in CHUNK_TIMEOUT, rest of records is asked for again up to CHUNK_RETRIES times.
+    # When records cannot be retrieved error is printed and given to error_callback(message); without
+    # error_callback, callback gets no records as the last chunk.
+    def retrieveChunks(self, stream, from_timestamp, to_timestmap, callback, chunk_size=DEFAULT_CHUNK_SIZE, window=DEFAULT_WINDOW, as_array=False, encoding=ENCODING_RAW, error_callback=None):
+        if self.pub_method is None:
+            raise NotImplemented("Publish method not defined")
+
+        streamCallback = self._addStreamCallback(stream.name)
+        if streamCallback.stream is None:
+            streamCallback.stream = stream
+        streamCallback.startChunkedRetrieve(_ChunkedRetrieve(from_timestamp, to_timestmap, callback, chunk_size, window, as_array, encoding, error_callback))
+
+    # Retrieves one record per bucket seconds where each field is min, max, mean or last value in the bucket
+    # (see telemetry_aggregate). callback gets records as retrieve would; when server cannot reduce records
+    # error is printed and given to error_callback(message), or callback gets no records without it.
+    def aggregate(self, stream, from_timestamp, to_timestmap, bucket, function, callback, as_array=False, error_callback=None):
+        self._requestReduced(stream, "/aggregate/", [from_timestamp, to_timestmap, bucket, function], callback, as_array, error_callback)
+
+    # Retrieves at most points records selected so graph of given field keeps its shape (LTTB).
+    def decimate(self, stream, from_timestamp, to_timestmap, points, field, callback, as_array=False, error_callback=None):
+        self._requestReduced(stream, "/decimate/", [from_timestamp, to_timestmap, points, field], callback, as_array, error_callback)
+
+    def _requestReduced(self, stream, path, arguments, callback, as_array, error_callback):
+        if self.pub_method is None:
+            raise NotImplemented("Publish method not defined")
+
+        streamCallback = self._addStreamCallback(stream.name)
+        if streamCallback.stream is None:
+            streamCallback.stream = stream
+        streamCallback.reduced_callbacks.append((callback, as_array, error_callback))
+        self.pub_method(self.topic + path + stream.name, ",".join(str(f) for f in [streamCallback.reducedTopic] + arguments))
+
 
 class SocketTelemetryClient(TelemetryClient):
     def __init__(self):
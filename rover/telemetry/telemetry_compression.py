@@ -0,0 +1,244 @@
+
+#
+# Copyright 2019 Games Creators Club
+#
+# MIT License
+#
+
+#
+# Columnar compressed blocks of records (needs numpy).
+#
+# Block is header followed by one column per fixed size field, each prefixed with its length in bytes:
+#
+#  - record timestamps: delta-of-delta of their 64 bit patterns (for timestamps in the same power of
+#    two bit patterns grow linearly with time, so regular logging gives near zero values), zigzag varints
+#  - floats and doubles: XOR with previous value (Gorilla style, but in whole bytes) - control byte with
+#    number of zero low bytes and number of remaining bytes followed by those bytes
+#  - integers: delta from previous value, zigzag varints
+#  - strings and bytes: as they are
+#
+# Blocks of variable length streams (BLOCK_FLAG_VARLEN) have one more, side column after those: variable
+# length fields of all records, in record order, each with its FIELD_LENGTH_PREFIX.
+#
+# Optionally whole body of the block is compressed with zlib. All of it is lossless; decoded block gives
+# back exactly the same records back to back.
+#
+
+import numpy
+import struct
+import zlib
+
+from telemetry.telemetry_stream import FIELD_LENGTH_PREFIX
+
+BLOCK_MAGIC = b'GCCB'
+BLOCK_VERSION = 1
+BLOCK_HEADER = struct.Struct('<4sBBHI')  # magic, version, flags, reserved, count
+BLOCK_FLAG_ZLIB = 1
+BLOCK_FLAG_VARLEN = 2
+
+ENCODING_RAW = 'raw'
+ENCODING_COLUMNAR = 'columnar'
+ENCODING_COLUMNAR_ZLIB = 'columnar-zlib'
+
+ENCODINGS = [ENCODING_RAW, ENCODING_COLUMNAR, ENCODING_COLUMNAR_ZLIB]
+
+_COLUMN_LENGTH = struct.Struct('<I')
+_VARINT_SHIFTS = numpy.arange(10, dtype=numpy.uint64) * numpy.uint64(7)
+
+
+def _zigzag(values):
+    return ((values << 1) ^ (values >> 63)).view(numpy.uint64)
+
+
+def _unzigzag(values):
+    return ((values >> numpy.uint64(1)) ^ (numpy.uint64(0) - (values & numpy.uint64(1)))).view(numpy.int64)
+
+
+def _encodeVarints(values):
+    if len(values) == 0:
+        return b''
+
+    groups = (values[:, None] >> _VARINT_SHIFTS) & numpy.uint64(0x7f)
+    lengths = 1 + numpy.count_nonzero((values[:, None] >> _VARINT_SHIFTS[1:]) != 0, axis=1)
+    columns = numpy.arange(10)
+    groups[columns < (lengths - 1)[:, None]] |= numpy.uint64(0x80)
+    return groups.astype(numpy.uint8)[columns < lengths[:, None]].tobytes()
+
+
+def _decodeVarints(data, count):
+    if count == 0:
+        return numpy.zeros(0, dtype=numpy.uint64)
+
+    data = numpy.frombuffer(data, dtype=numpy.uint8)
+    ends = numpy.flatnonzero(data < 0x80)[0:count]
+    if len(ends) < count:
+        raise ValueError("Column has " + str(len(ends)) + " values, expected " + str(count))
+    data = data[0:ends[-1] + 1]
+    starts = numpy.concatenate(([0], ends[:-1] + 1))
+    positions = numpy.arange(len(data)) - numpy.repeat(starts, ends - starts + 1)
+    values = (data & 0x7f).astype(numpy.uint64) << (positions.astype(numpy.uint64) * numpy.uint64(7))
+    return numpy.bitwise_or.reduceat(values, starts)
+
+
+def _encodeXor(values, width):
+    xored = values.copy()
+    xored[1:] ^= values[:-1]
+
+    matrix = xored.view(numpy.uint8).reshape(-1, width)
+    non_zero = matrix != 0
+    any_non_zero = non_zero.any(axis=1)
+    first = numpy.where(any_non_zero, numpy.argmax(non_zero, axis=1), 0)
+    last = numpy.where(any_non_zero, width - 1 - numpy.argmax(non_zero[:, ::-1], axis=1), -1)
+    lengths = last - first + 1
+
+    columns = numpy.arange(width)
+    mask = (columns >= first[:, None]) & (columns <= last[:, None])
+    control = ((first << 4) | lengths).astype(numpy.uint8)
+    return control.tobytes() + matrix[mask].tobytes()
+
+
+def _decodeXor(data, count, dtype):
+    width = dtype.itemsize
+    control = numpy.frombuffer(data, dtype=numpy.uint8, count=count)
+    first = (control >> 4).astype(numpy.int64)
+    lengths = (control & 0x0f).astype(numpy.int64)
+
+    columns = numpy.arange(width)
+    mask = (columns >= first[:, None]) & (columns < (first + lengths)[:, None])
+    matrix = numpy.zeros((count, width), dtype=numpy.uint8)
+    matrix[mask] = numpy.frombuffer(data, dtype=numpy.uint8, offset=count, count=int(lengths.sum()))
+    return numpy.bitwise_xor.accumulate(matrix.view(dtype).ravel())
+
+
+def _encodeColumn(column, is_timestamp):
+    kind = column.dtype.kind
+    if is_timestamp:
+        values = column.view(numpy.int64)
+        return _encodeVarints(_zigzag(numpy.diff(numpy.diff(values, prepend=numpy.int64(0)), prepend=numpy.int64(0))))
+    elif kind == 'f':
+        return _encodeXor(column.view(numpy.uint64 if column.dtype.itemsize == 8 else numpy.uint32), column.dtype.itemsize)
+    elif kind in 'iu':
+        values = column.astype(numpy.int64)
+        return _encodeVarints(_zigzag(numpy.diff(values, prepend=numpy.int64(0))))
+    else:
+        return column.tobytes()
+
+
+def _decodeColumn(data, count, dtype, is_timestamp):
+    kind = dtype.kind
+    if is_timestamp:
+        values = _unzigzag(_decodeVarints(data, count))
+        return numpy.cumsum(numpy.cumsum(values)).view(numpy.float64)
+    elif kind == 'f':
+        return _decodeXor(data, count, numpy.dtype(numpy.uint64 if dtype.itemsize == 8 else numpy.uint32)).view(dtype)
+    elif kind in 'iu':
+        return numpy.cumsum(_unzigzag(_decodeVarints(data, count))).astype(dtype)
+    else:
+        return numpy.frombuffer(data, dtype=dtype, count=count)
+
+
+# data is records of stream back to back as retrieved (with RECORD_LENGTH_PREFIX for variable length streams)
+def encodeBlock(stream, data, use_zlib=False):
+    flags = 0
+    varlen = None
+    if stream.fixed_length is None:
+        data, varlen = stream.splitVarLenRecords(data)
+        flags |= BLOCK_FLAG_VARLEN
+
+    records = numpy.frombuffer(data, dtype=stream.fixedDtype())
+    names = records.dtype.names
+
+    parts = []
+    for i in range(len(names)):
+        column = _encodeColumn(numpy.ascontiguousarray(records[names[i]]), i == 0)
+        parts.append(_COLUMN_LENGTH.pack(len(column)))
+        parts.append(column)
+
+    if varlen is not None:
+        column = b''.join(varlen)
+        parts.append(_COLUMN_LENGTH.pack(len(column)))
+        parts.append(column)
+
+    body = b''.join(parts)
+    if use_zlib:
+        body = zlib.compress(body)
+        flags |= BLOCK_FLAG_ZLIB
+
+    return BLOCK_HEADER.pack(BLOCK_MAGIC, BLOCK_VERSION, flags, 0, len(records)) + body
+
+
+# Returns number of records in the block
+def blockCount(block):
+    magic, version, _, _, count = BLOCK_HEADER.unpack_from(block, 0)
+    if magic != BLOCK_MAGIC or version != BLOCK_VERSION:
+        raise ValueError("Not a telemetry block or unsupported version " + str(version))
+    return count
+
+
+def _splitVarLenColumn(stream, column, count):
+    fields = len([field for field in stream.fields if field.field_size == 0])
+    varlen = []
+    p = 0
+    for i in range(count):
+        start = p
+        for j in range(fields):
+            p += FIELD_LENGTH_PREFIX.size + FIELD_LENGTH_PREFIX.unpack_from(column, p)[0]
+        varlen.append(column[start:p])
+    return varlen
+
+
+# Returns numpy structured array of fixed size fields of records in the block (see
+# TelemetryStreamDefinition.fixedDtype) and list of variable length fields of each record as
+# TelemetryStreamDefinition.splitVarLenRecords does (None for blocks of fixed length streams)
+def decodeBlockColumns(stream, block):
+    count = blockCount(block)
+    flags = block[5]
+    body = memoryview(block)[BLOCK_HEADER.size:]
+    if flags & BLOCK_FLAG_ZLIB:
+        body = memoryview(zlib.decompress(body))
+
+    dtype = stream.fixedDtype()
+    records = numpy.empty(count, dtype=dtype)
+    p = 0
+    for i in range(len(dtype.names)):
+        name = dtype.names[i]
+        length = _COLUMN_LENGTH.unpack_from(body, p)[0]
+        p += _COLUMN_LENGTH.size
+        records[name] = _decodeColumn(body[p:p + length], count, dtype[name], i == 0)
+        p += length
+
+    varlen = None
+    if flags & BLOCK_FLAG_VARLEN:
+        length = _COLUMN_LENGTH.unpack_from(body, p)[0]
+        p += _COLUMN_LENGTH.size
+        varlen = _splitVarLenColumn(stream, bytes(body[p:p + length]), count)
+
+    return records, varlen
+
+
+# Returns numpy structured array (see TelemetryStreamDefinition.numpyDtype) of records in the block;
+# for variable length streams of their fixed size fields only
+def decodeBlockArray(stream, block):
+    return decodeBlockColumns(stream, block)[0]
+
+
+# Returns records in the block back to back, as they were given to encodeBlock
+def decodeBlock(stream, block):
+    records, varlen = decodeBlockColumns(stream, block)
+    if varlen is None:
+        return records.tobytes()
+    return stream.joinVarLenRecords(records.tobytes(), b''.join(varlen))
+
+
+def encode(stream, data, encoding):
+    if encoding == ENCODING_COLUMNAR:
+        return encodeBlock(stream, data)
+    elif encoding == ENCODING_COLUMNAR_ZLIB:
+        return encodeBlock(stream, data, use_zlib=True)
+    return data
+
+
+def decode(stream, data, encoding):
+    if encoding == ENCODING_COLUMNAR or encoding == ENCODING_COLUMNAR_ZLIB:
+        return decodeBlock(stream, data)
+    return data
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+
+#
+# Copyright 2019 Games Creators Club
+#
+# MIT License
+#
+
+#
+# Compression ratio and encode/decode speed of telemetry_compression on a simulated 10 minute, 50Hz run
+# of rover state like stream (jittery timestamps, slowly changing odometers and heading, noisy radar),
+# in blocks as they are stored in compressed segments, against plain zlib of raw records.
+#
+# Needs numpy. Usage (from rover directory):
+#     python3 -m telemetry.telemetry_compression_benchmark
+#
+
+import math
+import random
+import struct
+import time
+import zlib
+
+from telemetry.telemetry_stream import TelemetryStreamDefinition
+from telemetry import telemetry_compression
+from telemetry.telemetry_file_storage import COMPRESSED_BLOCK_RECORDS
+
+RECORDS = 50 * 600
+WHEELS = ['fl', 'fr', 'bl', 'br']
+ANGLES = [0, 45, 90, 135, 180, 225, 270, 315]
+
+
+def makeStream():
+    stream = TelemetryStreamDefinition("rover-state")
+    stream.addDouble('odo_time')
+    for w in WHEELS:
+        stream.addWord('odo_' + w)
+    for w in WHEELS:
+        stream.addByte('odo_s_' + w)
+    stream.addDouble('ori_time')
+    for w in WHEELS:
+        stream.addWord('ori_' + w)
+    stream.addDouble('radar_time')
+    for a in ANGLES:
+        stream.addWord('radar_' + str(a))
+    for a in ANGLES:
+        stream.addByte('radar_s_' + str(a))
+    stream.addDouble('heading_time').addFloat('heading')
+    stream.addDouble('cmd_time').addWord('cmd_speed', signed=True).addWord('cmd_angle', signed=True)
+    stream.addFixedString('selection', 17)
+    stream.build(1)
+    return stream
+
+
+def makeRun(stream):
+    record_struct = struct.Struct(stream.pack_string)
+    records = []
+    now = 1560000000.0
+    odos = [0, 0, 0, 0]
+    heading = 0.0
+    for i in range(RECORDS):
+        now += 0.02 + random.gauss(0, 0.0005)
+        speed = 20 + int(10 * math.sin(i / 500.0))
+        odos = [(o + speed + random.randint(-1, 1)) & 0xFFFF for o in odos]
+        heading = (heading + random.gauss(0, 0.05)) % 360
+        radar = [max(0, int(500 + 300 * math.sin(i / 200.0 + a) + random.gauss(0, 5))) for a in range(len(ANGLES))]
+        values = [now - 0.005] + odos + [0, 0, 0, 0] + [now - 0.007] + [90, 90, 270, 270] + [now - 0.01] + radar + [0] * len(ANGLES) + \
+            [now - 0.003, heading, now - 1.0, 100, 0, b'forward to wall']
+        records.append(record_struct.pack(now, *values))
+    return b''.join(records)
+
+
+def blocks(stream, data):
+    block_size = COMPRESSED_BLOCK_RECORDS * stream.fixed_length
+    return [data[i:i + block_size] for i in range(0, len(data), block_size)]
+
+
+def measure(name, data, encode, decode):
+    started = time.perf_counter()
+    encoded = [encode(block) for block in data]
+    encode_time = time.perf_counter() - started
+
+    started = time.perf_counter()
+    decoded = [decode(block) for block in encoded]
+    decode_time = time.perf_counter() - started
+
+    if decoded != data:
+        raise ValueError(name + " did not decode to the same records")
+
+    raw_size = sum([len(block) for block in data])
+    encoded_size = sum([len(block) for block in encoded])
+    print("{0:<16} {1:>10} {2:>8.2f} {3:>12.0f} {4:>12.0f}".format(name, encoded_size, raw_size / encoded_size, RECORDS / encode_time, RECORDS / decode_time))
+
+
+if __name__ == "__main__":
+    stream = makeStream()
+    data = blocks(stream, makeRun(stream))
+    print(str(RECORDS) + " records of " + str(stream.fixed_length) + " bytes in blocks of " + str(COMPRESSED_BLOCK_RECORDS) + " records")
+    print("{0:<16} {1:>10} {2:>8} {3:>12} {4:>12}".format("format", "bytes", "ratio", "enc rec/s", "dec rec/s"))
+    measure("raw", data, lambda block: block, lambda block: block)
+    measure("zlib", data, zlib.compress, zlib.decompress)
+    measure("columnar", data, lambda block: telemetry_compression.encodeBlock(stream, block), lambda block: telemetry_compression.decodeBlock(stream, block))
+    measure("columnar-zlib", data, lambda block: telemetry_compression.encodeBlock(stream, block, True), lambda block: telemetry_compression.decodeBlock(stream, block))
@@ -0,0 +1,356 @@
+
+#
+# Copyright 2019 Games Creators Club
+#
+# MIT License
+#
+
+#
+# Export of stored telemetry streams to columnar files for offline analysis (needs numpy; Parquet needs pyarrow).
+#
+# Each stream is exported to its own directory (see exportDirectory) with:
+#
+#  - stream.json - stream definition, so export can be read (and imported back) without the rover
+#  - part-NNNNNN.parquet or part-NNNNNN.npz - records, one column named 'timestamp' and one per field
+#  - export.state - where in the stream the last export stopped
+#
+# Records are read from storage chunk by chunk (as in chunked retrieve), so only one chunk is in memory
+# at a time. Every export call continues where the previous one stopped and adds new part(s) - it can be
+# called periodically during a run and each time it writes only records stored since. Parquet parts get
+# one row group per chunk; npz parts (numpy only fallback, one array per column) get one chunk each.
+#
+# Fixed length strings and variable length strings are exported as strings (Parquet) or bytes/unicode
+# arrays (npz), numbers with their own types, fixed length bytes as they are stored (first byte is length).
+# Variable length fields in npz are one flat uint8 array of all values back to back (utf-8 for strings)
+# and '<field>.offsets' array of where each value starts and ends, as numpy bytes/unicode arrays would
+# strip trailing zeros.
+#
+# importExport reads parts back, in order, and stores records to storage so they can be retrieved or
+# replayed (see telemetry_replay) as if they were logged.
+#
+# Usage (from rover directory), on copy of telemetry-data directory (not one the telemetry service uses):
+#     python3 -m telemetry.telemetry_export export [-d <dir>] [-f parquet|npz] <export-dir> [<stream-name> ...]
+#     python3 -m telemetry.telemetry_export import [-d <dir>] <export-dir>/<stream> [<export-dir>/<stream> ...]
+#
+
+import json
+import numpy
+import os
+import struct
+import sys
+
+from telemetry.telemetry_stream import streamFromJSON, TYPE_STRING, TYPE_BYTES, TYPE_VARLEN_STRING, TYPE_VARLEN_BYTES
+from telemetry.telemetry_storage import RetrieveCursor
+
+FORMAT_PARQUET = 'parquet'
+FORMAT_NPZ = 'npz'
+
+NPZ_OFFSETS_SUFFIX = ".offsets"
+
+EXPORT_FORMATS = [FORMAT_PARQUET, FORMAT_NPZ]
+EXPORT_CHUNK_SIZE = 1024 * 1024
+
+STREAM_FILE = "stream.json"
+STATE_FILE = "export.state"
+PART_PREFIX = "part-"
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+        return pyarrow
+    except ImportError:
+        return None
+
+
+# Parquet when pyarrow is installed, npz otherwise
+def defaultFormat():
+    return FORMAT_PARQUET if _pyarrow() is not None else FORMAT_NPZ
+
+
+def exportDirectory(directory, stream):
+    return os.path.join(os.path.expanduser(directory), stream.storageName().replace("/", "_"))
+
+
+def _writeAtomically(path, data):
+    with open(path + ".tmp", "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.rename(path + ".tmp", path)
+
+
+def _partName(part, export_format):
+    return PART_PREFIX + "{0:06d}.".format(part) + export_format
+
+
+def _columns(stream, chunk):
+    # dict of column name to numpy array for records of the chunk
+    if stream.fixed_length is not None:
+        records = stream.recordsArray(chunk)
+        return {name: records[name] for name in records.dtype.names}
+
+    records = stream.unpackRecords(chunk)
+    columns = {'timestamp': numpy.array([r[0] for r in records], dtype='<f8')}
+    for i, field in enumerate(stream.fields):
+        values = [r[i + 1] for r in records]
+        if field.field_type in (TYPE_VARLEN_STRING, TYPE_VARLEN_BYTES):
+            column = numpy.empty(len(values), dtype=object)  # values as they are - see _npzColumns
+            column[:] = values
+            columns[field.name] = column
+        elif field.field_type == TYPE_BYTES:
+            columns[field.name] = numpy.array([struct.pack(field.packFormat(), v) for v in values], dtype=field.numpyFormat())
+        else:
+            columns[field.name] = numpy.array(values, dtype=field.numpyFormat())
+    return columns
+
+
+def _npzColumns(stream, columns):
+    # variable length columns as flat uint8 array and offsets - see above
+    columns = dict(columns)
+    for field in stream.fields:
+        if field.field_type in (TYPE_VARLEN_STRING, TYPE_VARLEN_BYTES):
+            values = [bytes(v, 'utf-8') if field.field_type == TYPE_VARLEN_STRING else bytes(v) for v in columns[field.name]]
+            offsets = numpy.zeros(len(values) + 1, dtype='<i8')
+            numpy.cumsum([len(v) for v in values], out=offsets[1:])
+            columns[field.name] = numpy.frombuffer(b''.join(values), dtype=numpy.uint8)
+            columns[field.name + NPZ_OFFSETS_SUFFIX] = offsets
+    return columns
+
+
+def _npzVarLenColumn(field, data, offsets):
+    data = data.tobytes()
+    values = [data[offsets[i]:offsets[i + 1]] for i in range(len(offsets) - 1)]
+    if field.field_type == TYPE_VARLEN_STRING:
+        return [str(v, 'utf-8') for v in values]
+    return values
+
+
+def _arrowTable(pyarrow, stream, columns):
+    arrays = [pyarrow.array(columns['timestamp'])]
+    for field in stream.fields:
+        column = columns[field.name]
+        if field.field_type in (TYPE_STRING, TYPE_VARLEN_STRING):
+            if column.dtype.kind == 'S':
+                column = numpy.char.decode(column, 'utf-8', 'replace')
+            arrays.append(pyarrow.array(column, type=pyarrow.string()))
+        elif field.field_type == TYPE_BYTES:
+            arrays.append(pyarrow.array([bytes(v) for v in column], type=pyarrow.binary(field.field_size)))
+        elif field.field_type == TYPE_VARLEN_BYTES:
+            arrays.append(pyarrow.array(column.tolist(), type=pyarrow.binary()))
+        else:
+            arrays.append(pyarrow.array(column))
+    return pyarrow.Table.from_arrays(arrays, names=['timestamp'] + [field.name for field in stream.fields])
+
+
+class TelemetryExporter:
+    def __init__(self, storage, stream, directory, export_format=None, chunk_size=EXPORT_CHUNK_SIZE):
+        if export_format is None:
+            export_format = defaultFormat()
+        if export_format not in EXPORT_FORMATS:
+            raise ValueError("Unknown export format " + str(export_format))
+        if export_format == FORMAT_PARQUET and _pyarrow() is None:
+            raise ValueError("Exporting to " + FORMAT_PARQUET + " needs pyarrow")
+
+        self.storage = storage
+        self.stream = stream
+        self.export_format = export_format
+        self.chunk_size = chunk_size
+        self.directory = exportDirectory(directory, stream)
+        self.cursor = 0.0
+        self.skip = 0
+        self.parts = 0
+        self.count = 0
+
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory)
+
+        stream_path = os.path.join(self.directory, STREAM_FILE)
+        if not os.path.exists(stream_path):
+            _writeAtomically(stream_path, bytes(stream.toJSON(), 'utf-8'))
+
+        state_path = os.path.join(self.directory, STATE_FILE)
+        if os.path.exists(state_path):
+            with open(state_path, "r") as f:
+                state = json.load(f)
+            if state['format'] != export_format:
+                raise ValueError("Stream " + stream.name + " is already exported to " + state['format'] + " in " + self.directory)
+            self.cursor = state['cursor']
+            self.skip = state['skip']
+            self.parts = state['parts']
+            self.count = state['count']
+
+    def _saveState(self):
+        state = {'format': self.export_format, 'cursor': self.cursor, 'skip': self.skip, 'parts': self.parts, 'count': self.count}
+        _writeAtomically(os.path.join(self.directory, STATE_FILE), bytes(json.dumps(state), 'utf-8'))
+
+    def _chunks(self, to_timestamp):
+        cursor = RetrieveCursor(self.stream, self.cursor, to_timestamp, self.chunk_size)
+        cursor.skip = self.skip
+        while not cursor.finished:
+            chunk = cursor.next(self.storage)
+            if len(chunk) == 0:
+                break
+            yield cursor, chunk
+
+    # Exports records stored since last export, up to to_timestamp. Returns number of exported records.
+    def export(self, to_timestamp=float('inf')):
+        path = os.path.join(self.directory, _partName(self.parts, self.export_format))
+        count = 0
+        cursor = None
+        writer = None
+        try:
+            for cursor, chunk in self._chunks(to_timestamp):
+                columns = _columns(self.stream, chunk)
+                if self.export_format == FORMAT_NPZ:
+                    path = os.path.join(self.directory, _partName(self.parts, self.export_format))
+                    with open(path + ".tmp", "wb") as f:
+                        numpy.savez(f, **_npzColumns(self.stream, columns))
+                    os.rename(path + ".tmp", path)
+                    self.parts += 1
+                else:
+                    pyarrow = _pyarrow()
+                    table = _arrowTable(pyarrow, self.stream, columns)
+                    if writer is None:
+                        writer = pyarrow.parquet.ParquetWriter(path + ".tmp", table.schema)
+                    writer.write_table(table)
+                count += len(columns['timestamp'])
+        finally:
+            if writer is not None:
+                writer.close()
+
+        if count == 0:
+            return 0
+
+        if writer is not None:
+            os.rename(path + ".tmp", path)
+            self.parts += 1
+
+        self.cursor = cursor.cursor
+        self.skip = cursor.skip
+        self.count += count
+        self._saveState()
+        return count
+
+
+def _partColumns(path, stream, chunk_size):
+    # yields dicts of column name to numpy array, a chunk of rows at a time
+    if path.endswith("." + FORMAT_NPZ):
+        with numpy.load(path) as part:
+            columns = {name: part[name] for name in part.files if not name.endswith(NPZ_OFFSETS_SUFFIX)}
+            for field in stream.fields:
+                if field.name + NPZ_OFFSETS_SUFFIX in part.files:
+                    columns[field.name] = _npzVarLenColumn(field, columns[field.name], part[field.name + NPZ_OFFSETS_SUFFIX])
+            yield columns
+        return
+
+    pyarrow = _pyarrow()
+    if pyarrow is None:
+        raise ValueError("Importing " + path + " needs pyarrow")
+
+    batch_size = max(1, chunk_size // 64)
+    for batch in pyarrow.parquet.ParquetFile(path).iter_batches(batch_size=batch_size):
+        columns = {'timestamp': batch.column('timestamp').to_numpy()}
+        for field in stream.fields:
+            column = batch.column(field.name)
+            if field.field_type in (TYPE_STRING, TYPE_BYTES, TYPE_VARLEN_STRING, TYPE_VARLEN_BYTES):
+                columns[field.name] = column.to_pylist()
+            else:
+                columns[field.name] = column.to_numpy()
+        yield columns
+
+
+def _storeColumns(storage, stream, columns):
+    timestamps = columns['timestamp']
+    if len(timestamps) == 0:
+        return 0
+
+    if stream.fixed_length is not None:
+        records = numpy.empty(len(timestamps), dtype=stream.numpyDtype())
+        records['timestamp'] = timestamps
+        for field in stream.fields:
+            column = columns[field.name]
+            if field.field_type == TYPE_STRING and not isinstance(column, numpy.ndarray):
+                column = [bytes(v, 'utf-8') for v in column]
+            records[field.name] = column
+        data = records.tobytes()
+        record_length = stream.fixed_length
+        storage.store_many(stream, [(float(timestamps[i]), data[i * record_length:(i + 1) * record_length]) for i in range(len(timestamps))])
+        return len(timestamps)
+
+    fields = []
+    for field in stream.fields:
+        column = columns[field.name]
+        if field.field_type == TYPE_BYTES:
+            column = [struct.unpack(field.packFormat(), bytes(v))[0] for v in column]
+        elif field.field_type == TYPE_STRING and not isinstance(column, numpy.ndarray):
+            column = [bytes(v, 'utf-8') for v in column]
+        elif isinstance(column, numpy.ndarray):
+            column = column.tolist()
+        fields.append(column)
+
+    storage.store_many(stream, [(float(timestamps[i]), stream.packRecord(float(timestamps[i]), *[column[i] for column in fields])) for i in range(len(timestamps))])
+    return len(timestamps)
+
+
+# Stores all exported records of one stream (directory as returned by exportDirectory) to storage.
+# Returns built stream definition.
+def importExport(storage, directory, chunk_size=EXPORT_CHUNK_SIZE):
+    directory = os.path.expanduser(directory)
+    with open(os.path.join(directory, STREAM_FILE), "r") as f:
+        stream = streamFromJSON(f.read())
+    stream.build(stream.stream_id)
+
+    for name in sorted(os.listdir(directory)):
+        if name.startswith(PART_PREFIX) and not name.endswith(".tmp"):
+            for columns in _partColumns(os.path.join(directory, name), stream, chunk_size):
+                _storeColumns(storage, stream, columns)
+
+    return stream
+
+
+if __name__ == "__main__":
+    from telemetry.telemetry_file_storage import FileTelemetryStorage
+    from telemetry.telemetry_registry import loadDefinitions
+
+    def usage():
+        print("Usage: python3 -m telemetry.telemetry_export export [-d <dir>] [-f parquet|npz] <export-dir> [<stream-name> ...]")
+        print("       python3 -m telemetry.telemetry_export import [-d <dir>] <export-dir>/<stream> [<export-dir>/<stream> ...]")
+        sys.exit(1)
+
+    args = sys.argv[1:]
+    if len(args) == 0 or args[0] not in ['export', 'import']:
+        usage()
+
+    command = args.pop(0)
+    directory = "~/telemetry-data"
+    export_format = None
+    paths = []
+    while len(args) > 0:
+        arg = args.pop(0)
+        if arg == "-d":
+            directory = args.pop(0)
+        elif arg == "-f":
+            export_format = args.pop(0)
+        else:
+            paths.append(arg)
+
+    if len(paths) == 0:
+        usage()
+
+    storage = FileTelemetryStorage(directory)
+    if command == 'export':
+        names = paths[1:]
+        streams = {}
+        for stream in loadDefinitions(os.path.join(os.path.expanduser(directory), "streams.def")):
+            streams[stream.storageName()] = stream  # all versions of each stream
+        for stream in streams.values():
+            if len(names) == 0 or stream.name in names:
+                exporter = TelemetryExporter(storage, stream, paths[0], export_format)
+                count = exporter.export()
+                print(stream.storageName() + ": exported " + str(count) + " records to " + exporter.directory)
+    else:
+        for path in paths:
+            stream = importExport(storage, path)
+            print(stream.storageName() + ": imported " + path + " to " + storage.directory)
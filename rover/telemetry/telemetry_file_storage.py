@@ -0,0 +1,651 @@
+
+#
+# Copyright 2019 Games Creators Club
+#
+# MIT License
+#
+
+#
+# Persistent telemetry storage.
+#
+# Each stream gets its own directory with segment files. Segment file is a small header followed by
+# records appended as they come (record starts with its timestamp - see TelemetryStreamDefinition).
+# Variable length records have RECORD_LENGTH_PREFIX in front of each and record length of 0 in segment header.
+# Only the newest segment is ever written to; older segments are immutable, so killing the process can
+# at most leave partially written record at the end of the last segment - which is cut off when the
+# stream is loaded again. New segment is started on each (re)start and when current segment gets
+# bigger than segment_size or older than segment_age. Oldest segments are removed when stream takes more
+# than max_size bytes or when they are older than max_age seconds.
+#
+# Segments are read through mmap. For each segment sparse index of every INDEX_STEP-th timestamp and its
+# offset is kept in memory so retrieve finds start of requested range with bisect and short scan.
+#
+# With compression set, segments are rewritten as columnar compressed blocks of COMPRESSED_BLOCK_RECORDS
+# records (see telemetry_compression) once they are closed. That is done by a background thread, so
+# storing records does not wait for it. Compressed segment is written next to the original and swapped in -
+# renamed to its place before the original is removed - under storage lock when done. Timestamp range of each block is kept
+# in memory and blocks are decoded when retrieved - lazily, one by one as views passed to retrieve callback are
+# read (see _Views), so taking a chunk from the start of a long range decodes only blocks the chunk needs.
+# Offsets in compressed segments are as if records were not compressed for fixed length records and record
+# indexes for variable length records.
+#
+
+import array
+import bisect
+import mmap
+import os
+import queue
+import struct
+import threading
+import time
+
+from telemetry import TelemetryStorage, RECORD_LENGTH_PREFIX
+
+SEGMENT_MAGIC = b'GCCT'
+SEGMENT_VERSION = 1
+SEGMENT_HEADER = struct.Struct('<4sHHId4x')
+SEGMENT_SUFFIX = ".seg"
+COMPRESSED_SEGMENT_MAGIC = b'GCCZ'
+COMPRESSED_SEGMENT_SUFFIX = ".segz"
+COMPRESSED_BLOCK_RECORDS = 4096
+TRIM_FILE = "trim"
+
+INDEX_STEP = 64
+
+_TIMESTAMP = struct.Struct('<d')
+
+# same as in telemetry_compression which is imported only when compression is used
+ENCODING_COLUMNAR = 'columnar'
+ENCODING_COLUMNAR_ZLIB = 'columnar-zlib'
+_VARLEN_RECORD_START = struct.Struct('<Id')  # record length prefix followed by timestamp
+_BLOCK_ENTRY = struct.Struct('<IIdd')  # block length, number of records, first and last timestamp
+
+
+# Returns timestamp and stored length of record at data offset of segment mapped as mm
+def _recordAt(mm, record_length, offset):
+    if record_length > 0:
+        return _TIMESTAMP.unpack_from(mm, SEGMENT_HEADER.size + offset)[0], record_length
+
+    length, time_stamp = _VARLEN_RECORD_START.unpack_from(mm, SEGMENT_HEADER.size + offset)
+    return time_stamp, RECORD_LENGTH_PREFIX.size + length
+
+
+class _Views:
+    # Sequence of views for retrieve callback; elements are memoryviews or functions returning them,
+    # which are called only when element is read
+    def __init__(self, parts):
+        self.parts = parts
+
+    def __len__(self):
+        return len(self.parts)
+
+    def __getitem__(self, i):
+        part = self.parts[i]
+        return part() if callable(part) else part
+
+    def __iter__(self):
+        for part in self.parts:
+            yield part() if callable(part) else part
+
+
+class _Segment:
+    # record_length of 0 means records of variable length, each with RECORD_LENGTH_PREFIX in front
+    def __init__(self, path, sequence, record_length, created):
+        self.path = path
+        self.sequence = sequence
+        self.record_length = record_length
+        self.created = created
+        self.count = 0
+        self.data_size = 0
+        self.first_timestamp = None
+        self.last_timestamp = None
+        self.index = array.array('d')
+        self.index_offsets = array.array('q')
+        self.mmap = None
+        self.mapped_size = 0
+
+    def size(self):
+        return SEGMENT_HEADER.size + self.data_size
+
+    def added(self, time_stamp, length):
+        if self.count % INDEX_STEP == 0:
+            if len(self.index) > 0 and time_stamp < self.index[-1]:
+                self.index.append(self.index[-1])  # out of order record - keep index sorted
+            else:
+                self.index.append(time_stamp)
+            self.index_offsets.append(self.data_size)
+        if self.first_timestamp is None:
+            self.first_timestamp = time_stamp
+        if self.last_timestamp is None or time_stamp > self.last_timestamp:
+            self.last_timestamp = time_stamp
+        self.count += 1
+        self.data_size += length
+
+    def map(self):
+        if self.mapped_size != self.data_size:
+            self.unmap()
+            with open(self.path, "rb") as f:
+                self.mmap = mmap.mmap(f.fileno(), self.size(), access=mmap.ACCESS_READ)
+            self.mapped_size = self.data_size
+
+        return self.mmap
+
+    def unmap(self):
+        if self.mmap is not None:
+            try:
+                self.mmap.close()
+            except BufferError:
+                pass  # someone still holds view of it; it will be closed when released
+            self.mmap = None
+            self.mapped_size = 0
+
+    # Returns timestamp and stored length of record at data offset
+    def record(self, offset):
+        return _recordAt(self.mmap, self.record_length, offset)
+
+    def timestamp(self, offset):
+        self.map()
+        return self.record(offset)[0]
+
+    # Returns index and data offset of first record with timestamp >= the_time
+    def find(self, the_time):
+        if self.count == 0 or the_time <= self.first_timestamp:
+            return 0, 0
+        if the_time > self.last_timestamp:
+            return self.count, self.data_size
+
+        self.map()
+        k = max(0, bisect.bisect_left(self.index, the_time) - 1)
+        i = k * INDEX_STEP
+        offset = self.index_offsets[k]
+        end = min(self.count, (k + 1) * INDEX_STEP + 1)
+        while i < end:
+            time_stamp, length = self.record(offset)
+            if time_stamp >= the_time:
+                break
+            offset += length
+            i += 1
+        return i, offset
+
+    def view(self, from_offset, to_offset):
+        mm = self.map()
+        return memoryview(mm)[SEGMENT_HEADER.size + from_offset:SEGMENT_HEADER.size + to_offset]
+
+    def views(self, from_offset, to_offset):
+        return [self.view(from_offset, to_offset)]
+
+    @staticmethod
+    def load(path, sequence):
+        with open(path, "r+b") as f:
+            header = f.read(SEGMENT_HEADER.size)
+            if len(header) < SEGMENT_HEADER.size:
+                return None
+            magic, version, _, record_length, created = SEGMENT_HEADER.unpack(header)
+            if magic != SEGMENT_MAGIC or version != SEGMENT_VERSION:
+                return None
+
+            segment = _Segment(path, sequence, record_length, created)
+            file_size = os.fstat(f.fileno()).st_size
+            if file_size > SEGMENT_HEADER.size:
+                # mapping whole file and going through records; anything after last whole record is
+                # partially written record from the process being killed
+                segment.data_size = file_size - SEGMENT_HEADER.size
+                segment.map()
+                data_size = segment.data_size
+                segment.data_size = 0
+                if record_length > 0:
+                    while segment.data_size + record_length <= data_size:
+                        segment.added(segment.record(segment.data_size)[0], record_length)
+                else:
+                    while segment.data_size + _VARLEN_RECORD_START.size <= data_size:
+                        time_stamp, length = segment.record(segment.data_size)
+                        if segment.data_size + length > data_size:
+                            break
+                        segment.added(time_stamp, length)
+                segment.unmap()
+
+            if segment.size() != file_size:
+                f.truncate(segment.size())
+
+        return segment
+
+
+class _CompressedSegment:
+    def __init__(self, path, sequence, record_length, created, stream):
+        self.path = path
+        self.sequence = sequence
+        self.record_length = record_length
+        self.created = created
+        self.stream = stream
+        self.count = 0
+        self.file_size = SEGMENT_HEADER.size
+        self.first_timestamp = None
+        self.last_timestamp = None
+        self.block_offsets = []
+        self.block_lengths = []
+        self.block_starts = []  # index of first record of each block
+        self.block_last_timestamps = array.array('d')
+        self.offset_unit = record_length if record_length > 0 else 1
+        self.cached_block = None
+        self.cached_records = None
+        self.cached_varlen = None  # variable length fields of cached records - see decodeBlockColumns
+
+    def size(self):
+        return self.file_size
+
+    def _added(self, length, count, first_timestamp, last_timestamp):
+        self.block_offsets.append(self.file_size + _BLOCK_ENTRY.size)
+        self.block_lengths.append(length)
+        self.block_starts.append(self.count)
+        self.block_last_timestamps.append(max(last_timestamp, self.block_last_timestamps[-1]) if len(self.block_last_timestamps) > 0 else last_timestamp)
+        if self.first_timestamp is None:
+            self.first_timestamp = first_timestamp
+        if self.last_timestamp is None or last_timestamp > self.last_timestamp:
+            self.last_timestamp = last_timestamp
+        self.count += count
+        self.file_size += _BLOCK_ENTRY.size + length
+
+    def _block(self, block):
+        if self.cached_block != block:
+            from telemetry import telemetry_compression
+
+            with open(self.path, "rb") as f:
+                f.seek(self.block_offsets[block])
+                data = f.read(self.block_lengths[block])
+            self.cached_records, self.cached_varlen = telemetry_compression.decodeBlockColumns(self.stream, data)
+            self.cached_block = block
+
+        return self.cached_records
+
+    def unmap(self):
+        self.cached_block = None
+        self.cached_records = None
+        self.cached_varlen = None
+
+    def timestamp(self, offset):
+        index = offset // self.offset_unit
+        block = bisect.bisect_right(self.block_starts, index) - 1
+        return float(self._block(block)['timestamp'][index - self.block_starts[block]])
+
+    # Returns index and offset (as if records were not compressed) of first record with timestamp >= the_time
+    def find(self, the_time):
+        if self.count == 0 or the_time <= self.first_timestamp:
+            return 0, 0
+        if the_time > self.last_timestamp:
+            return self.count, self.count * self.offset_unit
+
+        block = bisect.bisect_left(self.block_last_timestamps, the_time)
+        records = self._block(block)
+        index = self.block_starts[block] + int(records['timestamp'].searchsorted(the_time, side='left'))
+        return index, index * self.offset_unit
+
+    # Returns records between record indexes of one block, which are decoded if not cached
+    def _blockView(self, block, from_index, to_index):
+        start = self.block_starts[block]
+        records = self._block(block)
+        selected = slice(max(0, from_index - start), to_index - start)
+        if self.cached_varlen is None:
+            return memoryview(records[selected].tobytes())
+        return memoryview(self.stream.joinVarLenRecords(records[selected].tobytes(), b''.join(self.cached_varlen[selected])))
+
+    # Returns list of functions returning view of each block in range - nothing is decoded until called
+    def views(self, from_offset, to_offset):
+        from_index = from_offset // self.offset_unit
+        to_index = to_offset // self.offset_unit
+        block = bisect.bisect_right(self.block_starts, from_index) - 1
+        views = []
+        while block < len(self.block_starts) and self.block_starts[block] < to_index:
+            views.append(lambda block=block: self._blockView(block, from_index, to_index))
+            block += 1
+
+        return views
+
+    @staticmethod
+    def load(path, sequence, stream):
+        with open(path, "rb") as f:
+            header = f.read(SEGMENT_HEADER.size)
+            if len(header) < SEGMENT_HEADER.size:
+                return None
+            magic, version, _, record_length, created = SEGMENT_HEADER.unpack(header)
+            if magic != COMPRESSED_SEGMENT_MAGIC or version != SEGMENT_VERSION:
+                return None
+
+            segment = _CompressedSegment(path, sequence, record_length, created, stream)
+            file_size = os.fstat(f.fileno()).st_size
+            while segment.file_size + _BLOCK_ENTRY.size <= file_size:
+                f.seek(segment.file_size)
+                length, count, first_timestamp, last_timestamp = _BLOCK_ENTRY.unpack(f.read(_BLOCK_ENTRY.size))
+                if segment.file_size + _BLOCK_ENTRY.size + length > file_size:
+                    return None
+                segment._added(length, count, first_timestamp, last_timestamp)
+
+        return segment
+
+    # Writes records of closed segment compressed next to it (with .tmp suffix) and returns new segment
+    # which replaces it - see _StreamSegments.replaceCompressed. Segment is read through its own mapping,
+    # so this can run outside of storage lock.
+    @staticmethod
+    def compress(segment, stream, use_zlib):
+        from telemetry import telemetry_compression
+
+        path = segment.path[:-len(SEGMENT_SUFFIX)] + COMPRESSED_SEGMENT_SUFFIX
+        compressed = _CompressedSegment(path, segment.sequence, segment.record_length, segment.created, stream)
+        with open(segment.path, "rb") as f:
+            mm = mmap.mmap(f.fileno(), segment.size(), access=mmap.ACCESS_READ)
+        try:
+            offset = 0
+            with open(path + ".tmp", "wb") as f:
+                f.write(SEGMENT_HEADER.pack(COMPRESSED_SEGMENT_MAGIC, SEGMENT_VERSION, 0, segment.record_length, segment.created))
+                for start in range(0, segment.count, COMPRESSED_BLOCK_RECORDS):
+                    end = min(segment.count, start + COMPRESSED_BLOCK_RECORDS)
+                    block_offset = offset
+                    first_timestamp = _recordAt(mm, segment.record_length, offset)[0]
+                    for i in range(start, end):
+                        last_timestamp, length = _recordAt(mm, segment.record_length, offset)
+                        offset += length
+                    data = mm[SEGMENT_HEADER.size + block_offset:SEGMENT_HEADER.size + offset]
+                    block = telemetry_compression.encodeBlock(stream, data, use_zlib)
+                    f.write(_BLOCK_ENTRY.pack(len(block), end - start, first_timestamp, last_timestamp))
+                    f.write(block)
+                    compressed._added(len(block), end - start, first_timestamp, last_timestamp)
+                f.flush()
+                os.fsync(f.fileno())
+        finally:
+            mm.close()
+
+        return compressed
+
+
+class _StreamSegments:
+    # compressor(stream_segments, segment) is called with each closed segment when compression is set
+    def __init__(self, directory, record_length, stream=None, compression=None, compressor=None):
+        self.directory = directory
+        self.record_length = record_length
+        self.stream = stream
+        self.compression = compression
+        self.compressor = compressor
+        self.segments = []
+        self.active = None
+        self.active_fd = None
+        self.next_sequence = 1
+        self.trim_timestamp = 0.0
+
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+        names = os.listdir(directory)
+        for name in sorted(names):
+            if name.endswith(".tmp"):
+                os.remove(os.path.join(directory, name))  # left from compressing or writing trim when process was killed
+            elif name.endswith(SEGMENT_SUFFIX) or name.endswith(COMPRESSED_SEGMENT_SUFFIX):
+                try:
+                    sequence = int(name[:name.rindex('.')])
+                except ValueError:
+                    continue
+                self.next_sequence = max(self.next_sequence, sequence + 1)
+                if name.endswith(COMPRESSED_SEGMENT_SUFFIX):
+                    segment = _CompressedSegment.load(os.path.join(directory, name), sequence, stream)
+                elif name[:-len(SEGMENT_SUFFIX)] + COMPRESSED_SEGMENT_SUFFIX in names:
+                    os.remove(os.path.join(directory, name))  # was compressed but not removed
+                    continue
+                else:
+                    segment = _Segment.load(os.path.join(directory, name), sequence)
+                if segment is None:
+                    print("ERROR: Ignoring broken telemetry segment " + os.path.join(directory, name))
+                elif segment.record_length != record_length:
+                    print("ERROR: Ignoring telemetry segment " + os.path.join(directory, name) + " with different record size " + str(segment.record_length))
+                elif segment.count > 0:
+                    self.segments.append(segment)
+                else:
+                    os.remove(segment.path)
+
+        self.segments.sort(key=lambda s: s.sequence)
+
+        trim_path = os.path.join(directory, TRIM_FILE)
+        if os.path.exists(trim_path):
+            try:
+                with open(trim_path, "r") as f:
+                    self.trim_timestamp = float(f.read())
+            except ValueError:
+                pass
+
+    def size(self):
+        return sum([segment.size() for segment in self.segments])
+
+    def startSegment(self):
+        self.closeActive()
+
+        now = time.time()
+        sequence = self.next_sequence
+        self.next_sequence += 1
+
+        path = os.path.join(self.directory, "{0:010d}".format(sequence) + SEGMENT_SUFFIX)
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | os.O_APPEND, 0o644)
+        os.write(fd, SEGMENT_HEADER.pack(SEGMENT_MAGIC, SEGMENT_VERSION, 0, self.record_length, now))
+
+        self.active = _Segment(path, sequence, self.record_length, now)
+        self.active_fd = fd
+        self.segments.append(self.active)
+
+    def closeActive(self):
+        if self.active_fd is not None:
+            os.fsync(self.active_fd)
+            os.close(self.active_fd)
+            self.active_fd = None
+            if self.active.count == 0:
+                self.removeSegment(self.active)
+            elif self.compression is not None and self.compressor is not None:
+                self.compressor(self, self.active)
+            self.active = None
+
+    # Swaps compressed segment (None if compressing failed) in place of the original one, unless the
+    # original was removed meanwhile
+    def replaceCompressed(self, segment, compressed):
+        if compressed is None:
+            if os.path.exists(segment.path[:-len(SEGMENT_SUFFIX)] + COMPRESSED_SEGMENT_SUFFIX + ".tmp"):
+                os.remove(segment.path[:-len(SEGMENT_SUFFIX)] + COMPRESSED_SEGMENT_SUFFIX + ".tmp")
+        elif segment not in self.segments:
+            os.remove(compressed.path + ".tmp")
+        else:
+            os.rename(compressed.path + ".tmp", compressed.path)
+            self.segments[self.segments.index(segment)] = compressed
+            segment.unmap()
+            os.remove(segment.path)
+
+    def removeSegment(self, segment):
+        segment.unmap()
+        self.segments.remove(segment)
+        try:
+            os.remove(segment.path)
+        except OSError:
+            pass
+
+    def append(self, time_stamp, record):
+        os.write(self.active_fd, record)
+        self.active.added(time_stamp, len(record))
+
+    def appendMany(self, time_stamps, records):
+        os.write(self.active_fd, b''.join(records))
+        for time_stamp, record in zip(time_stamps, records):
+            self.active.added(time_stamp, len(record))
+
+    def writeTrim(self, to_timestamp):
+        self.trim_timestamp = to_timestamp
+        trim_path = os.path.join(self.directory, TRIM_FILE)
+        with open(trim_path + ".tmp", "w") as f:
+            f.write(repr(to_timestamp))
+        os.rename(trim_path + ".tmp", trim_path)
+
+    def close(self):
+        self.closeActive()
+        for segment in self.segments:
+            segment.unmap()
+
+
+class FileTelemetryStorage(TelemetryStorage):
+    # compression is None, ENCODING_COLUMNAR or ENCODING_COLUMNAR_ZLIB (needs numpy)
+    def __init__(self, directory="~/telemetry-data", segment_size=4 * 1024 * 1024, segment_age=600, max_size=256 * 1024 * 1024, max_age=None, compression=None):
+        super(FileTelemetryStorage, self).__init__()
+        self.directory = os.path.expanduser(directory)
+        self.compression = compression
+        self.segment_size = segment_size
+        self.segment_age = segment_age
+        self.max_size = max_size
+        self.max_age = max_age
+        self.streams = {}
+        self.lock = threading.Lock()
+        self.compress_queue = queue.Queue()
+        self.compress_thread = None
+
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory)
+
+    def _segments(self, stream):
+        storage_name = stream.storageName()
+        stream_segments = self.streams.get(storage_name)
+        if stream_segments is None:
+            record_length = stream.fixed_length if stream.fixed_length is not None else 0
+            stream_segments = _StreamSegments(os.path.join(self.directory, storage_name.replace("/", "_")), record_length, stream, self.compression, self._compressLater)
+            self.streams[storage_name] = stream_segments
+
+        return stream_segments
+
+    def _compressLater(self, stream_segments, segment):
+        if self.compress_thread is None:
+            self.compress_thread = threading.Thread(target=self._compressSegments, daemon=True)
+            self.compress_thread.start()
+        self.compress_queue.put((stream_segments, segment))
+
+    def _compressSegments(self):
+        while True:
+            item = self.compress_queue.get()
+            if item is None:
+                return
+
+            stream_segments, segment = item
+            try:
+                compressed = _CompressedSegment.compress(segment, stream_segments.stream, self.compression == ENCODING_COLUMNAR_ZLIB)
+            except Exception as ex:
+                compressed = None
+                if segment in stream_segments.segments:
+                    print("ERROR: Cannot compress telemetry segment " + segment.path + "; " + str(ex))
+
+            with self.lock:
+                try:
+                    stream_segments.replaceCompressed(segment, compressed)
+                except Exception as ex:
+                    print("ERROR: Cannot replace telemetry segment " + segment.path + " with compressed one; " + str(ex))
+
+    def _expire(self, stream_segments):
+        total = stream_segments.size()
+        oldest_allowed = time.time() - self.max_age if self.max_age is not None else None
+        while len(stream_segments.segments) > 1:
+            oldest = stream_segments.segments[0]
+            if (self.max_size is not None and total > self.max_size) or (oldest_allowed is not None and oldest.last_timestamp < oldest_allowed):
+                total -= oldest.size()
+                stream_segments.removeSegment(oldest)
+            else:
+                break
+
+    def store(self, stream, time_stamp, record):
+        with self.lock:
+            stream_segments = self._segments(stream)
+            if stream_segments.record_length == 0:
+                record = RECORD_LENGTH_PREFIX.pack(len(record)) + record
+            elif len(record) != stream_segments.record_length:
+                print("ERROR: Record of size " + str(len(record)) + " does not fit stream " + stream.name + " record size " + str(stream_segments.record_length))
+                return
+
+            active = stream_segments.active
+            if active is None or active.size() >= self.segment_size or active.created + self.segment_age < time.time():
+                stream_segments.startSegment()
+                self._expire(stream_segments)
+
+            stream_segments.append(time_stamp, record)
+
+    def store_many(self, stream, records):
+        with self.lock:
+            stream_segments = self._segments(stream)
+            record_length = stream_segments.record_length
+
+            # records are written with one write per segment
+            now = time.time()
+            time_stamps = []
+            pending = []
+            pending_size = 0
+            for time_stamp, record in records:
+                if record_length == 0:
+                    record = RECORD_LENGTH_PREFIX.pack(len(record)) + record
+                elif len(record) != record_length:
+                    print("ERROR: Record of size " + str(len(record)) + " does not fit stream " + stream.name + " record size " + str(record_length))
+                    continue
+
+                active = stream_segments.active
+                if active is None or active.size() + pending_size >= self.segment_size or active.created + self.segment_age < now:
+                    if len(pending) > 0:
+                        stream_segments.appendMany(time_stamps, pending)
+                        time_stamps = []
+                        pending = []
+                        pending_size = 0
+                    stream_segments.startSegment()
+                    self._expire(stream_segments)
+
+                time_stamps.append(time_stamp)
+                pending.append(record)
+                pending_size += len(record)
+
+            if len(pending) > 0:
+                stream_segments.appendMany(time_stamps, pending)
+
+    def trim(self, stream, to_timestamp):
+        with self.lock:
+            stream_segments = self._segments(stream)
+            for segment in list(stream_segments.segments):
+                if segment is not stream_segments.active and segment.last_timestamp < to_timestamp:
+                    stream_segments.removeSegment(segment)
+
+            if to_timestamp > stream_segments.trim_timestamp:
+                stream_segments.writeTrim(to_timestamp)
+
+    def retrieve(self, stream, from_timestamp, to_timestmap, callback):
+        with self.lock:
+            stream_segments = self._segments(stream)
+            from_timestamp = max(from_timestamp, stream_segments.trim_timestamp)
+
+            views = []
+            for segment in stream_segments.segments:
+                if segment.count > 0 and segment.last_timestamp >= from_timestamp and segment.first_timestamp < to_timestmap:
+                    _, start = segment.find(from_timestamp)
+                    _, end = segment.find(to_timestmap)
+                    if start < end:
+                        views += segment.views(start, end)
+
+            callback(_Views(views))
+
+    def getOldestTimestamp(self, stream, callback):
+        with self.lock:
+            stream_segments = self._segments(stream)
+            oldest = None
+            count = 0
+            for segment in stream_segments.segments:
+                if segment.count > 0 and segment.last_timestamp >= stream_segments.trim_timestamp:
+                    start, offset = segment.find(stream_segments.trim_timestamp)
+                    if oldest is None:
+                        oldest = segment.timestamp(offset) if start > 0 else segment.first_timestamp
+                    count += segment.count - start
+
+            if oldest is not None:
+                return callback(oldest, count)
+
+        return callback(0, 0)
+
+    # Closes all streams; waits for segments closed by it to be compressed
+    def close(self):
+        with self.lock:
+            for stream_segments in self.streams.values():
+                stream_segments.close()
+
+        if self.compress_thread is not None:
+            self.compress_queue.put(None)
+            self.compress_thread.join()
+            self.compress_thread = None
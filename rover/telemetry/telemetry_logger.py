@@ -5,10 +5,13 @@
 #
 
 import os
-import struct
 import uuid
 
 from telemetry import TelemetryStreamDefinition
+from telemetry.telemetry_ring import TelemetryRingWriter, RING_DIRECTORY, RING_CAPACITY
+
+TRANSPORT_FIFO = 'fifo'
+TRANSPORT_SHARED_MEMORY = 'shm'
 
 
 class TelemetryLoggerDestination:
@@ -35,17 +38,40 @@ class LocalPipeTelemetryLoggerDestination(TelemetryLoggerDestination):
         self.pipe = os.fdopen(self.pipe_fd, 'wb', buffering=0)
 
     def log(self, stream, time_stamp, *args):
-        if stream.fixed_length is None:
-            raise NotImplemented("Variable record size len is not yet implemented")
-
-        record = struct.pack(stream.pack_string, time_stamp, *args)
+        record = stream.packRecord(time_stamp, *args)
 
-        buf = stream.header + record
+        buf = stream.frameHeader(record) + record
 
         self.pipe.write(buf)
         # self.pipe.write(record)
 
 
+class SharedMemoryTelemetryLoggerDestination(TelemetryLoggerDestination):
+    # Writes frames to shared memory ring of this process (see telemetry_ring). Use sharedMemoryDestination()
+    # so all loggers of the process share one ring.
+    def __init__(self, ring_directory=RING_DIRECTORY, capacity=RING_CAPACITY):
+        super(SharedMemoryTelemetryLoggerDestination, self).__init__()
+        self.ring = TelemetryRingWriter(ring_directory, capacity)
+
+    def log(self, stream, time_stamp, *args):
+        record = stream.packRecord(time_stamp, *args)
+        self.ring.write(stream.frameHeader(record) + record)
+
+    # Number of records which did not fit to the ring
+    def dropped(self):
+        return self.ring.dropped
+
+
+_shared_memory_destination = None
+
+
+def sharedMemoryDestination():
+    global _shared_memory_destination
+    if _shared_memory_destination is None or _shared_memory_destination[0] != os.getpid():
+        _shared_memory_destination = (os.getpid(), SharedMemoryTelemetryLoggerDestination())
+    return _shared_memory_destination[1]
+
+
 class LocalMemoryTelemetryLoggerDestination(TelemetryLoggerDestination):
     def __init__(self):
         super(LocalMemoryTelemetryLoggerDestination, self).__init__()
@@ -91,8 +117,9 @@ class PubSubTelemetryLoggerClient(TelemetryLoggerClient):
 
 
 class TelemetryLogger(TelemetryStreamDefinition):
-    # Logs to a stream
-    def __init__(self, stream_name, destination=None, telemetry_client=None):
+    # Logs to a stream. With stream_cache (TelemetryStreamCache) which has seen this stream before, logger is
+    # ready as soon as init is called, using cached id; registration then only confirms (or corrects) the id.
+    def __init__(self, stream_name, destination=None, telemetry_client=None, stream_cache=None):
         super(TelemetryLogger, self).__init__(stream_name)
         self.stream_ready = False
         self.registration_error = 0
@@ -101,17 +128,28 @@ class TelemetryLogger(TelemetryStreamDefinition):
         else:
             self.destination = destination
         self.telemetry_client = telemetry_client
+        self.stream_cache = stream_cache
 
     def _finishRegistration(self, stream_id):
         if stream_id > 0:
-            self.build(stream_id)
-            self.stream_ready = True
+            if not self.stream_ready or stream_id != self.stream_id:
+                self.build(stream_id)
+                self.stream_ready = True
+            if self.stream_cache is not None:
+                self.stream_cache.put(self)
         else:
+            self.stream_ready = False
             self.registration_error = stream_id
             # TODO - what now?
             pass
 
     def init(self):
+        if self.stream_cache is not None:
+            cached = self.stream_cache.get(self.schemaHash())
+            if cached is not None and cached.stream_id > 0:
+                self.build(cached.stream_id)
+                self.stream_ready = True
+
         self.telemetry_client.registerStream(self, self._finishRegistration)
 
     def log(self, time_stamp, *args):
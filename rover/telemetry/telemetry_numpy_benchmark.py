@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+
+#
+# Copyright 2019 Games Creators Club
+#
+# MIT License
+#
+
+#
+# Decode cost of retrieved telemetry payload with rover state like records: previous record by record
+# struct.unpack, struct.iter_unpack over whole payload (unpackRecords) and numpy structured array
+# (recordsArray), followed by computing mean of one column.
+#
+# Needs numpy. Usage (from rover directory):
+#     python3 -m telemetry.telemetry_numpy_benchmark
+#
+
+import struct
+import time
+
+from telemetry.telemetry_stream import TelemetryStreamDefinition
+
+RECORDS = 1000000
+
+
+def makeStream():
+    stream = TelemetryStreamDefinition("rover-state")
+    stream.addDouble("last_time").addDouble("time")
+    for w in ['fl', 'fr', 'bl', 'br']:
+        stream.addWord("odo_" + w).addByte("odo_status_" + w).addWord("deg_" + w).addByte("deg_status_" + w)
+        stream.addDouble("speed_" + w).addDouble("angle_" + w)
+    for a in [0, 45, 90, 135, 180, 225, 270, 315]:
+        stream.addWord("radar_" + str(a)).addByte("radar_status_" + str(a))
+    stream.addDouble("heading").addDouble("heading_change").addDouble("pitch").addDouble("roll")
+    stream.addFloat("accel_x").addFloat("accel_y").addFloat("accel_z")
+    stream.addFixedString("selection", 8)
+    stream.build(1)
+    return stream
+
+
+def makePayload(stream):
+    values = []
+    for field in stream.fields:
+        if field.packFormat() in ['d', 'f']:
+            values.append(0.5)
+        elif field.packFormat().endswith('s'):
+            values.append(b'sel')
+        else:
+            values.append(7)
+
+    record_struct = struct.Struct(stream.pack_string)
+    payload = bytearray(RECORDS * stream.fixed_length)
+    for i in range(RECORDS):
+        record_struct.pack_into(payload, i * stream.fixed_length, float(i), *values)
+    return bytes(payload)
+
+
+def oldDecode(stream, payload):
+    record_length = stream.fixed_length
+    records = []
+    for i in range(0, len(payload) // record_length):
+        records.append(struct.unpack(stream.pack_string, payload[i * record_length: (i + 1) * record_length]))
+    return sum(record[1] for record in records) / len(records)
+
+
+def tupleDecode(stream, payload):
+    records = stream.unpackRecords(payload)
+    return sum(record[1] for record in records) / len(records)
+
+
+def arrayDecode(stream, payload):
+    array = stream.recordsArray(payload)
+    return array['last_time'].mean()
+
+
+def benchmark(name, decode, stream, payload):
+    started = time.perf_counter()
+    result = decode(stream, payload)
+    elapsed = time.perf_counter() - started
+    print("{0:<12} {1:>12.3f} {2:>15.0f} {3:>15}".format(name, elapsed * 1000, RECORDS / elapsed, result))
+
+
+if __name__ == "__main__":
+    stream = makeStream()
+    payload = makePayload(stream)
+    print(str(RECORDS) + " records, " + str(len(stream.fields)) + " fields, record size " + str(stream.fixed_length) + " bytes")
+    print("{0:<12} {1:>12} {2:>15} {3:>15}".format("decode", "ms", "records/s", "mean"))
+    benchmark("unpack", oldDecode, stream, payload)
+    benchmark("iter_unpack", tupleDecode, stream, payload)
+    benchmark("numpy", arrayDecode, stream, payload)
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+
+#
+# Copyright 2019 Games Creators Club
+#
+# MIT License
+#
+
+#
+# Ingest rate of telemetry fifo: previous field by field reader storing records one by one
+# against TelemetryFrameParser with store_many. Frames are written to an os.pipe from a separate thread.
+#
+# Usage (from rover directory):
+#     python3 -m telemetry.telemetry_pipe_benchmark
+#
+
+import os
+import struct
+import threading
+import time
+
+from telemetry.telemetry_stream import TelemetryStreamDefinition
+from telemetry.telemetry_storage import MemoryTelemetryStorage
+from telemetry.telemetry_server import TelemetryFrameParser
+
+RECORDS = 200000
+STREAMS = 4
+WRITE_CHUNK = 65536
+
+
+def makeStreams():
+    streams = {}
+    for i in range(STREAMS):
+        stream = TelemetryStreamDefinition("rover-state-" + str(i))
+        for w in ['fl', 'fr', 'bl', 'br']:
+            stream.addWord("odo_" + w).addWord("odo_status_" + w).addWord("deg_" + w).addWord("deg_status_" + w)
+        stream.addFloat("heading").addFixedString("selection", 17)
+        stream.build(i + 1)
+        streams[stream.stream_id] = stream
+    return streams
+
+
+def makeData(streams):
+    frames = []
+    for i in range(RECORDS):
+        stream = streams[i % STREAMS + 1]
+        record = struct.pack(stream.pack_string, float(i), *([i & 0xFFFF] * 16 + [0.5, b'selection']))
+        frames.append(stream.header + record)
+    return b''.join(frames)
+
+
+def writer(fd, data):
+    view = memoryview(data)
+    p = 0
+    while p < len(view):
+        p += os.write(fd, view[p:p + WRITE_CHUNK])
+    os.close(fd)
+
+
+def readOld(pipe, streams, storage):
+    def read_pipe(size):
+        buf = pipe.read(size)
+        if len(buf) == size:
+            return buf
+        while len(buf) < size:
+            bb = pipe.read(size - len(buf))
+            if bb == b'':
+                raise EOFError()
+            buf = buf + bb
+        return buf
+
+    count = 0
+    try:
+        while True:
+            d = read_pipe(1)[0]
+            if d & 1 == 0:
+                stream_id = struct.unpack('<B', read_pipe(1))[0]
+            else:
+                stream_id = struct.unpack('<H', read_pipe(2))[0]
+
+            if d & 6 == 0:
+                record_size = struct.unpack('<B', read_pipe(1))[0]
+            elif d & 6 == 2:
+                record_size = struct.unpack('<H', read_pipe(2))[0]
+            else:
+                record_size = struct.unpack('<I', read_pipe(4))[0]
+
+            record = read_pipe(record_size)
+            stream = streams[stream_id]
+            storage.store(stream, stream.extractTimestamp(record), record)
+            count += 1
+    except (EOFError, IndexError):
+        pass
+    return count
+
+
+def readNew(pipe, streams, storage):
+    unpack_timestamp = struct.Struct('<d').unpack_from
+    parser = TelemetryFrameParser()
+    count = 0
+    while parser.readFrom(pipe) > 0:
+        batches = {}
+        for stream_id, record in parser.frames():
+            batches.setdefault(stream_id, []).append(record)
+        for stream_id, records in batches.items():
+            stream = streams[stream_id]
+            storage.store_many(stream, [(unpack_timestamp(record)[0], record) for record in records])
+            count += len(records)
+    return count
+
+
+def benchmark(name, reader, streams, data):
+    r, w = os.pipe()
+    storage = MemoryTelemetryStorage(max_records=RECORDS)
+    thread = threading.Thread(target=writer, args=(w, data), daemon=True)
+    started = time.perf_counter()
+    thread.start()
+    with os.fdopen(r, "rb", buffering=0 if reader is readNew else -1) as pipe:
+        count = reader(pipe, streams, storage)
+    elapsed = time.perf_counter() - started
+    thread.join()
+    print("{0:<8} {1:>10} {2:>15.0f}".format(name, count, count / elapsed))
+
+
+if __name__ == "__main__":
+    streams = makeStreams()
+    data = makeData(streams)
+    print("record size " + str(streams[1].fixed_length) + " bytes, " + str(STREAMS) + " streams")
+    print("{0:<8} {1:>10} {2:>15}".format("reader", "records", "records/s"))
+    benchmark("old", readOld, streams, data)
+    benchmark("block", readNew, streams, data)
@@ -7,16 +7,27 @@
 import pyroslib
 
 
-from telemetry import TelemetryLogger, LocalPipeTelemetryLoggerDestination, PubSubTelemetryLoggerClient
+from telemetry import TelemetryLogger, LocalPipeTelemetryLoggerDestination, PubSubTelemetryLoggerClient, TelemetryStreamCache
+from telemetry import TRANSPORT_FIFO, TRANSPORT_SHARED_MEMORY, sharedMemoryDestination
+
+STREAM_CACHE_FILE = "~/.telemetry-cache/{0}.def"  # per telemetry topic
 
 
 class MQTTLocalPipeTelemetryLogger(TelemetryLogger):
-    def __init__(self, stream_name, host="localhost", port=1883, topic=None):
+    # transport is TRANSPORT_FIFO or TRANSPORT_SHARED_MEMORY
+    def __init__(self, stream_name, host="localhost", port=1883, topic=None, transport=TRANSPORT_FIFO):
         if topic is None:
             topic = "telemetry" if pyroslib.getClusterId() == "master" else pyroslib.getClusterId() + ":telemetry"
+        stream_cache = None
+        try:
+            stream_cache = TelemetryStreamCache(STREAM_CACHE_FILE.format(topic.replace(":", "_")))
+        except OSError as ex:
+            print("    cannot read stream cache; " + str(ex))
+
         super(MQTTLocalPipeTelemetryLogger, self).__init__(stream_name,
-                                                           destination=LocalPipeTelemetryLoggerDestination(),
-                                                           telemetry_client=PubSubTelemetryLoggerClient(topic, pyroslib.publish, pyroslib.subscribeBinary))
+                                                           destination=sharedMemoryDestination() if transport == TRANSPORT_SHARED_MEMORY else LocalPipeTelemetryLoggerDestination(),
+                                                           telemetry_client=PubSubTelemetryLoggerClient(topic, pyroslib.publish, pyroslib.subscribeBinary),
+                                                           stream_cache=stream_cache)
 
     def init(self):
         print("    set up topic " + self.telemetry_client.topic)
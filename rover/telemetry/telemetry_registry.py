@@ -0,0 +1,188 @@
+
+#
+# Copyright 2019 Games Creators Club
+#
+# MIT License
+#
+
+#
+# Stream definitions - server side registry and client side cache.
+#
+# Registry gives each stream id which stays the same across restarts when registry has a file: every
+# change is appended to the file as stream definition JSON, one per line, and the file is rewritten
+# (compacted) when loaded. Stream registered with the same name but different fields gets a new version
+# and a new id; records of old versions are still accepted and are kept in storage apart from the new
+# ones (see TelemetryStreamDefinition.storageName).
+#
+# Cache keeps definitions by schema hash, so the same definition is parsed only once, and with a file
+# remembers ids of streams between runs, so loggers can start logging before registration is confirmed.
+#
+
+import os
+import threading
+
+from telemetry.telemetry_stream import streamFromJSON
+
+
+def _makeDirectory(path):
+    directory = os.path.dirname(path)
+    if directory != "" and not os.path.exists(directory):
+        os.makedirs(directory)
+
+
+def _readDefinitions(path):
+    definitions = []
+    if path is not None and os.path.exists(path):
+        with open(path, "r") as f:
+            for line in f:
+                line = line.strip()
+                if line != "":
+                    definitions.append(line)
+
+    return definitions
+
+
+def _writeDefinitions(path, definitions):
+    with open(path + ".tmp", "w") as f:
+        for definition in definitions:
+            f.write(definition + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+    os.rename(path + ".tmp", path)
+
+
+def _appendDefinition(path, definition):
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+    try:
+        os.write(fd, bytes(definition + "\n", 'utf-8'))
+    finally:
+        os.close(fd)
+
+
+# Returns built stream definitions from registry file in order they were registered - for each stream
+# name the last one is its current version. File is only read, so it can be used while service is running.
+def loadDefinitions(path):
+    streams = []
+    for definition in _readDefinitions(path):
+        try:
+            stream = streamFromJSON(definition)
+        except SyntaxError as ex:
+            print("ERROR: Ignoring broken stream definition in " + path + "; " + str(ex))
+            continue
+        if stream is not None:
+            stream.build(stream.stream_id)
+            streams.append(stream)
+
+    return streams
+
+
+class TelemetryStreamRegistry:
+    def __init__(self, path=None):
+        self.path = os.path.expanduser(path) if path is not None else None
+        self.streams = {}  # current version of each stream by name
+        self.stream_ids = {}  # all versions by id
+        self.versions = {}  # all versions by name and then by schema hash
+        self.next_stream_id = 0
+        self.lock = threading.Lock()
+
+        if self.path is not None:
+            _makeDirectory(self.path)
+            self._load()
+
+    def _load(self):
+        for stream in loadDefinitions(self.path):
+            versions = self.versions.setdefault(stream.name, {})
+            versions[stream.schemaHash()] = stream
+            self.stream_ids[stream.stream_id] = stream
+            self.streams[stream.name] = stream  # last one registered is current
+            self.next_stream_id = max(self.next_stream_id, stream.stream_id)
+
+        # current versions are written last so they are current again after next load
+        current = [s for s in self.stream_ids.values() if self.streams[s.name] is not s] + list(self.streams.values())
+        _writeDefinitions(self.path, [stream.toJSON() for stream in current])
+
+    # Registers stream definition. Returns id of the stream.
+    def register(self, stream):
+        with self.lock:
+            schema_hash = stream.schemaHash()
+            versions = self.versions.setdefault(stream.name, {})
+            existing = versions.get(schema_hash)
+            if existing is not None:
+                if self.streams[stream.name] is existing:
+                    return existing.stream_id
+                stream = existing  # older version is in use again
+            else:
+                self.next_stream_id += 1
+                stream.version = max([s.version for s in versions.values()] + [0]) + 1
+                stream.build(self.next_stream_id)
+                versions[schema_hash] = stream
+                self.stream_ids[stream.stream_id] = stream
+                if stream.version > 1:
+                    print("  stream " + stream.name + " changed; registered version " + str(stream.version) + " with id " + str(stream.stream_id))
+
+            self.streams[stream.name] = stream
+            if self.path is not None:
+                _appendDefinition(self.path, stream.toJSON())
+
+            return stream.stream_id
+
+    # Current definitions of all streams, one per line, each preceded by its schema hash and space
+    def definitions(self):
+        with self.lock:
+            return "\n".join([stream.schemaHash() + " " + stream.toJSON() for stream in self.streams.values()])
+
+
+class TelemetryStreamCache:
+    # Definitions by schema hash. With path, hashes and definitions are kept in that file between runs.
+    def __init__(self, path=None):
+        self.path = os.path.expanduser(path) if path is not None else None
+        self.definitions = {}  # unparsed definitions by hash
+        self.streams = {}
+        self.lock = threading.Lock()
+
+        if self.path is not None:
+            _makeDirectory(self.path)
+        for line in _readDefinitions(self.path):
+            i = line.find(' ')
+            if i > 0:
+                self.definitions[line[0:i]] = line[i + 1:]
+
+    # Returns built stream definition or None
+    def get(self, schema_hash):
+        with self.lock:
+            stream = self.streams.get(schema_hash)
+            if stream is None and schema_hash in self.definitions:
+                stream = streamFromJSON(self.definitions[schema_hash])
+                stream.build(stream.stream_id)
+                self.streams[schema_hash] = stream
+            return stream
+
+    # Returns built stream definition for line as returned by TelemetryStreamRegistry.definitions,
+    # parsing it only if the same definition was not seen before
+    def fromDefinition(self, line):
+        i = line.index(' ')
+        schema_hash = line[0:i]
+        definition = line[i + 1:]
+        with self.lock:
+            if self.definitions.get(schema_hash) == definition and schema_hash in self.streams:
+                return self.streams[schema_hash]
+
+        stream = streamFromJSON(definition)
+        stream.build(stream.stream_id)
+        self.put(stream, definition)
+        return stream
+
+    def put(self, stream, definition=None):
+        if definition is None:
+            definition = stream.toJSON()
+
+        schema_hash = stream.schemaHash()
+        with self.lock:
+            self.streams[schema_hash] = stream
+            if self.definitions.get(schema_hash) != definition:
+                self.definitions[schema_hash] = definition
+                if self.path is not None:
+                    try:
+                        _appendDefinition(self.path, schema_hash + " " + definition)
+                    except OSError as ex:
+                        print("ERROR: Cannot write stream cache " + self.path + "; " + str(ex))
@@ -0,0 +1,164 @@
+
+#
+# Copyright 2019 Games Creators Club
+#
+# MIT License
+#
+
+#
+# Replay of recorded telemetry streams.
+#
+# Records of any number of streams are merged by timestamp (k-way merge where only one retrieved chunk
+# of each stream is held at a time, so streams are never loaded fully) and passed to handlers in that
+# order - paced as they were recorded, speed times faster or as fast as possible. Records with the same
+# timestamp come in order streams were added, so every replay of the same data is the same.
+#
+# Handlers get (stream, record) where record is tuple as from stream.unpackRecord (timestamp first).
+# publishHandler and dispatchHandler turn records back to messages on their original topics with
+# a translate function (record -> list of (topic, payload)) - see RoverStateReplay in client/common/rover.py.
+#
+# Usage (from rover directory), prints merged records of streams stored by telemetry service:
+#     python3 -m telemetry.telemetry_replay <stream-definition.json> [<stream-definition.json> ...] [-d <dir>] [-s <speed>]
+#
+
+import heapq
+import sys
+import time
+
+from telemetry.telemetry_stream import streamFromJSON
+from telemetry.telemetry_storage import RetrieveCursor
+
+REPLAY_CHUNK_SIZE = 65536
+AS_FAST_AS_POSSIBLE = 0
+
+
+class StorageReplaySource:
+    # Records of one stream from storage, fetched lazily chunk by chunk
+    def __init__(self, storage, stream, from_timestamp=0.0, to_timestamp=float('inf'), chunk_size=REPLAY_CHUNK_SIZE):
+        self.storage = storage
+        self.stream = stream
+        self.from_timestamp = from_timestamp
+        self.to_timestamp = to_timestamp
+        self.chunk_size = chunk_size
+
+    def __iter__(self):
+        cursor = RetrieveCursor(self.stream, self.from_timestamp, self.to_timestamp, self.chunk_size)
+        while not cursor.finished:
+            for record in self.stream.unpackRecords(cursor.next(self.storage)):
+                yield record
+
+
+def _tagged(source, index):
+    # records are compared by timestamp and then by index of the source - never by the record itself
+    for record in source:
+        yield record[0], index, record
+
+
+def publishHandler(pub_method, translate):
+    def handler(stream, record):
+        for topic, payload in translate(record):
+            pub_method(topic, payload)
+
+    return handler
+
+
+# handlers is dict of topic to handler(topic, message, groups) as pyroslib would invoke it
+def dispatchHandler(handlers, translate):
+    def handler(stream, record):
+        for topic, payload in translate(record):
+            topic_handler = handlers.get(topic)
+            if topic_handler is not None:
+                topic_handler(topic, payload, None)
+
+    return handler
+
+
+class TelemetryReplay:
+    def __init__(self, time_method=time.time, sleep_method=time.sleep):
+        self.time_method = time_method
+        self.sleep_method = sleep_method
+        self.sources = []
+        self.running = False
+        self.count = 0
+        self.max_lag = 0.0
+
+    # source is iterable of records (as from stream.unpackRecord) in timestamp order with stream attribute
+    def addSource(self, source, handler):
+        self.sources.append((source, handler))
+        return self
+
+    def addStream(self, storage, stream, handler, from_timestamp=0.0, to_timestamp=float('inf'), chunk_size=REPLAY_CHUNK_SIZE):
+        return self.addSource(StorageReplaySource(storage, stream, from_timestamp, to_timestamp, chunk_size), handler)
+
+    # Returns merged (source index, record) tuples
+    def records(self):
+        for _, index, record in heapq.merge(*[_tagged(self.sources[i][0], i) for i in range(len(self.sources))]):
+            yield index, record
+
+    def stop(self):
+        self.running = False
+
+    # speed 1 replays records as they were recorded, 2 twice as fast and so on; AS_FAST_AS_POSSIBLE does not wait.
+    # Returns number of replayed records. max_lag is how late (in seconds of wall time) the worst record was.
+    def run(self, speed=1.0):
+        self.running = True
+        self.count = 0
+        self.max_lag = 0.0
+        started = None
+        first_timestamp = None
+        for index, record in self.records():
+            if not self.running:
+                break
+
+            source, handler = self.sources[index]
+            if speed != AS_FAST_AS_POSSIBLE:
+                if started is None:
+                    started = self.time_method()
+                    first_timestamp = record[0]
+                delay = started + (record[0] - first_timestamp) / speed - self.time_method()
+                if delay > 0:
+                    self.sleep_method(delay)
+                elif -delay > self.max_lag:
+                    self.max_lag = -delay
+
+            handler(source.stream, record)
+            self.count += 1
+
+        self.running = False
+        return self.count
+
+
+if __name__ == "__main__":
+    from telemetry.telemetry_file_storage import FileTelemetryStorage
+
+    args = sys.argv[1:]
+    directory = "~/telemetry-data"
+    speed = AS_FAST_AS_POSSIBLE
+    definitions = []
+    while len(args) > 0:
+        arg = args.pop(0)
+        if arg == "-d":
+            directory = args.pop(0)
+        elif arg == "-s":
+            speed = float(args.pop(0))
+        else:
+            definitions.append(arg)
+
+    if len(definitions) == 0:
+        print("Usage: python3 -m telemetry.telemetry_replay <stream-definition.json> [<stream-definition.json> ...] [-d <dir>] [-s <speed>]")
+        sys.exit(1)
+
+    def printRecord(stream, record):
+        print(stream.name + " " + ", ".join([str(f) for f in record]))
+
+    storage = FileTelemetryStorage(directory)
+    replay = TelemetryReplay()
+    for definition in definitions:
+        with open(definition, "r") as f:
+            stream = streamFromJSON(f.read())
+        stream.build(stream.stream_id)
+        replay.addStream(storage, stream, printRecord)
+
+    started = time.time()
+    replay.run(speed)
+    print("Replayed " + str(replay.count) + " records in " + str(round(time.time() - started, 3)) + "s, max lag " + str(round(replay.max_lag, 3)) + "s")
@@ -0,0 +1,152 @@
+
+#
+# Copyright 2019 Games Creators Club
+#
+# MIT License
+#
+
+#
+# Shared memory transport of telemetry frames - alternative to the fifo.
+#
+# Each logging process has its own ring: memory mapped file in RING_DIRECTORY with header followed by
+# capacity bytes of frames (same framing as in the fifo). Writer appends frames and moves write
+# position; telemetry server polls all rings, takes everything between read and write position and moves
+# read position. Each position is written by one side only, and writer moves write position only after
+# whole frame is copied, so no locks are shared between processes and writing is just copying to memory.
+# When there is no room for a frame, it is dropped and dropped counter in the header is incremented.
+#
+# Positions are ever increasing byte counts; offset in the ring is position modulo capacity.
+#
+
+import mmap
+import os
+import struct
+import threading
+import uuid
+
+RING_MAGIC = b'GCCR'
+RING_VERSION = 1
+RING_HEADER = struct.Struct('<4sHHII')  # magic, version, flags, capacity, pid
+RING_HEADER_SIZE = 64
+RING_SUFFIX = ".ring"
+RING_FLAG_CLOSED = 1
+
+RING_DIRECTORY = "/dev/shm/telemetry-rings" if os.path.isdir("/dev/shm") else "~/telemetry-rings"
+RING_CAPACITY = 1024 * 1024
+
+_FLAGS_OFFSET = 6
+_WRITE_OFFSET = 16
+_READ_OFFSET = 24
+_DROPPED_OFFSET = 32
+_POSITION = struct.Struct('<Q')
+_FLAGS = struct.Struct('<H')
+
+
+class TelemetryRingWriter:
+    def __init__(self, directory=RING_DIRECTORY, capacity=RING_CAPACITY):
+        directory = os.path.expanduser(directory)
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+        self.capacity = capacity
+        self.path = os.path.join(directory, str(os.getpid()) + "-" + str(uuid.uuid4())[0:8] + RING_SUFFIX)
+        self.write_position = 0
+        self.dropped = 0
+        self.lock = threading.Lock()  # one producer - threads of the process take turns
+
+        # ring gets its name only when header is written so server never sees it half made
+        size = RING_HEADER_SIZE + capacity
+        fd = os.open(self.path + ".tmp", os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            os.ftruncate(fd, size)
+            os.write(fd, RING_HEADER.pack(RING_MAGIC, RING_VERSION, 0, capacity, os.getpid()))
+            self.map = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+        os.rename(self.path + ".tmp", self.path)
+
+    # Returns False if there was no room for the frame and it was dropped
+    def write(self, frame):
+        length = len(frame)
+        capacity = self.capacity
+        with self.lock:
+            read_position = _POSITION.unpack_from(self.map, _READ_OFFSET)[0]
+            if capacity - (self.write_position - read_position) < length:
+                self.dropped += 1
+                _POSITION.pack_into(self.map, _DROPPED_OFFSET, self.dropped)
+                return False
+
+            start = self.write_position % capacity
+            if start + length <= capacity:
+                self.map[RING_HEADER_SIZE + start:RING_HEADER_SIZE + start + length] = frame
+            else:
+                first = capacity - start
+                self.map[RING_HEADER_SIZE + start:RING_HEADER_SIZE + capacity] = frame[0:first]
+                self.map[RING_HEADER_SIZE:RING_HEADER_SIZE + length - first] = frame[first:]
+
+            self.write_position += length
+            _POSITION.pack_into(self.map, _WRITE_OFFSET, self.write_position)
+            return True
+
+    # Server removes closed ring once it has read everything from it
+    def close(self):
+        with self.lock:
+            _FLAGS.pack_into(self.map, _FLAGS_OFFSET, RING_FLAG_CLOSED)
+            self.map.close()
+
+
+class TelemetryRingReader:
+    def __init__(self, path):
+        self.path = path
+        fd = os.open(path, os.O_RDWR)
+        try:
+            size = os.fstat(fd).st_size
+            self.map = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+
+        magic, version, _, self.capacity, self.pid = RING_HEADER.unpack_from(self.map, 0)
+        if magic != RING_MAGIC or version != RING_VERSION or size != RING_HEADER_SIZE + self.capacity:
+            self.map.close()
+            raise ValueError("Not a telemetry ring or unsupported version " + str(version))
+
+        self.read_position = _POSITION.unpack_from(self.map, _READ_OFFSET)[0]
+
+    # Returns all frames written since last read
+    def read(self):
+        write_position = _POSITION.unpack_from(self.map, _WRITE_OFFSET)[0]
+        length = write_position - self.read_position
+        if length == 0:
+            return b''
+
+        capacity = self.capacity
+        start = self.read_position % capacity
+        if start + length <= capacity:
+            data = self.map[RING_HEADER_SIZE + start:RING_HEADER_SIZE + start + length]
+        else:
+            data = self.map[RING_HEADER_SIZE + start:RING_HEADER_SIZE + capacity] + self.map[RING_HEADER_SIZE:RING_HEADER_SIZE + length - capacity + start]
+
+        self.read_position = write_position
+        _POSITION.pack_into(self.map, _READ_OFFSET, write_position)
+        return data
+
+    def dropped(self):
+        return _POSITION.unpack_from(self.map, _DROPPED_OFFSET)[0]
+
+    def writerGone(self):
+        if _FLAGS.unpack_from(self.map, _FLAGS_OFFSET)[0] & RING_FLAG_CLOSED:
+            return True
+        try:
+            os.kill(self.pid, 0)
+            return False
+        except ProcessLookupError:
+            return True
+        except PermissionError:
+            return False
+
+    def close(self):
+        self.map.close()
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
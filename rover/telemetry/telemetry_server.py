@@ -6,46 +6,144 @@
 
 from telemetry import *
 
-import functools
 import os
+import queue
 import threading
+import time
 import traceback
 import uuid
 
 DEBUG = False
 
+RETRIEVE_SESSION_TIMEOUT = 60  # seconds without ack after which chunked retrieve is abandoned
+RETRIEVE_CHUNKS_PER_CALL = 8  # chunks sent from one handler call; rest is sent by retrieve thread
+RING_POLL_INTERVAL = 0.005  # seconds to wait when all shared memory rings were empty
+RING_SCAN_INTERVAL = 1  # seconds between looking for new shared memory rings
+
+
+def _frameHeader(d):
+    return struct.Struct('<x' + ('B' if d & 1 == STREAM_ID_BYTE else 'H') + {STREAM_SIZE_BYTE: 'B', STREAM_SIZE_WORD: 'H'}.get(d & 6, 'I'))
+
+
+# frame header formats indexed by lowest three bits of first (definition) byte
+_FRAME_HEADERS = [_frameHeader(d) for d in range(8)]
+_TIMESTAMP = struct.Struct('<d')
+
 
 class TelemetryServer:
-    def __init__(self):
-        self.streams = {}
-        self.stream_ids = {}
-        self.next_stream_id = 0
+    def __init__(self, registry=None):
+        self.registry = registry if registry is not None else TelemetryStreamRegistry()
+        self.streams = self.registry.streams
+        self.stream_ids = self.registry.stream_ids
 
     def registerStream(self, stream_definition):
         stream = streamFromJSON(stream_definition)
-        if stream.name in self.streams:
-
-            old_stream = self.streams[stream.name]
-            stream.stream_id = old_stream.stream_id
-            if stream.toJSON() != old_stream.toJSON():
-                print("ERROR: Someone tried to register different streams: " + stream.name)
-                print("old_stream=" + old_stream.toJSON())
-                print("new_stream=" + stream.toJSON())
-                return -1
-            else:
-                return old_stream.stream_id
-
-        else:
-            self.streams[stream.name] = stream
-            self.next_stream_id += 1
-            stream.stream_id = self.next_stream_id
-            self.stream_ids[stream.stream_id] = stream
-            return self.next_stream_id
+        return self.registry.register(stream)
+
+
+class TelemetryFrameParser:
+    # Splits bytes coming from telemetry fifo into (stream_id, record) frames. Data is read in big chunks
+    # into one reusable buffer and all complete frames in it are decoded in one go; incomplete frame at
+    # the end of the buffer is kept for the next read. Returned records are memoryviews into the buffer
+    # and are valid only until next readFrom.
+    def __init__(self, buffer_size=65536):
+        self.buffer = bytearray(buffer_size)
+        self.view = memoryview(self.buffer)
+        self.start = 0
+        self.end = 0
+
+    def reset(self):
+        self.start = 0
+        self.end = 0
+
+    def _makeRoom(self):
+        if self.start == self.end:
+            self.start = 0
+            self.end = 0
+        elif self.start > 0:
+            length = self.end - self.start
+            self.buffer[0:length] = self.view[self.start:self.end]
+            self.start = 0
+            self.end = length
+
+        if self.end == len(self.buffer):
+            self._grow(len(self.buffer) * 2)  # frame bigger than buffer
+
+    def _grow(self, size):
+        buffer = bytearray(size)
+        buffer[0:self.end] = self.view[0:self.end]
+        self.buffer = buffer
+        self.view = memoryview(buffer)
+
+    def feed(self, data):
+        self._makeRoom()
+        if self.end + len(data) > len(self.buffer):
+            self._grow(self.end + len(data))
+
+        self.view[self.end:self.end + len(data)] = data
+        self.end += len(data)
+
+    # Reads next chunk from raw (unbuffered) file. Returns number of bytes read, 0 for end of file.
+    def readFrom(self, f):
+        self._makeRoom()
+        read = f.readinto(self.view[self.end:])
+        if read is None:
+            return 0
+        self.end += read
+        return read
+
+    def frames(self):
+        buf = self.buffer
+        view = self.view
+        p = self.start
+        end = self.end
+        frames = []
+        append = frames.append
+        while p < end:
+            header = _FRAME_HEADERS[buf[p] & 7]
+            header_len = header.size
+            if p + header_len > end:
+                break
+
+            stream_id, record_size = header.unpack_from(buf, p)
+            record_end = p + header_len + record_size
+            if record_end > end:
+                break
+
+            append((stream_id, view[p + header_len:record_end]))
+            p = record_end
+
+        self.start = p
+        return frames
+
+
+class _RetrieveSession(RetrieveCursor):
+    # State of chunked retrieve - RetrieveCursor with sequence of sent and acknowledged chunks
+    def __init__(self, stream, response_topic, from_timestamp, to_timestamp, chunk_size, window, encoding):
+        super(_RetrieveSession, self).__init__(stream, from_timestamp, to_timestamp, chunk_size)
+        self.response_topic = response_topic
+        self.window = window
+        self.encoding = encoding
+        self.sequence = 0
+        self.acked = -1
+        self.last_activity = time.time()
+
+    def canSend(self):
+        return not self.finished and (self.window == 0 or self.sequence - 1 - self.acked < self.window)
+
+    # Returns chunk payload of records taken from storage (see take) - called outside of storage lock
+    # as encoding can take a while
+    def chunkPayload(self, data):
+        if self.encoding is not None:
+            data = self.encoding(self.stream, data)
+        header = RETRIEVE_CHUNK_HEADER.pack(self.sequence, RETRIEVE_CHUNK_LAST if self.finished else 0)
+        self.sequence += 1
+        return header + data
 
 
 class PubSubLocalPipeTelemetryServer(TelemetryServer):
-    def __init__(self, topic=None, pub_method=None, sub_method=None, telemetry_fifo="~/telemetry-fifo", stream_storage=MemoryTelemetryStorage()):
-        super(PubSubLocalPipeTelemetryServer, self).__init__()
+    def __init__(self, topic=None, pub_method=None, sub_method=None, telemetry_fifo="~/telemetry-fifo", stream_storage=MemoryTelemetryStorage(), registry=None, ring_directory=RING_DIRECTORY):
+        super(PubSubLocalPipeTelemetryServer, self).__init__(registry)
 
         print("  setting up published/subscriber, unix pipe server...")
         self.stream_storage = stream_storage
@@ -53,14 +151,21 @@ class PubSubLocalPipeTelemetryServer(TelemetryServer):
         self.pub_method = pub_method
         self.sub_method = sub_method
         self.uniqueId = str(uuid.uuid4())
+        self.retrieve_sessions = {}
+        self.retrieve_lock = threading.Lock()
+        self.retrieve_queue = queue.Queue()  # sessions with more chunks to send than one call sends
 
         print("  subscribing to server topics...")
         self.sub_method(topic + "/register", self._handleRegister)  # logger
         self.sub_method(topic + "/streams", self._handleGetStreams)  # client
         self.sub_method(topic + "/streamdef/#", self._handleGetStreamDefinition)  # client
+        self.sub_method(topic + "/streamdefs", self._handleGetStreamDefinitions)  # client
         self.sub_method(topic + "/oldest/#", self._handleGetOldestTimestamp)  # client
         self.sub_method(topic + "/trim/#", self._handleTrim)  # client
         self.sub_method(topic + "/retrieve/#", self._handleRetrieve)  # client
+        self.sub_method(topic + "/retrieve_ack/#", self._handleRetrieveAck)  # client
+        self.sub_method(topic + "/aggregate/#", self._handleAggregate)  # client
+        self.sub_method(topic + "/decimate/#", self._handleDecimate)  # client
 
         print("  subscribed to server topics.")
 
@@ -78,8 +183,20 @@ class PubSubLocalPipeTelemetryServer(TelemetryServer):
         print("  starting service thread...")
         self.thread = threading.Thread(target=self._service_pipe, daemon=True)
         self.thread.start()
+        self.retrieve_thread = threading.Thread(target=self._service_retrieves, daemon=True)
+        self.retrieve_thread.start()
         print("  service thread started.")
 
+        self.ring_directory = None
+        self.ring_dropped = {}  # dropped records by ring name
+        if ring_directory is not None:
+            self.ring_directory = os.path.expanduser(ring_directory)
+            if not os.path.exists(self.ring_directory):
+                os.makedirs(self.ring_directory)
+            self.ring_thread = threading.Thread(target=self._service_rings, daemon=True)
+            self.ring_thread.start()
+            print("  polling shared memory rings in " + self.ring_directory)
+
     #     print("  starting telemetry fifo thread...")
     #     self.thread = threading.Thread(target=self._initiate_fifo_file, daemon=True)
     #     self.thread.start()
@@ -92,84 +209,97 @@ class PubSubLocalPipeTelemetryServer(TelemetryServer):
     #     print("   opened and closed fifo.")
 
     def _service_pipe(self):
-        def read_pipe(size):
-            # buf = os.read(self.pipe_fd, size)
-            buf = self.pipe.read(size)
-            # if buf != b'' and len(buf) == size:
-            #     return buf
-            # elif buf != b'':
-            #     size -= len(buf)
-            #
-            # while size > 0:
-            #     b = os.read(self.pipe_fd, size)
-            #     if b != b'':
-            #         buf += b
-            #         size -= len(b)
-
-            if len(buf) == size:
-                return buf
-
-            if DEBUG:
-                print("Failed to load all in once: " + str(len(buf)) + " while needed " + str(size))
-            while len(buf) < size:
-                bb = self.pipe.read(size - len(buf))
-                buf = buf + bb
-
-            return buf
-
+        parser = TelemetryFrameParser()
         while True:
             try:
                 print("    opening " + str(self.telemetry_fifo) + " fifo file...")
-                self.pipe = open(self.telemetry_fifo, "rb")
+                self.pipe = open(self.telemetry_fifo, "rb", buffering=0)
                 print("    opened " + str(self.telemetry_fifo) + " fifo file...")
 
-                while True:
-                    d = read_pipe(1)[0]
-                    if DEBUG:
-                        print("Def char " + str(bin(d)))
-                    if d & 1 == 0:
-                        if DEBUG:
-                            print("Reading one byte stream id...")
-                        stream_id = struct.unpack('<B', read_pipe(1))[0]
-                    else:
-                        if DEBUG:
-                            print("Reading two bytes stream id...")
-                        stream_id = struct.unpack('<H', read_pipe(2))[0]
-
-                    if DEBUG:
-                        print("Stream id = " + str(stream_id))
-
-                    if d & 6 == 0:
-                        if DEBUG:
-                            print("Reading one byte record size...")
-                        record_size = struct.unpack('<B', read_pipe(1))[0]
-                    elif d & 6 == 1:
-                        if DEBUG:
-                            print("Reading two bytes record size...")
-                        record_size = struct.unpack('<H', read_pipe(2))[0]
-                    else:
-                        if DEBUG:
-                            print("Reading four bytes record size...")
-                        record_size = struct.unpack('<I', read_pipe(4))[0]
-
-                    if DEBUG:
-                        print("Record size = " + str(record_size) + ", reading record...")
-
-                    record = read_pipe(record_size)
-                    if DEBUG:
-                        print("Got record of size = " + str(len(record)) + ", storing record...")
-
-                    if stream_id in self.stream_ids:
-                        stream = self.stream_ids[stream_id]
-                        self.stream_storage.store(stream, stream.extractTimestamp(record), record)
-                        if DEBUG:
-                            print("Stored record for stream id " + str(stream_id))
-                    else:
-                        print("Got unknown stream id! stream_id=" + str(stream_id) + ",  record_id=" + str(record_size) + ", def=" + str(bin(d)))
+                parser.reset()
+                while parser.readFrom(self.pipe) > 0:
+                    self._storeFrames(parser.frames())
+
+                # all writers closed the fifo; anything left in the buffer is an incomplete frame
+                self.pipe.close()
 
             except Exception as ex:
                 print("Exception while handing pipe stream; " + str(ex) + "\n" + ''.join(traceback.format_tb(ex.__traceback__)))
 
+    def _service_rings(self):
+        parser = TelemetryFrameParser()
+        readers = {}
+        broken = set()
+        last_scan = 0
+        while True:
+            try:
+                now = time.time()
+                if now - last_scan >= RING_SCAN_INTERVAL:
+                    last_scan = now
+                    for name in os.listdir(self.ring_directory):
+                        if name.endswith(RING_SUFFIX) and name not in readers and name not in broken:
+                            try:
+                                readers[name] = TelemetryRingReader(os.path.join(self.ring_directory, name))
+                                self.ring_dropped[name] = 0
+                            except ValueError as ex:
+                                print("ERROR: Ignoring telemetry ring " + name + "; " + str(ex))
+                                broken.add(name)
+
+                idle = True
+                for name, reader in list(readers.items()):
+                    data = reader.read()
+                    if len(data) == 0 and reader.writerGone():
+                        data = reader.read()  # written just before writer went away
+                        reader.close()
+                        del readers[name]
+                        del self.ring_dropped[name]
+
+                    if len(data) > 0:
+                        idle = False
+                        parser.reset()
+                        parser.feed(data)
+                        self._storeFrames(parser.frames())
+
+                    if name in readers:
+                        dropped = reader.dropped()
+                        if dropped != self.ring_dropped[name]:
+                            print("ERROR: Telemetry ring " + name + " was full, dropped " + str(dropped - self.ring_dropped[name]) + " records (" + str(dropped) + " in total)")
+                            self.ring_dropped[name] = dropped
+
+                if idle:
+                    time.sleep(RING_POLL_INTERVAL)
+
+            except Exception as ex:
+                print("Exception while handing shared memory rings; " + str(ex) + "\n" + ''.join(traceback.format_tb(ex.__traceback__)))
+                time.sleep(RING_SCAN_INTERVAL)
+
+    def _service_retrieves(self):
+        while True:
+            session = self.retrieve_queue.get()
+            try:
+                self._sendChunks(session)
+            except Exception as ex:
+                print("Exception while sending chunks; " + str(ex) + "\n" + ''.join(traceback.format_tb(ex.__traceback__)))
+
+    def _storeFrames(self, frames):
+        batches = {}
+        for stream_id, record in frames:
+            batch = batches.get(stream_id)
+            if batch is None:
+                batch = []
+                batches[stream_id] = batch
+            batch.append(record)
+
+        for stream_id, records in batches.items():
+            if stream_id in self.stream_ids:
+                stream = self.stream_ids[stream_id]
+                unpack_timestamp = _TIMESTAMP.unpack_from
+                self.stream_storage.store_many(stream, [(unpack_timestamp(record)[0], record) for record in records])
+                if DEBUG:
+                    print("Stored " + str(len(records)) + " records for stream id " + str(stream_id))
+            else:
+                print("Got unknown stream id! stream_id=" + str(stream_id) + ", records=" + str(len(records)))
+
     def _handleRegister(self, topic, payload):
         payload = str(payload, 'UTF-8')
         i = payload.index(',')
@@ -186,6 +316,11 @@ class PubSubLocalPipeTelemetryServer(TelemetryServer):
             streams = "\n".join(self.streams)
             self.pub_method(topic, streams)
 
+    # Payload is response topic; response is TelemetryStreamRegistry.definitions
+    def _handleGetStreamDefinitions(self, topic, payload):
+        payload = str(payload, 'UTF-8')
+        self.pub_method(payload, self.registry.definitions())
+
     def _handleGetStreamDefinition(self, topic, payload):
         payload = str(payload, 'UTF-8')
         response_topic = payload
@@ -221,26 +356,155 @@ class PubSubLocalPipeTelemetryServer(TelemetryServer):
             if DEBUG:
                 print("Asked for trim but stream does not exist " + stream_name)
 
+    # Payload is 'response_topic,from,to' for all records in one message or
+    # 'response_topic,from,to,chunk_size,window[,encoding]' for records sent in chunks of about chunk_size bytes,
+    # with at most window chunks not acknowledged (0 for no limit). Encoding is one of
+    # telemetry_compression.ENCODINGS; records of each chunk are sent as one compressed block unless it is 'raw'.
+    # When records cannot be sent as asked, chunk with RETRIEVE_CHUNK_ERROR flag is sent instead.
     def _handleRetrieve(self, topic, payload):
         payload = str(payload, 'UTF-8')
         stream_name = topic[topic.rindex('/') + 1:]
-        response_topic, from_timestamp, to_timestamp = payload.split(",")
+        split = payload.split(",")
+        response_topic, from_timestamp, to_timestamp = split[0:3]
         if stream_name in self.streams:
             stream = self.streams[stream_name]
             if DEBUG:
                 print("Asked to retrieve from stream " + stream_name + ", from " + str(float(from_timestamp)) + " to " + str(float(to_timestamp)))
-            self.stream_storage.retrieve(stream, float(from_timestamp), float(to_timestamp), lambda records: self._sendRecords(response_topic, records))
+            if len(split) >= 5:
+                encoding = None
+                if len(split) >= 6 and split[5] != 'raw':
+                    try:
+                        from telemetry import telemetry_compression
+                    except ImportError as ex:
+                        print("ERROR: Cannot send records of stream " + stream_name + " as " + split[5] + "; " + str(ex))
+                        self.pub_method(response_topic, self._errorChunk(0, "Cannot send records of stream " + stream_name + " as " + split[5] + "; " + str(ex)))
+                        return
+
+                    if split[5] not in telemetry_compression.ENCODINGS:
+                        print("ERROR: Cannot send records of stream " + stream_name + " as " + split[5])
+                        self.pub_method(response_topic, self._errorChunk(0, "Unknown encoding " + split[5]))
+                        return
+                    encoding = lambda s, data: telemetry_compression.encode(s, data, split[5])
+
+                session = _RetrieveSession(stream, response_topic, float(from_timestamp), float(to_timestamp), max(1, int(split[3])), max(0, int(split[4])), encoding)
+                with self.retrieve_lock:
+                    self._expireRetrieveSessions()
+                    self.retrieve_sessions[response_topic] = session
+                self._sendChunks(session)
+            else:
+                self.stream_storage.retrieve(stream, float(from_timestamp), float(to_timestamp), lambda records: self._sendRecords(response_topic, records))
         else:
             if DEBUG:
                 print("Asked to retrieve from unknown stream " + stream_name)
 
+    # Payload is 'response_topic,sequence' of last processed chunk; sequence -1 cancels retrieve
+    def _handleRetrieveAck(self, topic, payload):
+        payload = str(payload, 'UTF-8')
+        response_topic, sequence = payload.split(",")
+        with self.retrieve_lock:
+            session = self.retrieve_sessions.get(response_topic)
+            if session is None:
+                return
+            sequence = int(sequence)
+            if sequence < 0:
+                del self.retrieve_sessions[response_topic]
+                return
+            session.acked = max(session.acked, sequence)
+            session.last_activity = time.time()
+
+        self._sendChunks(session)
+
+    def _expireRetrieveSessions(self):
+        now = time.time()
+        for response_topic in [t for t, s in self.retrieve_sessions.items() if s.last_activity + RETRIEVE_SESSION_TIMEOUT < now]:
+            del self.retrieve_sessions[response_topic]
+
+    # Sends at most RETRIEVE_CHUNKS_PER_CALL chunks the session can send and leaves the rest to retrieve thread,
+    # so handlers (and window of 0) do not hold up others. Records are only copied out while storage is locked
+    # (see retrieve) - chunks are encoded and published after, under retrieve_lock which keeps them in order.
+    def _sendChunks(self, session):
+        def takeRecords(views):
+            data[0] = session.take(views)
+
+        data = [None]
+        sent = 0
+        with self.retrieve_lock:
+            while sent < RETRIEVE_CHUNKS_PER_CALL and session.canSend() and self.retrieve_sessions.get(session.response_topic) is session:
+                try:
+                    self.stream_storage.retrieve(session.stream, session.cursor, session.to_timestamp, takeRecords)
+                    payload = session.chunkPayload(data[0])
+                except Exception as ex:
+                    print("ERROR: Cannot send records of stream " + session.stream.name + "; " + str(ex) + "\n" + ''.join(traceback.format_tb(ex.__traceback__)))
+                    session.finished = True
+                    payload = self._errorChunk(session.sequence, "Cannot send records of stream " + session.stream.name + "; " + str(ex))
+                if DEBUG:
+                    print("Sending chunk " + str(session.sequence - 1) + " of " + str(len(payload)) + " bytes out...")
+                self.pub_method(session.response_topic, payload)
+                sent += 1
+
+            if session.finished and self.retrieve_sessions.get(session.response_topic) is session:
+                del self.retrieve_sessions[session.response_topic]
+            elif sent == RETRIEVE_CHUNKS_PER_CALL and session.canSend():
+                self.retrieve_queue.put(session)
+
+    # Payload is 'response_topic,from,to,bucket,function' - see telemetry_aggregate.aggregate
+    def _handleAggregate(self, topic, payload):
+        payload = str(payload, 'UTF-8')
+        stream_name = topic[topic.rindex('/') + 1:]
+        response_topic, from_timestamp, to_timestamp, bucket, function = payload.split(",")
+        if stream_name in self.streams:
+            from telemetry.telemetry_aggregate import aggregate
+
+            from_timestamp = float(from_timestamp)
+            self._sendReduced(self.streams[stream_name], response_topic, from_timestamp, float(to_timestamp),
+                              lambda stream, views: aggregate(stream, views, from_timestamp, float(bucket), function))
+        else:
+            if DEBUG:
+                print("Asked to aggregate unknown stream " + stream_name)
+
+    # Payload is 'response_topic,from,to,points,field' - see telemetry_aggregate.decimate
+    def _handleDecimate(self, topic, payload):
+        payload = str(payload, 'UTF-8')
+        stream_name = topic[topic.rindex('/') + 1:]
+        response_topic, from_timestamp, to_timestamp, points, field = payload.split(",")
+        if stream_name in self.streams:
+            from telemetry.telemetry_aggregate import decimate
+
+            self._sendReduced(self.streams[stream_name], response_topic, float(from_timestamp), float(to_timestamp),
+                              lambda stream, views: decimate(stream, views, int(points), field))
+        else:
+            if DEBUG:
+                print("Asked to decimate unknown stream " + stream_name)
+
+    # Reduced records are sent as one chunk (see RETRIEVE_CHUNK_HEADER); if they cannot be reduced
+    # chunk has RETRIEVE_CHUNK_ERROR flag and error message instead
+    def _sendReduced(self, stream, response_topic, from_timestamp, to_timestamp, reduce):
+        result = [RETRIEVE_CHUNK_HEADER.pack(0, RETRIEVE_CHUNK_LAST)]
+
+        def reduceRecords(views):
+            try:
+                result[0] = RETRIEVE_CHUNK_HEADER.pack(0, RETRIEVE_CHUNK_LAST) + reduce(stream, views)
+            except Exception as ex:
+                print("ERROR: Cannot reduce records of stream " + stream.name + "; " + str(ex) + "\n" + ''.join(traceback.format_tb(ex.__traceback__)))
+                result[0] = self._errorChunk(0, "Cannot reduce records of stream " + stream.name + "; " + str(ex))
+
+        self.stream_storage.retrieve(stream, from_timestamp, to_timestamp, reduceRecords)
+        if DEBUG:
+            print("Sending " + str(len(result[0])) + " bytes of reduced records out...")
+        self.pub_method(response_topic, result[0])
+
+    @staticmethod
+    def _errorChunk(sequence, message):
+        return RETRIEVE_CHUNK_HEADER.pack(sequence, RETRIEVE_CHUNK_LAST | RETRIEVE_CHUNK_ERROR) + bytes(message, 'utf-8')
+
     def _sendRecords(self, topic, records):
         if len(records) > 0:
+            payload = b''.join(records)
             if DEBUG:
-                print("Sending " + str(len(records)) + " records out...")
-            self.pub_method(topic, functools.reduce(lambda x, y: x + y, [r[1] for r in records]))
+                print("Sending " + str(len(payload)) + " bytes of records out...")
+            self.pub_method(topic, payload)
             if DEBUG:
-                print("Sent " + str(len(records)) + " records out.")
+                print("Sent " + str(len(payload)) + " bytes of records out.")
         else:
             if DEBUG:
                 print("Sending empty message")
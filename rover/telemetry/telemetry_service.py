@@ -6,11 +6,16 @@
 # MIT License
 #
 
+import threading
+import time
 import traceback
 import pyroslib
 
 from telemetry_stream import *
 from telemetry_storage import *
+from telemetry_file_storage import *
+from telemetry_registry import *
+from telemetry_ring import *
 from telemetry_pyros_logger import *
 from telemetry_logger import *
 from telemetry_server import *
@@ -23,10 +28,20 @@ from telemetry_server import *
 
 DEBUG = False
 
+PERSISTENT_STORAGE = True
+STORAGE_DIRECTORY = "~/telemetry-data"
+STORAGE_COMPRESSION = None  # 'columnar' or 'columnar-zlib' to compress closed segments (needs numpy)
+REGISTRY_FILE = "~/telemetry-data/streams.def"  # stream definitions and ids kept across restarts
+EXPORT_DIRECTORY = None  # "~/telemetry-export" to export all streams to columnar files during the run (needs numpy)
+EXPORT_FORMAT = None  # 'parquet' (needs pyarrow) or 'npz'; None picks parquet when pyarrow is installed
+EXPORT_INTERVAL = 60  # seconds
+
 
 class MQTTLocalPipeTelemetryServer(PubSubLocalPipeTelemetryServer):
-    def __init__(self, topic='telemetry'):
-        super(MQTTLocalPipeTelemetryServer, self).__init__(topic, pyroslib.publish, pyroslib.subscribeBinary)
+    def __init__(self, topic='telemetry', stream_storage=None, registry=None):
+        if stream_storage is None:
+            stream_storage = MemoryTelemetryStorage()
+        super(MQTTLocalPipeTelemetryServer, self).__init__(topic, pyroslib.publish, pyroslib.subscribeBinary, stream_storage=stream_storage, registry=registry)
 
     def waitAndProcess(self, waitTime=0.02):  # 50 times a second by default
         self.mqtt.loop(waitTime)
@@ -35,6 +50,23 @@ class MQTTLocalPipeTelemetryServer(PubSubLocalPipeTelemetryServer):
         self.mqtt.forever(waitTime, outer)
 
 
+def exportPeriodically(storage, registry):
+    from telemetry import telemetry_export
+
+    exporters = {}
+    while True:
+        time.sleep(EXPORT_INTERVAL)
+        for stream in list(registry.stream_ids.values()):
+            try:
+                exporter = exporters.get(stream.stream_id)
+                if exporter is None:
+                    exporter = telemetry_export.TelemetryExporter(storage, stream, EXPORT_DIRECTORY, EXPORT_FORMAT)
+                    exporters[stream.stream_id] = exporter
+                exporter.export()
+            except Exception as ex:
+                print("ERROR: Cannot export stream " + stream.storageName() + "; " + str(ex) + "\n" + ''.join(traceback.format_tb(ex.__traceback__)))
+
+
 def handleEcho(topic, payload, groups):
     print("Got echo in " + payload)
     if len(groups) > 0:
@@ -55,8 +87,26 @@ if __name__ == "__main__":
         else:
             telemetryTopic = "telemetry"
 
+        storage = None
+        registry = None
+        if PERSISTENT_STORAGE:
+            try:
+                storage = FileTelemetryStorage(STORAGE_DIRECTORY, compression=STORAGE_COMPRESSION)
+                print("  storing telemetry in " + storage.directory)
+            except Exception as ex:
+                print("ERROR: Cannot use " + STORAGE_DIRECTORY + " for telemetry, keeping it in memory; " + str(ex))
+            try:
+                registry = TelemetryStreamRegistry(REGISTRY_FILE)
+                print("  loaded " + str(len(registry.streams)) + " stream definitions from " + registry.path)
+            except Exception as ex:
+                print("ERROR: Cannot use " + REGISTRY_FILE + " for stream definitions, ids will change on restart; " + str(ex))
+
         print("  starting telemetry server...")
-        server = MQTTLocalPipeTelemetryServer(telemetryTopic)
+        server = MQTTLocalPipeTelemetryServer(telemetryTopic, stream_storage=storage, registry=registry)
+
+        if EXPORT_DIRECTORY is not None and storage is not None and registry is not None:
+            threading.Thread(target=exportPeriodically, args=(storage, registry), daemon=True).start()
+            print("  exporting streams to " + EXPORT_DIRECTORY + " every " + str(EXPORT_INTERVAL) + "s")
 
         print("Started telemetry service on topic " + telemetryTopic)
 
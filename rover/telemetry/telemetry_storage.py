@@ -4,18 +4,15 @@
 # MIT License
 #
 
+import array
+import bisect
 import os
 import struct
+import threading
 import time
 import uuid
 
-
-def _findTimeIndex(values, the_time, starting_from=0):
-    for i in range(starting_from, len(values)):
-        if values[i][0] >= the_time:
-            return i
-
-    return len(values)
+from telemetry.telemetry_stream import RECORD_LENGTH_PREFIX
 
 
 class TelemetryStorage:
@@ -25,9 +22,16 @@ class TelemetryStorage:
     def store(self, stream, time_stamp, record):
         raise NotImplemented("TelemetryStorage.store")
 
+    # records is list of (time_stamp, record) tuples
+    def store_many(self, stream, records):
+        for time_stamp, record in records:
+            self.store(stream, time_stamp, record)
+
     def trim(self, stream, to_timestamp):
         raise NotImplemented("TelemetryStorage.trim")
 
+    # callback is invoked with sequence of bytes like objects (memoryviews) which contain records back to back;
+    # records of variable length streams each have RECORD_LENGTH_PREFIX in front
     def retrieve(self, stream, from_timestamp, to_timestmap, callback):
         raise NotImplemented("TelemetryStorage.retrieve")
 
@@ -35,48 +39,289 @@ class TelemetryStorage:
         callback(time.time())
 
 
+_TIMESTAMP = struct.Struct('<d')
+_VARLEN_RECORD_START = struct.Struct('<Id')  # record length prefix followed by timestamp
+
+
+class RetrieveCursor:
+    # Walks time range of a stream in chunks of at most chunk_size bytes (or one record if it is bigger).
+    # Each chunk is fetched from storage again starting at cursor - timestamp of last record taken; skip
+    # is number of records with that timestamp which were already taken.
+    def __init__(self, stream, from_timestamp, to_timestamp, chunk_size):
+        self.stream = stream
+        self.to_timestamp = to_timestamp
+        self.chunk_size = chunk_size
+        self.cursor = from_timestamp
+        self.skip = 0
+        self.finished = False
+
+    # Takes next chunk from views returned by storage.retrieve(stream, cursor, to_timestamp, ...).
+    # Returns records of the chunk back to back.
+    def take(self, views):
+        stream = self.stream
+        chunk_size = self.chunk_size
+        skip = self.skip
+        last_timestamp = self.cursor
+        same = self.skip
+        parts = []
+        size = 0
+        more = False
+        for view in views:
+            p = 0
+            end = len(view)
+            while p < end:
+                if stream.fixed_length is not None:
+                    time_stamp = _TIMESTAMP.unpack_from(view, p)[0]
+                    length = stream.fixed_length
+                else:
+                    length, time_stamp = _VARLEN_RECORD_START.unpack_from(view, p)
+                    length += RECORD_LENGTH_PREFIX.size
+
+                if skip > 0:
+                    skip -= 1
+                elif size > 0 and size + length > chunk_size:
+                    more = True
+                    break
+                else:
+                    parts.append(view[p:p + length])
+                    size += length
+                    if time_stamp == last_timestamp:
+                        same += 1
+                    else:
+                        last_timestamp = time_stamp
+                        same = 1
+                p += length
+
+            if more:
+                break
+
+        self.cursor = last_timestamp
+        self.skip = same
+        self.finished = not more
+        return b''.join(parts)
+
+    # Retrieves next chunk from storage. Returns records of the chunk back to back.
+    def next(self, storage):
+        result = []
+        storage.retrieve(self.stream, self.cursor, self.to_timestamp, lambda views: result.append(self.take(views)))
+        return result[0]
+
+
+class _RecordRing:
+    # Fixed size ring of fixed length records: one contiguous buffer for records and parallel array of
+    # timestamps. Timestamps are kept non decreasing so time ranges can be found with bisect.
+    def __init__(self, capacity, record_length):
+        self.capacity = capacity
+        self.record_length = record_length
+        self.buffer = bytearray(capacity * record_length)
+        self.view = memoryview(self.buffer)
+        self.timestamps = array.array('d', bytes(capacity * 8))
+        self.start = 0
+        self.count = 0
+        self.last_timestamp = 0.0
+
+    def append(self, time_stamp, record):
+        if self.count == self.capacity:
+            pos = self.start
+            self.start += 1
+            if self.start == self.capacity:
+                self.start = 0
+        else:
+            pos = self.start + self.count
+            if pos >= self.capacity:
+                pos -= self.capacity
+            self.count += 1
+
+        if time_stamp < self.last_timestamp:
+            time_stamp = self.last_timestamp  # out of order record - keep index sorted
+        self.last_timestamp = time_stamp
+
+        offset = pos * self.record_length
+        self.view[offset:offset + self.record_length] = record
+        self.timestamps[pos] = time_stamp
+
+    def extend(self, records):
+        capacity = self.capacity
+        record_length = self.record_length
+        view = self.view
+        timestamps = self.timestamps
+        last_timestamp = self.last_timestamp
+        pos = self.start + self.count
+        if pos >= capacity:
+            pos -= capacity
+
+        for time_stamp, record in records:
+            if time_stamp < last_timestamp:
+                time_stamp = last_timestamp
+            last_timestamp = time_stamp
+
+            offset = pos * record_length
+            view[offset:offset + record_length] = record
+            timestamps[pos] = time_stamp
+            pos += 1
+            if pos == capacity:
+                pos = 0
+
+        added = len(records)
+        if self.count + added > capacity:
+            self.count = capacity
+            self.start = pos
+        else:
+            self.count += added
+        self.last_timestamp = last_timestamp
+
+    # Returns logical index (0 is oldest) of first record with timestamp >= the_time
+    def find(self, the_time):
+        end = self.start + self.count
+        if end <= self.capacity:
+            return bisect.bisect_left(self.timestamps, the_time, self.start, end) - self.start
+
+        if the_time <= self.timestamps[self.capacity - 1]:
+            return bisect.bisect_left(self.timestamps, the_time, self.start, self.capacity) - self.start
+
+        return self.capacity - self.start + bisect.bisect_left(self.timestamps, the_time, 0, end - self.capacity)
+
+    def drop(self, number):
+        self.start = (self.start + number) % self.capacity
+        self.count -= number
+
+    # Returns list of (at most two) memoryviews of records between logical indexes
+    def views(self, from_index, to_index):
+        if from_index >= to_index:
+            return []
+
+        record_length = self.record_length
+        start = self.start + from_index
+        if start >= self.capacity:
+            start -= self.capacity
+        end = start + to_index - from_index
+        if end <= self.capacity:
+            return [self.view[start * record_length:end * record_length]]
+
+        return [self.view[start * record_length:], self.view[:(end - self.capacity) * record_length]]
+
+
+class _VarRecordRing(_RecordRing):
+    # Ring of variable length records. Records are kept as separate length prefixed bytes objects (see
+    # RECORD_LENGTH_PREFIX) so retrieved records can be sent back to back as they are.
+    def __init__(self, capacity):
+        super(_VarRecordRing, self).__init__(capacity, 0)
+        self.records = [None] * capacity
+
+    def append(self, time_stamp, record):
+        self.extend([(time_stamp, record)])
+
+    def extend(self, records):
+        capacity = self.capacity
+        stored = self.records
+        timestamps = self.timestamps
+        last_timestamp = self.last_timestamp
+        pos = self.start + self.count
+        if pos >= capacity:
+            pos -= capacity
+
+        for time_stamp, record in records:
+            if time_stamp < last_timestamp:
+                time_stamp = last_timestamp
+            last_timestamp = time_stamp
+
+            stored[pos] = RECORD_LENGTH_PREFIX.pack(len(record)) + record
+            timestamps[pos] = time_stamp
+            pos += 1
+            if pos == capacity:
+                pos = 0
+
+        added = len(records)
+        if self.count + added > capacity:
+            self.count = capacity
+            self.start = pos
+        else:
+            self.count += added
+        self.last_timestamp = last_timestamp
+
+    def drop(self, number):
+        for i in range(number):
+            self.records[(self.start + i) % self.capacity] = None
+        super(_VarRecordRing, self).drop(number)
+
+    def views(self, from_index, to_index):
+        if from_index >= to_index:
+            return []
+
+        start = self.start + from_index
+        if start >= self.capacity:
+            start -= self.capacity
+        end = start + to_index - from_index
+        if end <= self.capacity:
+            return self.records[start:end]
+
+        return self.records[start:] + self.records[:end - self.capacity]
+
+
 class MemoryTelemetryStorage(TelemetryStorage):
     def __init__(self, max_records=100000):
         super(MemoryTelemetryStorage, self).__init__()
         self.streams = {}
         self.max_records = max_records
+        self.lock = threading.Lock()
 
-    def _values(self, stream):
-        if stream.name not in self.streams:
-            self.streams[stream.name] = []
+    def _ring(self, stream):
+        ring = self.streams.get(stream.storageName())
+        if ring is None:
+            if stream.fixed_length is None:
+                ring = _VarRecordRing(self.max_records)
+            else:
+                ring = _RecordRing(self.max_records, stream.fixed_length)
+            self.streams[stream.storageName()] = ring
 
-        return self.streams[stream.name]
+        return ring
 
     def store(self, stream, time_stamp, record):
-        stream_array = self._values(stream)
-        stream_array.append([time_stamp, record])
-        if len(stream_array) > self.max_records:
-            del stream_array[0:self.max_records//10]
+        with self.lock:
+            ring = self._ring(stream)
+            if ring.record_length != 0 and len(record) != ring.record_length:
+                print("ERROR: Record of size " + str(len(record)) + " does not fit stream " + stream.name + " record size " + str(ring.record_length))
+                return
 
-    def trim(self, stream, to_timestamp):
-        values = self._values(stream)
-        if len(values) > 0:
-            i = _findTimeIndex(values, to_timestamp)
-            values = values[i:]
-            self.streams[stream.name] = values
+            ring.append(time_stamp, record)
 
-    def retrieve(self, stream, from_timestamp, to_timestmap, callback):
-        values = self._values(stream)
-        if len(values) > 0:
-            start = _findTimeIndex(values, from_timestamp)
-            if start < len(values):
-                end = _findTimeIndex(values, to_timestmap, starting_from=start)
+    def store_many(self, stream, records):
+        with self.lock:
+            ring = self._ring(stream)
+            record_length = ring.record_length
+            for time_stamp, record in records:
+                if record_length != 0 and len(record) != record_length:
+                    print("ERROR: Record of size " + str(len(record)) + " does not fit stream " + stream.name + " record size " + str(record_length))
+                    records = [r for r in records if len(r[1]) == record_length]
+                    break
 
-                callback(values[start:end])
-                return
+            ring.extend(records)
 
-        callback([])
+    def trim(self, stream, to_timestamp):
+        with self.lock:
+            ring = self._ring(stream)
+            if ring.count > 0:
+                ring.drop(ring.find(to_timestamp))
+
+    def retrieve(self, stream, from_timestamp, to_timestmap, callback):
+        # callback is invoked while holding the lock so returned views are not overwritten by incoming records
+        with self.lock:
+            ring = self._ring(stream)
+            if ring.count > 0:
+                start = ring.find(from_timestamp)
+                if start < ring.count:
+                    end = ring.find(to_timestmap)
+                    callback(ring.views(start, end))
+                    return
+
+            callback([])
 
     def getOldestTimestamp(self, stream, callback):
-        if stream.name in self.streams:
-            values = self.streams[stream.name]
-            if len(values) > 0:
-                return callback(values[0][0], len(values))
+        with self.lock:
+            if stream.storageName() in self.streams:
+                ring = self.streams[stream.storageName()]
+                if ring.count > 0:
+                    return callback(ring.timestamps[ring.start], ring.count)
 
         return callback(0, 0)
 
@@ -85,19 +330,13 @@ class StreamCallback:
     def __init__(self, stream):
         self.stream = stream
         self.callback = None
+        self.as_array = False
 
     def handleRetrieve(self, topic, payload):
-        record_length = self.stream.fixed_length
-
-        received_records = len(payload) // record_length
-        if received_records * record_length != len(payload):
-            pass  # what to do here?
-
-        records = []
-        for i in range(0, received_records):
-            record = struct.unpack(self.stream.pack_string, payload[i * record_length: (i + 1) * record_length])
-            records.append(record)
-        self.callback(records)
+        if self.as_array:
+            self.callback(self.stream.recordsArray(payload))
+        else:
+            self.callback(self.stream.unpackRecords(payload))
 
     def handleOldest(self, topic, payload):
         self.callback(struct.unpack('<d', payload))
@@ -127,7 +366,7 @@ class ClientPubSubTelemetryStorage(TelemetryStorage):
     def trim(self, stream, to_timestamp):
         self.put_method(self.pub_topic + "/trim/" + stream.name, struct.pack("<d", to_timestamp))
 
-    def _addStreamCallback(self, stream, callback):
+    def _addStreamCallback(self, stream, callback, as_array=False):
         if stream.name not in self.stream_callbacks:
             streamCallback = StreamCallback(stream)
             self.stream_callbacks[stream.name] = streamCallback
@@ -136,12 +375,15 @@ class ClientPubSubTelemetryStorage(TelemetryStorage):
             self.sub_method(self.topic + "/oldest/" + self.uniqueId + stream.name, streamCallback.handleOldest)
 
         self.stream_callbacks[stream.name].callback = callback
+        self.stream_callbacks[stream.name].as_array = as_array
 
-    def retrieve(self, stream, from_timestamp, to_timestmap, callback):
+    # When as_array is True callback gets numpy structured array (see TelemetryStreamDefinition.numpyDtype)
+    # instead of list of tuples.
+    def retrieve(self, stream, from_timestamp, to_timestmap, callback, as_array=False):
         if self.put_method is None:
             raise NotImplemented("Publish method not defined")
 
-        self._addStreamCallback(stream, callback)
+        self._addStreamCallback(stream, callback, as_array)
         self.put_method(self.topic + "/retrieve/request", struct.pack("<dd36s", from_timestamp, to_timestmap, self.uniqueId))
 
     def getOldestTimestamp(self, stream, callback):
@@ -168,16 +410,22 @@ class LocalPipePubSubTelemetryStorage(ClientPubSubTelemetryStorage):
         self.pipe = os.fdopen(self.pipe_fd, 'wb', buffering=0)
 
     def store(self, stream, time_stamp, record):
-        self.pipe.write(stream.header)
-        self.pipe.write(record)
+        self.pipe.write(stream.frameHeader(record) + record)
+
+    def store_many(self, stream, records):
+        parts = []
+        for _, record in records:
+            parts.append(stream.frameHeader(record))
+            parts.append(record)
+        self.pipe.write(b''.join(parts))
 
     def trim(self, stream, to_timestamp):
         # use ClientPubSubTelemetryStorage for rest of the communication
         super(LocalPipePubSubTelemetryStorage, self).trim(stream, to_timestamp)
 
-    def retrieve(self, stream, from_timestamp, to_timestmap, callback):
+    def retrieve(self, stream, from_timestamp, to_timestmap, callback, as_array=False):
         # use ClientPubSubTelemetryStorage for rest of the communication
-        super(LocalPipePubSubTelemetryStorage, self).retrieve(stream, from_timestamp, to_timestmap, callback)
+        super(LocalPipePubSubTelemetryStorage, self).retrieve(stream, from_timestamp, to_timestmap, callback, as_array)
 
     def getOldestTimestamp(self, stream, callback):
         # use ClientPubSubTelemetryStorage for rest of the communication
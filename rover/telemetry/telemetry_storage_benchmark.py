@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+
+#
+# Copyright 2019 Games Creators Club
+#
+# MIT License
+#
+
+#
+# Insert rate and range query cost of MemoryTelemetryStorage against previous list based implementation.
+#
+# Usage (from rover directory):
+#     python3 -m telemetry.telemetry_storage_benchmark
+#
+
+import random
+import struct
+import time
+
+from telemetry.telemetry_stream import TelemetryStreamDefinition
+from telemetry.telemetry_storage import MemoryTelemetryStorage
+
+SIZES = [10000, 100000, 1000000]
+QUERY_TIME = 1.0  # seconds spent on range queries for each storage
+QUERY_SPAN = 0.01  # each query covers 1% of stored records
+
+
+def _findTimeIndex(values, the_time, starting_from=0):
+    for i in range(starting_from, len(values)):
+        if values[i][0] >= the_time:
+            return i
+
+    return len(values)
+
+
+class ListTelemetryStorage:
+    # previous implementation of MemoryTelemetryStorage
+    def __init__(self, max_records=100000):
+        self.streams = {}
+        self.max_records = max_records
+
+    def _values(self, stream):
+        if stream.name not in self.streams:
+            self.streams[stream.name] = []
+
+        return self.streams[stream.name]
+
+    def store(self, stream, time_stamp, record):
+        stream_array = self._values(stream)
+        stream_array.append([time_stamp, record])
+        if len(stream_array) > self.max_records:
+            del stream_array[0:self.max_records//10]
+
+    def retrieve(self, stream, from_timestamp, to_timestmap, callback):
+        values = self._values(stream)
+        if len(values) > 0:
+            start = _findTimeIndex(values, from_timestamp)
+            if start < len(values):
+                end = _findTimeIndex(values, to_timestmap, starting_from=start)
+
+                callback(values[start:end])
+                return
+
+        callback([])
+
+
+def makeStream():
+    stream = TelemetryStreamDefinition("benchmark")
+    stream.addWord("odo_fl").addWord("odo_fr").addWord("odo_bl").addWord("odo_br").addFloat("heading").addByte("status")
+    stream.build(1)
+    return stream
+
+
+def benchmark(storage, stream, size):
+    records = [struct.pack(stream.pack_string, float(i), i & 0xFFFF, i & 0xFFFF, i & 0xFFFF, i & 0xFFFF, 0.5, 0) for i in range(size)]
+
+    # inserting twice as many records as storage holds so trimming of old records is included
+    started = time.perf_counter()
+    for i in range(size * 2):
+        storage.store(stream, float(i), records[i % size])
+    insert_rate = size * 2 / (time.perf_counter() - started)
+
+    received = [0]
+
+    def callback(result):
+        received[0] += len(result)
+
+    span = size * QUERY_SPAN
+    queries = 0
+    started = time.perf_counter()
+    while time.perf_counter() - started < QUERY_TIME:
+        from_timestamp = size + random.random() * (size - span)
+        storage.retrieve(stream, from_timestamp, from_timestamp + span, callback)
+        queries += 1
+    query_time = (time.perf_counter() - started) / queries
+
+    return insert_rate, query_time
+
+
+if __name__ == "__main__":
+    stream = makeStream()
+    print("record size " + str(stream.fixed_length) + " bytes, query span " + str(int(QUERY_SPAN * 100)) + "% of records")
+    print("{0:<10} {1:<8} {2:>15} {3:>15}".format("records", "storage", "inserts/s", "query ms"))
+    for size in SIZES:
+        for name, storage in [("list", ListTelemetryStorage(max_records=size)), ("ring", MemoryTelemetryStorage(max_records=size))]:
+            insert_rate, query_time = benchmark(storage, stream, size)
+            print("{0:<10} {1:<8} {2:>15.0f} {3:>15.3f}".format(size, name, insert_rate, query_time * 1000))
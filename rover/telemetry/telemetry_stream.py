@@ -4,6 +4,7 @@
 # MIT License
 #
 
+import hashlib
 import struct
 
 STREAM_ID_BYTE = 0
@@ -20,6 +21,20 @@ TYPE_FLOAT = 'f'
 TYPE_DOUBLE = 'd'
 TYPE_STRING = 's'
 TYPE_BYTES = 'a'
+TYPE_VARLEN_STRING = 'S'
+TYPE_VARLEN_BYTES = 'A'
+
+# Variable length fields are stored as unsigned short length followed by value, so they can be up to 64KB long
+VARLEN_FIELD_MAX_SIZE = 65535
+FIELD_LENGTH_PREFIX = struct.Struct('<H')
+
+# Records of variable length streams are stored and retrieved with length in front of each record
+RECORD_LENGTH_PREFIX = struct.Struct('<I')
+
+# Chunked retrieve: each chunk is sequence number and flags followed by records
+RETRIEVE_CHUNK_HEADER = struct.Struct('<IB')
+RETRIEVE_CHUNK_LAST = 1
+RETRIEVE_CHUNK_ERROR = 2  # chunk carries error message (utf-8) instead of records; it is always last
 
 
 class TelemetryStreamField:
@@ -37,6 +52,9 @@ class TelemetryStreamField:
     def packFormat(self):
         return None
 
+    def numpyFormat(self):
+        return None
+
     def toJSON(self):
         return "\"type\" : \"" + self.field_type + "\""
 
@@ -64,6 +82,9 @@ class TelemetryStreamByteField(TelemetryStreamField):
     def packFormat(self):
         return 'b' if self.signed else 'B'
 
+    def numpyFormat(self):
+        return 'i1' if self.signed else 'u1'
+
     def toJSON(self):
         return super(TelemetryStreamByteField, self).toJSON() + ", \"signed\" : " + str(self.signed).lower()
 
@@ -91,6 +112,9 @@ class TelemetryStreamWordField(TelemetryStreamField):
     def packFormat(self):
         return 'h' if self.signed else 'H'
 
+    def numpyFormat(self):
+        return '<i2' if self.signed else '<u2'
+
     def toJSON(self):
         return super(TelemetryStreamWordField, self).toJSON() + ", \"signed\" : " + str(self.signed).lower()
 
@@ -118,6 +142,9 @@ class TelemetryStreamIntField(TelemetryStreamField):
     def packFormat(self):
         return 'i' if self.signed else 'I'
 
+    def numpyFormat(self):
+        return '<i4' if self.signed else '<u4'
+
     def toJSON(self):
         return super(TelemetryStreamIntField, self).toJSON() + ", \"signed\" : " + str(self.signed).lower()
 
@@ -145,6 +172,9 @@ class TelemetryStreamLongField(TelemetryStreamField):
     def packFormat(self):
         return 'q' if self.signed else 'Q'
 
+    def numpyFormat(self):
+        return '<i8' if self.signed else '<u8'
+
     def toJSON(self):
         return super(TelemetryStreamLongField, self).toJSON() + ", \"signed\" : " + str(self.signed).lower()
 
@@ -168,6 +198,9 @@ class TelemetryStreamFloatField(TelemetryStreamField):
     def packFormat(self):
         return 'f'
 
+    def numpyFormat(self):
+        return '<f4'
+
     def fromString(self, s):
         return float(s)
 
@@ -183,6 +216,9 @@ class TelemetryStreamDoubleField(TelemetryStreamField):
     def packFormat(self):
         return 'd'
 
+    def numpyFormat(self):
+        return '<f8'
+
     def fromString(self, s):
         return float(s)
 
@@ -198,6 +234,9 @@ class TelemetryStreamTimestampField(TelemetryStreamField):
     def packFormat(self):
         return 'd'
 
+    def numpyFormat(self):
+        return '<f8'
+
     def fromString(self, s):
         return float(s)
 
@@ -214,6 +253,9 @@ class TelemetryStreamStringField(TelemetryStreamField):
     def packFormat(self):
         return str(self.field_size) + 's'
 
+    def numpyFormat(self):
+        return 'S' + str(self.field_size)
+
     def toJSON(self):
         return super(TelemetryStreamStringField, self).toJSON() + ", \"size\" : " + str(self.field_size)
 
@@ -235,6 +277,9 @@ class TelemetryStreamBytesField(TelemetryStreamField):
     def packFormat(self):
         return str(self.field_size) + 'p'
 
+    def numpyFormat(self):
+        return 'V' + str(self.field_size)  # pascal string - first byte is length
+
     def toJSON(self):
         return super(TelemetryStreamBytesField, self).toJSON() + ", \"size\" : " + str(self.field_size)
 
@@ -244,18 +289,69 @@ class TelemetryStreamBytesField(TelemetryStreamField):
         return False
 
 
+class TelemetryStreamVarLenStringField(TelemetryStreamField):
+    def __init__(self, name, size):
+        super(TelemetryStreamVarLenStringField, self).__init__(name, TYPE_VARLEN_STRING, 0)
+        if size > VARLEN_FIELD_MAX_SIZE:
+            raise ValueError("Variable length field " + name + " cannot be longer than " + str(VARLEN_FIELD_MAX_SIZE) + " bytes")
+        self.max_size = size
+
+    def toBytes(self, value):
+        if isinstance(value, str):
+            value = bytes(value, 'utf-8')
+        return value[0:self.max_size]
+
+    def fromBytes(self, value):
+        return str(value, 'utf-8', 'replace')
+
+    def toJSON(self):
+        return super(TelemetryStreamVarLenStringField, self).toJSON() + ", \"size\" : " + str(self.max_size)
+
+    def __eq__(self, other):
+        if isinstance(other, TelemetryStreamVarLenStringField):
+            return super(TelemetryStreamVarLenStringField, self).__eq__(other) and self.max_size == other.max_size
+        return False
+
+
+class TelemetryStreamVarLenBytesField(TelemetryStreamField):
+    def __init__(self, name, size):
+        super(TelemetryStreamVarLenBytesField, self).__init__(name, TYPE_VARLEN_BYTES, 0)
+        if size > VARLEN_FIELD_MAX_SIZE:
+            raise ValueError("Variable length field " + name + " cannot be longer than " + str(VARLEN_FIELD_MAX_SIZE) + " bytes")
+        self.max_size = size
+
+    def toBytes(self, value):
+        return bytes(value[0:self.max_size])
+
+    def fromBytes(self, value):
+        return bytes(value)
+
+    def toJSON(self):
+        return super(TelemetryStreamVarLenBytesField, self).toJSON() + ", \"size\" : " + str(self.max_size)
+
+    def __eq__(self, other):
+        if isinstance(other, TelemetryStreamVarLenBytesField):
+            return super(TelemetryStreamVarLenBytesField, self).__eq__(other) and self.max_size == other.max_size
+        return False
+
+
 class TelemetryStreamDefinition:
 
     def __init__(self, name):
         self.name = name
         self.stream_id = 0  # Not defined yet
+        self.version = 1  # incremented by registry each time stream with the same name changes its fields
         self.buildCallback = None
         self.fields = []
         self.fixed_length = 0
+        self.fixed_fields_length = 0  # timestamp and fixed size fields only - same as fixed_length for fixed length streams
         self.pack_string = None
         self.header_byte = 0
         self.header_pack = None
         self.header = None
+        self.record_parts = None
+        self.numpy_dtype = None
+        self.storage = None
 
     def addByte(self, name, signed=False):
         self.fields.append(TelemetryStreamByteField(name, signed))
@@ -293,17 +389,21 @@ class TelemetryStreamDefinition:
         self.fields.append(TelemetryStreamBytesField(name, size))
         return self
 
+    # size is maximum size in bytes; longer values are cut off
     def addVarLenString(self, name, size):
-        raise NotImplemented("Not implemented yet")
+        self.fields.append(TelemetryStreamVarLenStringField(name, size))
+        return self
 
     def addVarLenBytes(self, name, size):
-        raise NotImplemented("Not implemented yet")
+        self.fields.append(TelemetryStreamVarLenBytesField(name, size))
+        return self
 
     def getFields(self):
         return self.fields
 
     def build(self, stream_id):
         self.stream_id = stream_id
+        self.numpy_dtype = None
         self.fixed_length = 0
         self.pack_string = ""
         for field in self.fields:
@@ -319,6 +419,24 @@ class TelemetryStreamDefinition:
         if self.pack_string is not None:
             self.pack_string = '<d' + self.pack_string
             self.fixed_length += 8
+            self.fixed_fields_length = self.fixed_length
+            self.record_parts = None
+        else:
+            # variable length record: runs of fixed fields are packed together, variable length
+            # fields are length prefixed values between them
+            self.record_parts = []
+            pack_string = 'd'
+            for field in self.fields:
+                if field.field_size > 0:
+                    pack_string += field.packFormat()
+                else:
+                    if pack_string != '':
+                        self.record_parts.append((struct.Struct('<' + pack_string), None))
+                        pack_string = ''
+                    self.record_parts.append((None, field))
+            if pack_string != '':
+                self.record_parts.append((struct.Struct('<' + pack_string), None))
+            self.fixed_fields_length = sum(part.size for part, _ in self.record_parts if part is not None)
 
         if self.buildCallback is not None:
             self.buildCallback(self)
@@ -331,39 +449,175 @@ class TelemetryStreamDefinition:
             self.header_byte = STREAM_ID_WORD
             self.header_pack += 'H'
 
-        if self.fixed_length < 256:
-            self.header_byte |= STREAM_SIZE_BYTE
-            self.header_pack += 'B'
-        elif self.fixed_length < 65536:
-            self.header_byte |= STREAM_SIZE_WORD
-            self.header_pack += 'H'
+        if self.fixed_length is None:
+            self.header = None  # size differs from record to record - see frameHeader
+        else:
+            self.header = self._header(self.fixed_length)
+
+    def _header(self, record_length):
+        if record_length < 256:
+            return struct.pack(self.header_pack + 'B', self.header_byte | STREAM_SIZE_BYTE, self.stream_id, record_length)
+        elif record_length < 65536:
+            return struct.pack(self.header_pack + 'H', self.header_byte | STREAM_SIZE_WORD, self.stream_id, record_length)
         else:
-            self.header_byte |= STREAM_SIZE_LONG
-            self.header_pack += 'I'
+            return struct.pack(self.header_pack + 'I', self.header_byte | STREAM_SIZE_LONG, self.stream_id, record_length)
+
+    # Header of fifo frame carrying given record
+    def frameHeader(self, record):
+        if self.header is not None:
+            return self.header
+        return self._header(len(record))
 
-        self.header = struct.pack(self.header_pack, self.header_byte, self.stream_id, self.fixed_length)
+    def packRecord(self, time_stamp, *args):
+        if self.pack_string is not None:
+            return struct.pack(self.pack_string, time_stamp, *args)
+
+        pack_string = '<d'
+        values = [time_stamp]
+        for field, value in zip(self.fields, args):
+            if field.field_size > 0:
+                pack_string += field.packFormat()
+                values.append(value)
+            else:
+                value = field.toBytes(value)
+                pack_string += 'H' + str(len(value)) + 's'
+                values.append(len(value))
+                values.append(value)
+
+        return struct.pack(pack_string, *values)
+
+    def unpackRecord(self, record):
+        if self.pack_string is not None:
+            return struct.unpack(self.pack_string, record)
+
+        values = []
+        p = 0
+        for part, field in self.record_parts:
+            if part is not None:
+                values.extend(part.unpack_from(record, p))
+                p += part.size
+            else:
+                length = FIELD_LENGTH_PREFIX.unpack_from(record, p)[0]
+                p += FIELD_LENGTH_PREFIX.size
+                values.append(field.fromBytes(record[p:p + length]))
+                p += length
+
+        return tuple(values)
+
+    # Splits retrieved payload to list of records (memoryviews). Records of fixed length streams are
+    # back to back, records of variable length streams have RECORD_LENGTH_PREFIX in front of each.
+    # Incomplete record at the end is ignored.
+    def splitRecords(self, payload):
+        view = memoryview(payload)
+        if self.fixed_length is not None:
+            record_length = self.fixed_length
+            return [view[p:p + record_length] for p in range(0, len(view) - record_length + 1, record_length)]
+
+        records = []
+        p = 0
+        end = len(view)
+        prefix_size = RECORD_LENGTH_PREFIX.size
+        while p + prefix_size <= end:
+            record_end = p + prefix_size + RECORD_LENGTH_PREFIX.unpack_from(view, p)[0]
+            if record_end > end:
+                break
+            records.append(view[p + prefix_size:record_end])
+            p = record_end
+        return records
+
+    # Splits retrieved payload of variable length stream to fixed size fields of each record (timestamp
+    # first, see fixedDtype) back to back and list with variable length fields of each record - values
+    # with their FIELD_LENGTH_PREFIX, back to back.
+    def splitVarLenRecords(self, payload):
+        fixed = []
+        varlen = []
+        for record in self.splitRecords(payload):
+            p = 0
+            fields = []
+            for part, field in self.record_parts:
+                if part is not None:
+                    fixed.append(record[p:p + part.size])
+                    p += part.size
+                else:
+                    end = p + FIELD_LENGTH_PREFIX.size + FIELD_LENGTH_PREFIX.unpack_from(record, p)[0]
+                    fields.append(record[p:end])
+                    p = end
+            varlen.append(b''.join(fields))
+        return b''.join(fixed), varlen
+
+    # Reverse of splitVarLenRecords: fixed size fields of records back to back and their variable length
+    # fields back to back (list from splitVarLenRecords joined) to records as they are retrieved
+    def joinVarLenRecords(self, fixed, varlen):
+        result = []
+        f = 0
+        v = 0
+        for i in range(len(fixed) // self.fixed_fields_length):
+            parts = []
+            for part, field in self.record_parts:
+                if part is not None:
+                    parts.append(fixed[f:f + part.size])
+                    f += part.size
+                else:
+                    end = v + FIELD_LENGTH_PREFIX.size + FIELD_LENGTH_PREFIX.unpack_from(varlen, v)[0]
+                    parts.append(varlen[v:end])
+                    v = end
+            record = b''.join(parts)
+            result.append(RECORD_LENGTH_PREFIX.pack(len(record)))
+            result.append(record)
+        return b''.join(result)
 
     def extractTimestamp(self, record):
         return struct.unpack('<d', record[0:8])[0]
 
-    def log(self, time_stamp, *args):
+    # numpy structured dtype matching fixed length record: 'timestamp' followed by fields.
+    # numpy is imported only here so telemetry works where numpy is not installed.
+    def numpyDtype(self):
         if self.fixed_length is None:
-            raise NotImplemented("Variable record size len is not yet implemented")
+            raise ValueError("Stream " + self.name + " has variable length records which cannot be mapped to numpy array")
+
+        return self.fixedDtype()
+
+    # numpy structured dtype of 'timestamp' followed by fixed size fields only - of records from
+    # splitVarLenRecords for variable length streams, same as numpyDtype for fixed length streams
+    def fixedDtype(self):
+        if self.numpy_dtype is None:
+            import numpy
+            self.numpy_dtype = numpy.dtype([('timestamp', '<f8')] + [(field.name, field.numpyFormat()) for field in self.fields if field.field_size > 0])
 
+        return self.numpy_dtype
+
+    # Unpacks all whole records in payload to list of tuples (timestamp, field values...)
+    def unpackRecords(self, payload):
+        if self.fixed_length is None:
+            return [self.unpackRecord(record) for record in self.splitRecords(payload)]
+
+        end = len(payload) - len(payload) % self.fixed_length
+        if end == 0:
+            return []
+        return list(struct.iter_unpack(self.pack_string, memoryview(payload)[:end]))
+
+    # Returns numpy structured array (see numpyDtype) over all whole records in payload without copying them.
+    # For variable length streams array is of fixed size fields only (see fixedDtype) and is a copy.
+    def recordsArray(self, payload):
+        import numpy
+
+        if self.fixed_length is None:
+            return numpy.frombuffer(self.splitVarLenRecords(payload)[0], dtype=self.fixedDtype())
+
+        return numpy.frombuffer(payload, dtype=self.numpyDtype(), count=len(payload) // self.fixed_length)
+
+    def log(self, time_stamp, *args):
         if self.storage is None:
             raise NotImplemented("Stream storage is not set")
 
-        record = struct.pack(self.pack_string, time_stamp, *args)
-        self.storage.store(self, self, time_stamp, record)
+        record = self.packRecord(time_stamp, *args)
+        self.storage.store(self, time_stamp, record)
 
     def rawRecord(self, *args):
-        if self.fixed_length is None:
-            raise NotImplemented("Variable record size len is not yet implemented")
-
         if self.storage is None:
             raise NotImplemented("Stream storage is not set")
 
-        return struct.pack(self.pack_string, *args)
+        return self.packRecord(*args)
 
     def retrieve(self, from_timestamp, to_timestmap):
         if self.storage is None:
@@ -383,8 +637,19 @@ class TelemetryStreamDefinition:
 
         return self.storage.getOldestTimestamp(self)
 
+    def _fieldsJSON(self):
+        return "\"fields\" : { " + ", ".join(["\"" + field.name + "\" : { " + field.toJSON() + " }" for field in self.fields]) + " }"
+
+    # Hash of name and fields (not id or version) - same for all processes defining the same stream
+    def schemaHash(self):
+        return hashlib.sha1(bytes("{ \"name\" : \"" + self.name + "\", " + self._fieldsJSON() + " }", 'utf-8')).hexdigest()[0:16]
+
+    # Name under which records are kept in storage - versions with different fields are kept apart
+    def storageName(self):
+        return self.name if self.version <= 1 else self.name + "@v" + str(self.version)
+
     def toJSON(self):
-        return "{ \"id\" : " + str(self.stream_id) + ", \"name\" : \"" + self.name + "\", \"fields\" : { " + ", ".join(["\"" + field.name + "\" : { " + field.toJSON() + " }" for field in self.fields]) + " } }"
+        return "{ \"id\" : " + str(self.stream_id) + ", \"version\" : " + str(self.version) + ", \"hash\" : \"" + self.schemaHash() + "\", \"name\" : \"" + self.name + "\", " + self._fieldsJSON() + " }"
 
 
 def streamFromJSON(json):
@@ -564,6 +829,7 @@ def streamFromJSON(json):
 
     stream = TelemetryStreamDefinition(top['name'])
     stream.stream_id = int(top['id'])
+    stream.version = int(top.get('version', 1))
     fields = top['fields']
     for fieldName in fields['_key_order']:
         field = fields[fieldName]
@@ -585,5 +851,9 @@ def streamFromJSON(json):
             stream.addFixedString(fieldName, field['size'])
         elif field['type'] == TYPE_BYTES:
             stream.addFixedBytes(fieldName, field['size'])
+        elif field['type'] == TYPE_VARLEN_STRING:
+            stream.addVarLenString(fieldName, field['size'])
+        elif field['type'] == TYPE_VARLEN_BYTES:
+            stream.addVarLenBytes(fieldName, field['size'])
 
     return stream
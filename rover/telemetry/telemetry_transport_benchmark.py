@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+
+#
+# Copyright 2019 Games Creators Club
+#
+# MIT License
+#
+
+#
+# Four processes logging as fast as they can through the named fifo (LocalPipeTelemetryLoggerDestination)
+# against shared memory rings (SharedMemoryTelemetryLoggerDestination), with reader storing frames as
+# telemetry server does. Shows cost of one log call in writers, records which got to storage, records
+# lost and how many of those writers knew about: ring counts records it dropped when it was full, while
+# write to full fifo fails silently (or writes part of the frame, breaking framing of what follows).
+#
+# Usage (from rover directory):
+#     python3 -m telemetry.telemetry_transport_benchmark
+#
+
+import multiprocessing
+import os
+import shutil
+import struct
+import tempfile
+import time
+
+from telemetry.telemetry_logger import LocalPipeTelemetryLoggerDestination, SharedMemoryTelemetryLoggerDestination
+from telemetry.telemetry_ring import TelemetryRingReader, RING_SUFFIX
+from telemetry.telemetry_server import TelemetryFrameParser
+from telemetry.telemetry_storage import MemoryTelemetryStorage
+from telemetry import telemetry_pipe_benchmark
+
+WRITERS = 4
+RECORDS = 100000  # per writer
+
+_TIMESTAMP = struct.Struct('<d')
+
+
+def writer(make_destination, stream_id, results):
+    stream = telemetry_pipe_benchmark.makeStreams()[stream_id]
+    destination = make_destination()
+    values = [stream_id] * 16 + [0.5, b'selection']
+    reported = 0
+    started = time.perf_counter()
+    for i in range(RECORDS):
+        try:
+            destination.log(stream, float(i), *values)
+        except (BlockingIOError, BrokenPipeError):
+            reported += 1
+    elapsed = time.perf_counter() - started
+    if isinstance(destination, SharedMemoryTelemetryLoggerDestination):
+        reported = destination.dropped()
+        destination.ring.close()
+    results.put((elapsed, reported))
+
+
+def store(parser, streams, storage):
+    batches = {}
+    for stream_id, record in parser.frames():
+        batches.setdefault(stream_id, []).append(record)
+
+    count = 0
+    for stream_id, records in batches.items():
+        stream = streams.get(stream_id)
+        if stream is not None:
+            storage.store_many(stream, [(_TIMESTAMP.unpack_from(record)[0], record) for record in records])
+            count += len(records)
+    return count
+
+
+def openFifo():
+    # reader end has to be open before writers open the fifo
+    return os.fdopen(os.open(FIFO, os.O_RDONLY | os.O_NONBLOCK), "rb", buffering=0)
+
+
+def readFifo(pipe, processes, streams, storage):
+    parser = TelemetryFrameParser()
+    count = 0
+    with pipe:
+        while True:
+            if parser.readFrom(pipe) > 0:
+                count += store(parser, streams, storage)
+            elif any([p.is_alive() for p in processes]):
+                time.sleep(0.001)
+            elif parser.readFrom(pipe) == 0:
+                break
+            else:
+                count += store(parser, streams, storage)
+    return count
+
+
+def openRings():
+    return RINGS
+
+
+def readRings(directory, processes, streams, storage):
+    readers = {}
+    parser = TelemetryFrameParser()
+    count = 0
+    while True:
+        for name in os.listdir(directory):
+            if name.endswith(RING_SUFFIX) and name not in readers:
+                readers[name] = TelemetryRingReader(os.path.join(directory, name))
+
+        idle = True
+        for reader in readers.values():
+            data = reader.read()
+            if len(data) > 0:
+                idle = False
+                parser.reset()
+                parser.feed(data)
+                count += store(parser, streams, storage)
+
+        if idle:
+            if not any([p.is_alive() for p in processes]) and len(readers) == WRITERS:
+                break
+            time.sleep(0.001)
+
+    for reader in readers.values():
+        reader.close()
+    return count
+
+
+def benchmark(name, make_destination, open_reader, read):
+    streams = telemetry_pipe_benchmark.makeStreams()
+    storage = MemoryTelemetryStorage(max_records=RECORDS)
+    results = multiprocessing.Queue()
+    processes = [multiprocessing.Process(target=writer, args=(make_destination, i + 1, results)) for i in range(WRITERS)]
+
+    reader = open_reader()
+    started = time.perf_counter()
+    for process in processes:
+        process.start()
+    received = read(reader, processes, streams, storage)
+    elapsed = time.perf_counter() - started
+    for process in processes:
+        process.join()
+
+    writes = [results.get() for _ in processes]
+    log_time = sum([w[0] for w in writes]) / (WRITERS * RECORDS)
+    reported = sum([w[1] for w in writes])
+    print("{0:<10} {1:>8.2f} {2:>10} {3:>10} {4:>10} {5:>12.0f}".format(name, log_time * 1000000, received, WRITERS * RECORDS - received, reported, received / elapsed))
+
+
+def fifoDestination():
+    return LocalPipeTelemetryLoggerDestination(FIFO)
+
+
+def ringDestination():
+    return SharedMemoryTelemetryLoggerDestination(RINGS)
+
+
+if __name__ == "__main__":
+    directory = tempfile.mkdtemp()
+    FIFO = os.path.join(directory, "telemetry-fifo")
+    RINGS = os.path.join(directory, "rings")
+    os.mkfifo(FIFO)
+    os.makedirs(RINGS)
+    try:
+        print(str(WRITERS) + " writers, " + str(RECORDS) + " records each")
+        print("{0:<10} {1:>8} {2:>10} {3:>10} {4:>10} {5:>12}".format("transport", "us/log", "received", "lost", "reported", "records/s"))
+        benchmark("fifo", fifoDestination, openFifo, readFifo)
+        benchmark("ring", ringDestination, openRings, readRings)
+    finally:
+        shutil.rmtree(directory)
@@ -9,6 +9,7 @@ import os
 import pygame
 import pyroslib
 import roverscreencomponents
+import statuslib
 import time
 from functools import partial
 from pygame import Rect
@@ -18,8 +19,8 @@ received = False
 
 RADAR_ANGLES = [0, 45, 90, 135, 180, 225, 270, 315]
 
-_radar = {0: 0, 45: 0, 90: 0, 135: 0, 180: 0, 225: 0, 270: 0, 315: 0, 'status': '', 'timestamp': 0.0}
-_last_radar = {0: 0, 45: 0, 90: 0, 135: 0, 180: 0, 225: 0, 270: 0, 315: 0, 'status': '', 'timestamp': 0.0}
+_radar = {0: 0, 45: 0, 90: 0, 135: 0, 180: 0, 225: 0, 270: 0, 315: 0, 'timestamp': 0.0}
+_last_radar = {0: 0, 45: 0, 90: 0, 135: 0, 180: 0, 225: 0, 270: 0, 315: 0, 'timestamp': 0.0}
 _radar_status = {0: 0, 45: 0, 90: 0, 135: 0, 180: 0, 225: 0, 270: 0, 315: 0}
 
 angle = 0.0
@@ -121,82 +122,48 @@ def initGui():
 def handleWheelPositions(topic, message, groups):
     global received  # , angle
 
-    def updateWheel(wheelName, _values, index):
-        wheel = _wheelsMap[wheelName]
-        odoStr = _values[index]
-        statusStr = _values[index + 1]
-        wheel['speed_status'] = int(statusStr)
-        if statusStr == "0":
-            wheel['odo'] = int(odoStr)
-
     received = True
 
-    values = message.split(",")
-    updateWheel('fl', values, 1)
-    updateWheel('fr', values, 3)
-    updateWheel('bl', values, 5)
-    updateWheel('br', values, 7)
+    _, odos, statuses = statuslib.decodeWheelStatus(message)
+    for wheelName in statuslib.WHEEL_NAMES:
+        wheel = _wheelsMap[wheelName]
+        wheel['speed_status'] = statuses[wheelName]
+        if statuses[wheelName] == 0 and odos[wheelName] is not None:
+            wheel['odo'] = odos[wheelName]
 
 
 def handleDistances(topic, message, groups):
     global received  # , angle
 
-    def convertValue(k, v):
-        if k == 'timestamp':
-            return float(v)
-        elif k == 'status':
-            return str(v)
-        else:
-            return int(v)
-
-    def convertKey(k):
-        if k == 'timestamp':
-            return k
-        elif k == 'status':
-            return k
-        else:
-            return int(k)
-
-    values = {convertKey(v[0]): convertValue(v[0], v[1]) for v in [v.split(":") for v in message.split(" ")]}
+    timestamp, distances, statuses = statuslib.decodeRadar(message)
 
     for k, v in _radar.items():
         _last_radar[k] = v
 
-    for a in values:
-        _radar[a] = values[a]
+    for a in distances:
+        _radar[a] = distances[a]
+    _radar['timestamp'] = timestamp
 
-    status_str = _radar['status']
-    del _radar['status']
-    i = 0
-    # print("Received status: " + str(status_str))
-    for angle in RADAR_ANGLES:
-        _radar_status[angle] = int(status_str[i:i+2], 16)
-        i += 2
+    for a in statuses:
+        _radar_status[a] = statuses[a]
 
 
 def handleWheelOrientations(topic, message, groups):
     global received  # , angle
 
-    def updateWheel(wheelName, _values, index):
+    received = True
+    # print("** wheel positions = " + str(message))
+
+    _, angles, statuses = statuslib.decodeWheelStatus(message)
+    for wheelName in statuslib.WHEEL_NAMES:
         wheel = _wheelsMap[wheelName]
-        angleStr = _values[index]
-        statusStr = _values[index + 1]
-        wheel['deg_status'] = int(statusStr)
-        if angleStr != '-':
-            _angle = int(angleStr)
+        wheel['deg_status'] = statuses[wheelName]
+        _angle = angles[wheelName]
+        if _angle is not None:
             wheel['angle'] = _angle
             if 'wanted' not in wheel or screensComponent.selectedCardName == 'calibrateWheel':
                 wheel['wanted'] = _angle
 
-    received = True
-    # print("** wheel positions = " + message)
-
-    values = message.split(",")
-    updateWheel('fl', values, 1)
-    updateWheel('fr', values, 3)
-    updateWheel('bl', values, 5)
-    updateWheel('br', values, 7)
-
 
 def handleStorageWrite(topic, message, groups):
     topics = topic[len("storage/write/wheels/cal/"):].split('/')
@@ -510,13 +477,13 @@ class WheelsScreen(ScreenComponent):
 
     def enter(self):
         super(WheelsScreen, self).enter()
-        pyroslib.subscribe("wheel/deg/status", handleWheelOrientations)
-        pyroslib.subscribe("wheel/speed/status", handleWheelPositions)
+        statuslib.subscribe(statuslib.WHEEL_DEG_TOPIC, handleWheelOrientations)
+        statuslib.subscribe(statuslib.WHEEL_SPEED_TOPIC, handleWheelPositions)
 
     def leave(self):
         super(WheelsScreen, self).enter()
-        pyroslib.unsubscribe("wheel/deg/status")
-        pyroslib.unsubscribe("wheel/speed/status")
+        statuslib.unsubscribe(statuslib.WHEEL_DEG_TOPIC)
+        statuslib.unsubscribe(statuslib.WHEEL_SPEED_TOPIC)
 
 
 class MenuScreen(ScreenComponent):
@@ -719,15 +686,15 @@ class CalibrateWheelScreen(ScreenComponent):
 
     def enter(self):
         super(CalibrateWheelScreen, self).enter()
-        pyroslib.subscribe("wheel/deg/status", handleWheelOrientations)
-        pyroslib.subscribe("wheel/speed/status", handleWheelPositions)
+        statuslib.subscribe(statuslib.WHEEL_DEG_TOPIC, handleWheelOrientations)
+        statuslib.subscribe(statuslib.WHEEL_SPEED_TOPIC, handleWheelPositions)
         self.card.selectCard('select')
         pyroslib.publish("storage/read/wheels/cal", "")
 
     def leave(self):
         super(CalibrateWheelScreen, self).leave()
-        pyroslib.unsubscribe("wheel/deg/status")
-        pyroslib.unsubscribe("wheel/speed/status")
+        statuslib.unsubscribe(statuslib.WHEEL_DEG_TOPIC)
+        statuslib.unsubscribe(statuslib.WHEEL_SPEED_TOPIC)
 
     def setSelectedWheelName(self, selected_wheel_name):
         self.selected_wheel_name = selected_wheel_name
@@ -987,12 +954,12 @@ class RadarScreen(ScreenComponent):
 
     def enter(self):
         super(RadarScreen, self).enter()
-        pyroslib.subscribe("sensor/distance", handleDistances)
+        statuslib.subscribe(statuslib.RADAR_TOPIC, handleDistances)
         pyroslib.publish("sensor/distance/resume", "")
 
     def leave(self):
         super(RadarScreen, self).leave()
-        pyroslib.unsubscribe("distance/deg")
+        statuslib.unsubscribe(statuslib.RADAR_TOPIC)
         pyroslib.publish("sensor/distance/pause", "")
 
 
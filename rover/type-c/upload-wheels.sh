@@ -7,6 +7,7 @@ echo "Uploading all for wheels:"
 
 $DIR/../pyroslib/upload-pyroslib.sh $1 "wheels"
 $DIR/../storagelib/upload-storagelib.sh $1 "wheels"
+$DIR/../statuslib/upload-statuslib.sh $1 "wheels"
 
 echo ""
 echo Uploading     wheels:shutdown
@@ -12,6 +12,7 @@ import copy
 import nRF2401
 import pyroslib
 import smbus
+import statuslib
 import storagelib
 import telemetry
 import time
@@ -76,6 +77,9 @@ last_time = 0
 
 i2cBus = smbus.SMBus(I2C_BUS)
 
+speed_status_publisher = statuslib.publisher(statuslib.WHEEL_SPEED_TOPIC)
+deg_status_publisher = statuslib.publisher(statuslib.WHEEL_DEG_TOPIC)
+
 shutdown = False
 all_stop = False
 
@@ -117,6 +121,7 @@ PROTOTYPE_PID_CALIBRATION = {
 
 wheelMap = {}
 wheelCalibrationMap = {}
+pidCalibration = {}  # storagelib.StorageValue of each PID calibration value
 wheelMap["servos"] = {}
 WHEEL_NAMES = ['fl', 'fr', 'bl', 'br']
 
@@ -266,11 +271,11 @@ def init_wheels():
 
 def init_all_wheels_pid():
     global kp, ki, kd, kg, deadband
-    kp = float(wheelCalibrationMap['pid']['p'])
-    ki = float(wheelCalibrationMap['pid']['i'])
-    kd = float(wheelCalibrationMap['pid']['d'])
-    kg = float(wheelCalibrationMap['pid']['g'])
-    deadband = int(float(wheelCalibrationMap['pid']['deadband']))
+    kp = pidCalibration['p'].value
+    ki = pidCalibration['i'].value
+    kd = pidCalibration['d'].value
+    kg = pidCalibration['g'].value
+    deadband = int(pidCalibration['deadband'].value)
 
     for wheel_name in WHEEL_NAMES:
         pid = wheelMap[wheel_name]['pid']
@@ -281,13 +286,23 @@ def init_all_wheels_pid():
         pid.dead_band = deadband
 
 
-def check_pids_changed():
-    if kp != float(wheelCalibrationMap['pid']['p']) or \
-            ki != float(wheelCalibrationMap['pid']['i']) or \
-            kd != float(wheelCalibrationMap['pid']['d']) or \
-            kg != float(wheelCalibrationMap['pid']['g']) or \
-            deadband != float(wheelCalibrationMap['pid']['deadband']):
-        init_all_wheels_pid()
+# Calibration values used in each cycle are parsed once, when they arrive, instead of in every cycle
+def bind_wheel_calibration(wheel_name):
+    wheel = wheelMap[wheel_name]
+    path = "wheels/cal/" + wheel_name
+    wheel['deg_dir'] = storagelib.bind(path + "/deg/dir", int, 1)
+    wheel['deg_0'] = storagelib.bind(path + "/deg/0", int, 0)
+    wheel['deg_i2c'] = storagelib.bind(path + "/deg/i2c", int, 0)
+    wheel['steer_dir'] = storagelib.bind(path + "/steer/dir", int, -1)
+    wheel['steer_en_pin'] = storagelib.bind(path + "/steer/en_pin", int, 0)
+    wheel['speed_dir'] = storagelib.bind(path + "/speed/dir", int, 1)
+
+
+def bind_pid_calibration():
+    for name in PROTOTYPE_PID_CALIBRATION:
+        value = storagelib.bind("wheels/cal/pid/" + name, float, float(PROTOTYPE_PID_CALIBRATION[name]))
+        value.onChange(lambda v: init_all_wheels_pid())
+        pidCalibration[name] = value
 
 
 def subscribe_wheels():
@@ -351,6 +366,8 @@ def load_storage():
 
     for wheel_name in WHEEL_NAMES:
         setup_wheel_with_calibration(wheel_name)
+        bind_wheel_calibration(wheel_name)
+    bind_pid_calibration()
     print("  Storage details loaded.")
 
 
@@ -392,7 +409,10 @@ def handle_speed(wheel, speed_string: str):
         wheel_name = wheel['name']
         print("    got speed " + speed_string + " @ for " + str(wheel_name))
 
-    wheel['speed'] = speed_string
+    try:
+        wheel['speed'] = int(float(speed_string))
+    except ValueError:
+        wheel['speed'] = None
 
 
 def steer_wheel(wheel_name: str, current_degrees, status):
@@ -413,8 +433,8 @@ def steer_wheel(wheel_name: str, current_degrees, status):
 
     wheel = wheelMap[wheel_name]
     calibration_steer = wheelCalibrationMap[wheel_name]['steer']
-    en_pin = int(calibration_steer['en_pin'])
-    steer_direction = int(calibration_steer['dir'])
+    en_pin = wheel['steer_en_pin'].value
+    steer_direction = wheel['steer_dir'].value
     motor_pwm = calibration_steer['pwm']
 
     deg = int(wheel['deg'])
@@ -489,7 +509,7 @@ def steer_wheel(wheel_name: str, current_degrees, status):
 
 
 def read_position(wheel_name: str):
-    i2c_address = int(wheelCalibrationMap[wheel_name]['deg']["i2c"])
+    i2c_address = wheelMap[wheel_name]['deg_i2c'].value
     try:
         i2cBus.write_byte(I2C_MULTIPLEXER_ADDRESS, i2c_address)
         try:
@@ -520,22 +540,22 @@ def prepare_and_steer_wheel(wheel_name: str):
     if DBEUG_ERRORS and status & 24 != 0:
         print(wheel_name + ": position (raw) " + str(angle) + " " + ("MH" if status & 8 else "  ") + " " + ("ML" if status & 16 else "  ") + " " + ("MD" if status & 32 else "  "))
 
-    degree_calibration = wheelCalibrationMap[wheel_name]['deg']
-    pos_dir = int(degree_calibration['dir'])
+    wheel = wheelMap[wheel_name]
+    pos_dir = wheel['deg_dir'].value
     if pos_dir < 0:
         angle = 360 - angle
 
     if status == 1:
         return 0, status
 
-    calibration_offset = int(degree_calibration['0'])
+    calibration_offset = wheel['deg_0'].value
     angle -= calibration_offset
     if angle < 0:
         angle += 360
 
     steer_wheel(wheel_name, angle, status)
 
-    if 'overheat' in wheelMap[wheel_name]:
+    if 'overheat' in wheel:
         status |= STATUS_ERROR_MOTOR_OVERHEAT
 
     return angle, status
@@ -556,22 +576,18 @@ def prepare_and_drive_wheel(wheel_name: str):
     wheel_speed_cal_map = wheelCalibrationMap[wheel_name]['speed']
 
     address = wheel_speed_cal_map['nrf']
-    speed_dir_str = wheel_speed_cal_map['dir']
+    speed_dir = wheel['speed_dir'].value
 
     started_time = time.time()
     nRF2401.setReadPipeAddress(0, address)
     nRF2401.setWritePipeAddress(address)
 
     if all_stop:
-        speed_str = 0
-    else:
-        speed_str = wheel['speed']
-    speed_mod_str = wheel['s_mod']
-
-    try:
-        speed = int(float(speed_str)) * int(speed_mod_str) * int(speed_dir_str)
-    except:
+        speed = 0
+    elif wheel['speed'] is None:
         speed = None
+    else:
+        speed = wheel['speed'] * wheel['s_mod'] * speed_dir
 
     if speed is not None:
         update_current(abs(speed))
@@ -630,23 +646,19 @@ def drive_wheels():
         odo_bl, status_speed_bl = prepare_and_drive_wheel("bl")
         odo_br, status_speed_br = prepare_and_drive_wheel("br")
 
-        message = ",".join([str(f) for f in [time.time(), odo_fl, status_speed_fl, odo_fr, status_speed_fr, odo_bl, status_speed_bl, odo_br, status_speed_br]])
-        pyroslib.publish("wheel/speed/status", message)
+        speed_status_publisher.publish(time.time(), [odo_fl, odo_fr, odo_bl, odo_br], [status_speed_fl, status_speed_fr, status_speed_bl, status_speed_br])
 
 
 def steer_wheels():
     global last_status_broadcast
 
     if not shutdown:
-        check_pids_changed()
-
         angle_fl, status_steer_fl = prepare_and_steer_wheel("fl")
         angle_fr, status_steer_fr = prepare_and_steer_wheel("fr")
         angle_bl, status_steer_bl = prepare_and_steer_wheel("bl")
         angle_br, status_steer_br = prepare_and_steer_wheel("br")
 
-        message = ",".join([str(f) for f in [time.time(), angle_fl, status_steer_fl, angle_fr, status_steer_fr, angle_bl, status_steer_bl, angle_br, status_steer_br]])
-        pyroslib.publish("wheel/deg/status", message)
+        deg_status_publisher.publish(time.time(), [angle_fl, angle_fr, angle_bl, angle_br], [status_steer_fl, status_steer_fr, status_steer_bl, status_steer_br])
 
         now = time.time()
         if last_status_broadcast + status_broadcast_time < now:
@@ -791,6 +803,7 @@ if __name__ == "__main__":
         pyroslib.subscribe("wheel/+/speed", wheel_speed_topic)
         pyroslib.subscribe("shutdown/announce", handle_shutdown_announced)
         pyroslib.init("wheels-service", onStop=stop_callback)
+        statuslib.queryConsumers()
 
         print("  Loading storage details...")
         load_storage()
@@ -49,6 +49,7 @@ echo "Uploading all for wheels:"
 $DIR/upload-telemetry-wheels.sh $1
 $DIR//upload-wheels.sh $1
 $DIR/pyroslib/upload-pyroslib.sh $1
+$DIR/statuslib/upload-statuslib.sh $1
 
 echo ""
 echo "Currently running processes:"
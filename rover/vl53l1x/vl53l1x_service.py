@@ -11,6 +11,7 @@ import RPi.GPIO as GPIO
 import os
 import pyroslib
 import smbus
+import statuslib
 import time
 import traceback
 
@@ -72,8 +73,10 @@ sensorsMap = {
     315: {'bus': 2, 'i2c': I2C_VL53L1X_ADDRESS_2, 'name': 'forward_right wn', 'adjust': 121, 'vl53l1x': None}
 }
 
-_angle_to_status_position = {0: 0, 45: 1, 90: 2, 135: 3, 180: 4, 225: 5, 270: 6, 315: 7}
-radar = {0: 0, 45: 0, 90: 0, 135: 0, 180: 0, 225: 0, 270: 0, 315: 0, 'timestamp': 0.0, 'status': '0000000000000000'}
+radar = {0: 0, 45: 0, 90: 0, 135: 0, 180: 0, 225: 0, 270: 0, 315: 0}
+radar_status = {0: 0, 45: 0, 90: 0, 135: 0, 180: 0, 225: 0, 270: 0, 315: 0}
+
+radar_publisher = statuslib.publisher(statuslib.RADAR_TOPIC)
 
 paused = True
 
@@ -98,15 +101,7 @@ def readSensor(angle):
         if status_value == -1 or status_value == 255:
             i2c_error_detected = True
 
-        index = _angle_to_status_position[sensor_angle] * 2
-        status_str = hex(status_value)[2:]
-        if len(status_str) < 2:
-            status_str = "0" + status_str
-
-        old_status_str = radar['status']
-        old_status_str = old_status_str[:index] + status_str + old_status_str[index + 2:]
-        # print("Replaced status old=" + radar['status'] + " new=" + old_status_str + " index=" + str(index))
-        radar['status'] = old_status_str
+        radar_status[sensor_angle] = status_value & 0xFF
 
     def adjustDistance(angle):
         if int(angle) % 90 == 0:
@@ -162,9 +157,7 @@ def readAllSensors():
             if angle not in sensors:
                 radar[angle] = 1
 
-        radar['timestamp'] = time.time()
-
-        pyroslib.publish("sensor/distance", " ".join([":".join([str(v) for v in kv]) for kv in radar.items()]))
+        radar_publisher.publish(time.time(), radar, radar_status)
 
         if i2c_error_detected:
             initDistanceSensors()
@@ -310,6 +303,7 @@ if __name__ == "__main__":
 
         print("    sbscribing to topics...")
         pyroslib.init("vl53l1x-service", unique=True)
+        statuslib.queryConsumers()
 
         print("  Loading storage details...")
 